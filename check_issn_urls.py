@@ -9,6 +9,13 @@ Takes a tsv filepath or lines on stdin and dumps to stdout. The stdin thing mean
     # times.
     parallel -j10 --bar --pipepart -a urls_to_crawl.shuf.tsv ./check_issn_urls.py > url_status.json
 
+Or, with --async, check many URLs concurrently from a single process (needs
+the aiohttp package). Connections are pooled and kept alive, at most
+--per-host connections are open to any one journal host at a time, and at most
+--cdx-concurrency requests are made to the wayback CDX API at once:
+
+    ./check_issn_urls.py --async --concurrency 2000 urls_to_crawl.shuf.tsv > url_status.json
+
 Input columns (no header):
 
     ISSN-L, URL
@@ -33,8 +40,21 @@ HTTP status will be -1 if domain does not even resolve.
 import sys
 import json
 import time
+import asyncio
+import argparse
+from typing import NamedTuple, TextIO
+
 import requests
 
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None  # type: ignore
+
+CDX_API_URL = "https://web.archive.org/cdx/search/cdx"
+
+USER_AGENT = "ia_bot/0.0 (python requests) journal-live-check; contact:info@archive.org"
+
 
 def sniff_platform(resp):
     """
@@ -98,7 +118,7 @@ def check_gwb(url, match_type="exact"):
     for i in range(2):
         try:
             resp = requests.get(
-                "https://web.archive.org/cdx/search/cdx",
+                CDX_API_URL,
                 params={
                     "url": url,
                     "matchType": match_type,
@@ -142,30 +162,34 @@ HOST_SKIP_LIST = [
 ]
 
 
+def url_skip_error(url):
+    """
+    Returns an error string if the URL should not be fetched at all.
+    """
+    if "://" not in url:
+        return "bad-url"
+    if not url.startswith("http"):
+        return "url-not-http"
+    for host in HOST_SKIP_LIST:
+        if f"://{host}/" in url:
+            return "skip-host"
+    return None
+
+
 def check_url(issnl, url):
     # print("Fetching: %s" % url)
     info = dict(issnl=issnl, url=url)
-    if "://" not in url:
-        info["error"] = "bad-url"
+    error = url_skip_error(url)
+    if error:
+        info["error"] = error
         info["terminal_status_code"] = -1
         return info
-    if not url.startswith("http"):
-        info["error"] = "url-not-http"
-        info["terminal_status_code"] = -1
-        return info
-    for host in HOST_SKIP_LIST:
-        if f"://{host}/" in url:
-            info["error"] = "skip-host"
-            info["terminal_status_code"] = -1
-            return info
 
     try:
         resp = requests.get(
             url,
             timeout=(5.0, 5.0),
-            headers={
-                "User-Agent": "ia_bot/0.0 (python requests) journal-live-check; contact:info@archive.org"
-            },
+            headers={"User-Agent": USER_AGENT},
         )
     except requests.exceptions.TooManyRedirects:
         info["error"] = "TooManyRedirects"
@@ -235,6 +259,126 @@ def check_url(issnl, url):
     return info
 
 
+class AsyncResponse(NamedTuple):
+    """
+    The parts of an aiohttp response that the sniff_*() helpers look at, with
+    the same names as on a requests response.
+    """
+
+    url: str
+    status_code: int
+    text: str
+
+
+async def check_gwb_async(session, url, match_type="exact"):
+    """
+    Like check_gwb(), using an aiohttp session. Retries once (after a short
+    pause) if the CDX API returns anything other than a 200 or 404.
+    """
+    if "//web.archive.org/" in url:
+        return None
+    params = {
+        "url": url,
+        "matchType": match_type,
+        "limit": "-1",
+        "filter": "statuscode:200",
+    }
+    for i in range(2):
+        try:
+            async with session.get(CDX_API_URL, params=params) as resp:
+                status_code = resp.status
+                text = await resp.text(errors="replace")
+        except Exception:
+            # nasty blanket catch
+            return None
+        if status_code in (200, 404):
+            break
+        await asyncio.sleep(0.1)
+    if not status_code == 200:
+        sys.stderr.write("CDX ERR {}: {}\n".format(status_code, url))
+        return None
+    line = text.strip().split("\n")[0]
+    if line:
+        try:
+            dt = line.split()[1]
+            int(dt)
+        except (IndexError, ValueError):
+            # a malformed reply shouldn't take down the calling worker task
+            sys.stderr.write("CDX BAD LINE {!r}: {}\n".format(line[:200], url))
+            return None
+        return dt
+    else:
+        return None
+
+
+async def check_url_async(session, issnl, url, cdx_session=None):
+    """
+    Like check_url(), using an aiohttp session. Returns the same fields, with
+    aiohttp exceptions mapped to the corresponding requests error strings.
+
+    CDX API lookups go through cdx_session, if given.
+    """
+    info = dict(issnl=issnl, url=url)
+    error = url_skip_error(url)
+    if error:
+        info["error"] = error
+        info["terminal_status_code"] = -1
+        return info
+
+    try:
+        async with session.get(url, max_redirects=30) as resp:
+            text = await resp.text(errors="replace")
+    except aiohttp.TooManyRedirects:
+        error = "TooManyRedirects"
+    except aiohttp.ClientSSLError:
+        error = "SSLError"
+    except aiohttp.NonHttpUrlRedirectClientError:
+        error = "InvalidSchema"
+    except aiohttp.ConnectionTimeoutError:
+        # requests raises ConnectionError for connect timeouts
+        error = "ConnectionError"
+    except (aiohttp.ServerTimeoutError, asyncio.TimeoutError):
+        error = "ReadTimeout"
+    except aiohttp.ClientPayloadError:
+        error = "ChunkedEncodingError"
+    except aiohttp.InvalidURL:
+        error = "ProtocolError"
+    except ConnectionResetError:
+        error = "ConnectionResetError"
+    except aiohttp.ClientConnectionError:
+        error = "ConnectionError"
+    except Exception as e:
+        # nasty blanket catch
+        print(e, file=sys.stderr)
+        error = "other"
+    if error:
+        info["error"] = error
+        info["terminal_status_code"] = info["status_code"] = -1
+        return info
+
+    if resp.history:
+        info["status_code"] = resp.history[0].status
+    else:
+        info["status_code"] = resp.status
+
+    info["terminal_status_code"] = resp.status
+    info["terminal_url"] = str(resp.url)
+    content_type = resp.headers.get("Content-Type")
+    if content_type:
+        info["terminal_content_type"] = content_type.split(";")[0]
+    info["issnl_in_body"] = bool(issnl in text)
+    info["gwb_url_success_dt"], info["gwb_terminal_url_success_dt"] = (
+        await asyncio.gather(
+            check_gwb_async(cdx_session or session, url),
+            check_gwb_async(cdx_session or session, info["terminal_url"]),
+        )
+    )
+    page = AsyncResponse(url=info["terminal_url"], status_code=resp.status, text=text)
+    info["blocked"] = sniff_blocked(page)
+    info["software_platform"] = sniff_platform(page)
+    return info
+
+
 def run(tsvfile):
     for line in tsvfile:
         records = line.split("\t")
@@ -243,9 +387,100 @@ def run(tsvfile):
         print(json.dumps(check_url(issnl, url)))
 
 
+async def run_async(
+    tsvfile, out=sys.stdout, concurrency=1000, per_host=4, cdx_concurrency=10
+):
+    """
+    Checks URLs from tsvfile with up to `concurrency` in flight at once, and
+    at most `per_host` open connections to any single host. Output records are
+    written to `out` in completion order, not input order.
+    """
+    if aiohttp is None:
+        raise RuntimeError("the aiohttp package is required for async checking")
+    queue: asyncio.Queue = asyncio.Queue(maxsize=2 * concurrency)
+
+    async def worker(session, cdx_session):
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            info = await check_url_async(session, *item, cdx_session=cdx_session)
+            out.write(json.dumps(info) + "\n")
+
+    # no overall connect timeout: waiting for a free connection to a busy host
+    # is not an error
+    timeout = aiohttp.ClientTimeout(total=None, sock_connect=5.0, sock_read=5.0)
+    headers = {"User-Agent": USER_AGENT}
+    async with aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=concurrency, limit_per_host=per_host),
+        timeout=timeout,
+        headers=headers,
+    ) as session, aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=cdx_concurrency),
+        timeout=timeout,
+        headers=headers,
+    ) as cdx_session:
+        workers = [
+            asyncio.create_task(worker(session, cdx_session))
+            for _ in range(concurrency)
+        ]
+        for line in tsvfile:
+            records = line.split("\t")
+            issnl = records[0]
+            url = records[1].strip()
+            await queue.put((issnl, url))
+        for _ in workers:
+            await queue.put(None)
+        await asyncio.gather(*workers)
+
+
 if __name__ == "__main__":
-    if len(sys.argv) != 2:
+    parser = argparse.ArgumentParser(
+        description="Check journal homepage status (live web and wayback)"
+    )
+    parser.add_argument(
+        "tsv_file",
+        nargs="?",
+        help="ISSN-L and URL per line (default: stdin)",
+    )
+    parser.add_argument(
+        "--async",
+        dest="run_async",
+        action="store_true",
+        help="check URLs concurrently with asyncio (requires aiohttp)",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=1000,
+        help="max URLs in flight at once with --async",
+    )
+    parser.add_argument(
+        "--per-host",
+        type=int,
+        default=4,
+        help="max open connections to a single host with --async",
+    )
+    parser.add_argument(
+        "--cdx-concurrency",
+        type=int,
+        default=10,
+        help="max wayback CDX API requests in flight at once with --async",
+    )
+    args = parser.parse_args()
+    f: TextIO
+    if args.tsv_file:
+        f = open(args.tsv_file, "r")
+    else:
         f = sys.stdin
+    if args.run_async:
+        asyncio.run(
+            run_async(
+                f,
+                concurrency=args.concurrency,
+                per_host=args.per_host,
+                cdx_concurrency=args.cdx_concurrency,
+            )
+        )
     else:
-        f = open(sys.argv[1], "r")
-    run(f)
+        run(f)
@@ -11,12 +11,14 @@ Count Chocula - online serials metadata and stats
 
 Commands:
 
-    everything
+    everything [--workers N]
     init_db
-    summarize
+    summarize [--workers N] [--incremental]
     export
     export_fatcat
     export_urls
+    fix_issnl
+    issnl_cache [--verify]
 
     directory <source>
         doaj
@@ -57,24 +59,62 @@ from chocula import (
     ALL_CHOCULA_DIR_CLASSES,
     ALL_CHOCULA_KBART_CLASSES,
 )
+from chocula.common import index_directories_parallel, HathifilesLoader
+from chocula.database import open_url_cache, close_url_cache
+from chocula.issn_index import build_cache, cache_path_for, verify_cache
 
 
-def run_everything(config, database):
+def changed_sources(database, loaders):
+    """
+    Returns the loaders whose source files changed since 'everything' last
+    loaded them. For the others, the counts from that load are printed.
+    """
+    changed = []
+    for loader in loaders:
+        if database.source_changed(loader.source_slug, loader.source_paths()):
+            changed.append(loader)
+        else:
+            print(f"##### Skipping {loader.source_slug} (unchanged)", file=sys.stderr)
+            print(database.source_counts(loader.source_slug))
+    return changed
+
+
+def run_everything(config, database, workers: int = 1):
 
     database.init_db()
-    for cls in ALL_CHOCULA_DIR_CLASSES:
-        loader = cls(config)
-        counts = loader.index_file(database)
-        print(counts)
-    for cls in ALL_CHOCULA_KBART_CLASSES:
-        loader = cls(config)
-        counts = loader.index_file(database)
+    loaders = changed_sources(
+        database, [cls(config) for cls in ALL_CHOCULA_DIR_CLASSES]
+    )
+    if workers > 1:
+        paths = {loader.source_slug: loader.source_paths() for loader in loaders}
+        for slug, counts in index_directories_parallel(
+            [type(loader) for loader in loaders],
+            config,
+            database,
+            workers,
+            replace=True,
+        ):
+            database.record_source(slug, paths[slug], counts)
+            print(counts)
+    else:
+        for loader in loaders:
+            counts = loader.index_file(database, replace=True)
+            database.record_source(loader.source_slug, loader.source_paths(), counts)
+            print(counts)
+    for loader in changed_sources(
+        database, [cls(config) for cls in ALL_CHOCULA_KBART_CLASSES]
+    ):
+        if isinstance(loader, HathifilesLoader):
+            counts = loader.index_file(database, workers=workers, replace=True)
+        else:
+            counts = loader.index_file(database, replace=True)
+        database.record_source(loader.source_slug, loader.source_paths(), counts)
         print(counts)
 
-    database.load_fatcat_containers(config)
+    database.load_fatcat_containers(config, workers=workers)
     database.load_fatcat_stats(config)
     database.load_homepage_status(config)
-    database.summarize()
+    database.summarize(workers=workers)
     print("### Done with everything!")
 
 
@@ -109,6 +149,24 @@ def run_load(config, database, source):
         raise NotImplementedError(f"unknown source: {source}")
 
 
+def run_issnl_cache(config, cache_dir: Optional[str], verify: bool) -> int:
+    if not cache_dir:
+        print("issnl_cache requires --issnl-cache-dir", file=sys.stderr)
+        return 1
+    issn_map_path = config.issnl.filepath
+    if verify:
+        problem = verify_cache(issn_map_path, cache_dir)
+        if problem:
+            print(f"ISSN-L index cache is not valid: {problem}", file=sys.stderr)
+            return 1
+        print("ISSN-L index cache is valid", file=sys.stderr)
+        return 0
+    index = build_cache(issn_map_path, cache_dir)
+    cache_path = cache_path_for(issn_map_path, cache_dir)
+    print(f"Wrote {len(index)} ISSN-L mappings to {cache_path}", file=sys.stderr)
+    return 0
+
+
 def main():
     parser = argparse.ArgumentParser(
         prog="python -m chocula", formatter_class=argparse.ArgumentDefaultsHelpFormatter
@@ -118,8 +176,26 @@ def main():
     parser.add_argument(
         "--db-file", help="sqlite database file", default="chocula.sqlite", type=str
     )
+    parser.add_argument(
+        "--url-cache",
+        help="sqlite file to cache homepage URL canonicalization in, across runs",
+        default=None,
+        type=str,
+    )
+    parser.add_argument(
+        "--issnl-cache-dir",
+        help="directory to keep a pre-built ISSN-L index in, across runs",
+        default=None,
+        type=str,
+    )
 
     sub = subparsers.add_parser("everything", help="run all the commands")
+    sub.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="number of processes for parsing source files in parallel",
+    )
     sub.set_defaults(func="everything")
 
     sub = subparsers.add_parser("init_db", help="create sqlite3 output file and tables")
@@ -128,6 +204,17 @@ def main():
     sub = subparsers.add_parser(
         "summarize", help="aggregate metadata from all tables into 'journals' table"
     )
+    sub.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="number of processes for summarizing ISSN-L ranges in parallel",
+    )
+    sub.add_argument(
+        "--incremental",
+        action="store_true",
+        help="only re-summarize ISSN-Ls changed since the last summarize",
+    )
     sub.set_defaults(func="summarize")
 
     sub = subparsers.add_parser("export", help="dump JSON output")
@@ -143,6 +230,22 @@ def main():
     )
     sub.set_defaults(func="export_urls")
 
+    sub = subparsers.add_parser(
+        "fix_issnl",
+        help="dump TSV of fatcat containers with invalid ISSN-L, and likely fixes",
+    )
+    sub.set_defaults(func="fix_issnl")
+
+    sub = subparsers.add_parser(
+        "issnl_cache", help="rebuild (or verify) the pre-built ISSN-L index cache"
+    )
+    sub.add_argument(
+        "--verify",
+        action="store_true",
+        help="check that the cache matches the ISSN-L file, instead of rebuilding",
+    )
+    sub.set_defaults(func=run_issnl_cache)
+
     sub = subparsers.add_parser(
         "directory", help="index directory metadata from a given source"
     )
@@ -165,13 +268,30 @@ def main():
         sys.exit(-1)
 
     config = ChoculaConfig.from_file()
+    if args.func == run_issnl_cache:
+        sys.exit(run_issnl_cache(config, args.issnl_cache_dir, args.verify))
+
     issn_db: Optional[IssnDatabase] = None
-    if args.func in ("everything", "summarize", run_directory, run_kbart):
-        issn_db = IssnDatabase(config.issnl.filepath)
+    if args.func in (
+        "everything",
+        "summarize",
+        "fix_issnl",
+        run_directory,
+        run_kbart,
+    ):
+        issn_db = IssnDatabase(config.issnl.filepath, cache_dir=args.issnl_cache_dir)
+
+    if args.url_cache:
+        url_cache = open_url_cache(args.url_cache)
 
     cdb = ChoculaDatabase(args.db_file, issn_db)
     if args.func == "everything":
-        run_everything(config, cdb)
+        run_everything(config, cdb, workers=args.workers)
+    elif args.func == "summarize":
+        print(
+            cdb.summarize(workers=args.workers, incremental=args.incremental),
+            file=sys.stderr,
+        )
     elif args.func in (run_directory, run_load, run_kbart):
         args.func(config, cdb, args.source)
     else:
@@ -179,6 +299,10 @@ def main():
         func = getattr(cdb, args.func)
         print(func(), file=sys.stderr)
 
+    if args.url_cache:
+        print(f"URL cache: {dict(url_cache.counts)}", file=sys.stderr)
+        close_url_cache()
+
 
 if __name__ == "__main__":
     main()
@@ -1,20 +1,45 @@
+import os
 import sys
 import csv
+import time
+import pickle
+import struct
 import datetime
-from typing import Iterable, Optional, Dict, Any, List
+import tempfile
+from itertools import islice
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Iterable, Iterator, Optional, Dict, Any, List, Tuple, Type, Set
 from collections import Counter
 from dataclasses import dataclass
 
-import ftfy
-
-from chocula.util import clean_str, clean_issn, merge_spans
+from chocula.util import clean_str, clean_issn, YearSpans
+from chocula.fileio import (
+    iter_fixed_lines,
+    iter_line_range,
+    line_chunk_offsets,
+    open_source,
+)
 from chocula.config import ChoculaConfig
 from chocula.database import DirectoryInfo, IssnDatabase, HomepageUrl
 
-
 # Portico files have weirdly large field sizes
 csv.field_size_limit(1310720)
 THIS_YEAR = datetime.date.today().year
+# number of rows parsed before ISSN-Ls get resolved (and rows inserted) as a
+# batch
+BATCH_SIZE = 5000
+# how long the database writer waits before checking a parallel parsing
+# worker's spill file for more batches
+SPILL_POLL_SECONDS = 0.05
+
+
+def chunked(it: Iterable, size: int = BATCH_SIZE) -> Iterator[List]:
+    it = iter(it)
+    while True:
+        chunk = list(islice(it, size))
+        if not chunk:
+            return
+        yield chunk
 
 
 class DirectoryLoader:
@@ -30,21 +55,151 @@ class DirectoryLoader:
     def parse_record(self, record) -> Optional[DirectoryInfo]:
         raise NotImplementedError()
 
-    def index_file(self, db) -> Counter:
+    def source_paths(self) -> List[str]:
+        """
+        Paths of the files this source gets loaded from.
+        """
+        return [getattr(self.config, self.source_slug).filepath]
+
+    def parse_records(self, records: List) -> List[Optional[DirectoryInfo]]:
+        """
+        Parses a batch of records. Loaders can override this to do some of the
+        work for the whole batch at once.
+        """
+        return [self.parse_record(record) for record in records]
+
+    def index_file(self, db, *, replace: bool = False) -> Counter:
+        """
+        If replace is set, any rows previously loaded from this source get
+        deleted first, in the same transaction (see
+        ChoculaDatabase.delete_source()).
+        """
+        counts: Counter = Counter()
+        inserted = self.insert_parsed(db, self.parse_batches(counts), replace=replace)
+        counts.update(inserted)
+        return counts
+
+    def parse_batches(self, counts: Counter) -> Iterator[List[DirectoryInfo]]:
+        """
+        Parses the file in batches of (up to) BATCH_SIZE rows, without touching
+        the database. The row count gets added to counts["total"].
+        """
+        for chunk in chunked(self.open_file()):
+            counts["total"] += len(chunk)
+            yield [info for info in self.parse_records(chunk) if info]
+
+    def insert_parsed(
+        self, db, batches: Iterable[List[DirectoryInfo]], replace: bool = False
+    ) -> Counter:
+        """
+        Inserts batches of records as yielded by parse_batches(). Returns insert
+        status counts. replace works as for index_file().
+        """
         print(f"##### Loading {self.source_slug}...", file=sys.stderr)
         counts: Counter = Counter()
+        if replace:
+            db.delete_source(self.source_slug)
         cur = db.db.cursor()
-        for record in self.open_file():
-            counts["total"] += 1
-            info = self.parse_record(record)
-            if info:
-                status = db.insert_directory(info, cur=cur)
-                counts[status] += 1
+        for batch in batches:
+            counts.update(db.insert_directory_batch(batch, cur=cur, counts=counts))
         cur.close()
         db.db.commit()
         return counts
 
 
+def _parse_directory_file(
+    cls: Type[DirectoryLoader], config: ChoculaConfig, spill_path: str
+) -> Counter:
+    """
+    Runs in a worker process: appends parsed batches to the spill file, each
+    as a length-prefixed pickle, flushed as soon as it is written (so the
+    writer can read it while parsing is still going on). Returns the row
+    counts.
+    """
+    counts: Counter = Counter()
+    with open(spill_path, "ab") as f:
+        for batch in cls(config).parse_batches(counts):
+            data = pickle.dumps(batch, protocol=pickle.HIGHEST_PROTOCOL)
+            f.write(struct.pack("<Q", len(data)))
+            f.write(data)
+            f.flush()
+    return counts
+
+
+def _iter_spilled_batches(
+    spill_path: str, future: Future
+) -> Iterator[List[DirectoryInfo]]:
+    """
+    Yields batches from a _parse_directory_file() spill file, following it
+    until the worker is done. If the worker fails, its exception gets raised
+    here.
+    """
+    with open(spill_path, "rb") as f:
+        while True:
+            # checked before reading, so nothing written after the last read
+            # can be missed
+            done = future.done()
+            offset = f.tell()
+            header = f.read(8)
+            if len(header) == 8:
+                (size,) = struct.unpack("<Q", header)
+                data = f.read(size)
+                if len(data) == size:
+                    yield pickle.loads(data)
+                    continue
+            f.seek(offset)
+            if done:
+                future.result()
+                if header:
+                    raise ValueError(f"truncated parsed batch in {spill_path}")
+                return
+            time.sleep(SPILL_POLL_SECONDS)
+
+
+def index_directories_parallel(
+    classes: List[Type[DirectoryLoader]],
+    config: ChoculaConfig,
+    db,
+    workers: int,
+    replace: bool = False,
+) -> Iterator[Tuple[str, Counter]]:
+    """
+    Like calling index_file() for each of the loader classes in order, but
+    with the parsing of all the files (CSV/JSON, string cleaning, URL
+    normalization) running in a pool of worker processes.
+
+    This process remains the only database writer, and it inserts the parsed
+    records one source at a time in the order given (not the order parsing
+    finishes), so the "first inserted wins" behavior of the directory table is
+    the same as a serial run.
+
+    Workers never wait on the writer: each one spills its parsed batches to a
+    temporary file, which the writer reads back when it gets to that source
+    (following the file if parsing is still in progress) and deletes once
+    inserted. Neither side holds more than one batch in memory at a time.
+
+    Yields (source_slug, counts) as each source is inserted.
+    """
+    with tempfile.TemporaryDirectory(
+        prefix="chocula-parsed-"
+    ) as spill_dir, ProcessPoolExecutor(max_workers=workers) as executor:
+        spill_paths = []
+        for i, cls in enumerate(classes):
+            spill_path = os.path.join(spill_dir, f"{i}-{cls.source_slug}.batches")
+            open(spill_path, "wb").close()
+            spill_paths.append(spill_path)
+        futures = [
+            executor.submit(_parse_directory_file, cls, config, spill_path)
+            for cls, spill_path in zip(classes, spill_paths)
+        ]
+        for cls, spill_path, future in zip(classes, spill_paths, futures):
+            batches = _iter_spilled_batches(spill_path, future)
+            counts = cls(config).insert_parsed(db, batches, replace=replace)
+            counts.update(future.result())
+            os.remove(spill_path)
+            yield cls.source_slug, counts
+
+
 @dataclass
 class KbartRecord:
     issnl: Optional[str]
@@ -59,6 +214,8 @@ class KbartRecord:
     url: Optional[HomepageUrl]
     embargo: Optional[str]
     year_spans: List[Any]
+    # for formats which don't distinguish print/electronic ISSNs
+    raw_issn: Optional[str] = None
 
 
 class KbartLoader:
@@ -72,20 +229,26 @@ class KbartLoader:
         # return self.config.TEMPLATE.filepath)
         raise NotImplementedError()
 
+    def source_paths(self) -> List[str]:
+        return [self.file_path()]
+
     def open_file(self) -> Iterable:
-        raw_file = open(self.file_path(), "rb").read().decode(errors="replace")
-        fixed_file = ftfy.fix_text(raw_file)
-        reader = csv.DictReader(fixed_file.split("\n"), delimiter="\t")
-        return reader
+        return csv.DictReader(iter_fixed_lines(self.file_path()), delimiter="\t")
 
-    def parse_record(self, row: dict, issn_db: IssnDatabase) -> Optional[KbartRecord]:
+    def parse_record(
+        self, row: dict, issn_db: Optional[IssnDatabase]
+    ) -> Optional[KbartRecord]:
+        """
+        If issn_db is None, the ISSN-L is not resolved here; index_file() does
+        that for a whole batch of records at once (see resolve_issnls()).
+        """
 
         issne: Optional[str] = clean_issn(row["online_identifier"] or "")
         issnp: Optional[str] = clean_issn(row["print_identifier"] or "")
         issnl: Optional[str] = None
-        if issne:
+        if issne and issn_db:
             issnl = issn_db.issn2issnl(issne)
-        if issnp and not issnl:
+        if issnp and not issnl and issn_db:
             issnl = issn_db.issn2issnl(issnp)
         start_year: Optional[int] = None
         end_year: Optional[int] = None
@@ -117,19 +280,67 @@ class KbartLoader:
             record.end_volume = None
         return record
 
-    def index_file(self, db) -> Counter:
+    def resolve_issnls(self, records: List[KbartRecord], issn_db: IssnDatabase) -> None:
+        """
+        Fills in the ISSN-L of a batch of records (parsed without an
+        IssnDatabase), resolving one column at a time: electronic, then print,
+        then raw ISSN.
+        """
+        for column in ("issne", "issnp", "raw_issn"):
+            todo = [r for r in records if not r.issnl and getattr(r, column)]
+            if not todo:
+                continue
+            issnls = issn_db.issn2issnl_many([getattr(r, column) for r in todo])
+            for record, issnl in zip(todo, issnls):
+                record.issnl = issnl
+
+    def parse_records(self, db, counts: Counter) -> Iterator[Optional[KbartRecord]]:
+        """
+        Parses rows from the file in batches, resolving ISSN-Ls a batch at a
+        time. Yields None for rows which failed to parse.
+        """
+        return self.parse_rows(self.open_file(), db.issn_db, counts)
+
+    def parse_rows(
+        self, rows: Iterable[dict], issn_db: IssnDatabase, counts: Counter
+    ) -> Iterator[Optional[KbartRecord]]:
+        for chunk in chunked(rows):
+            counts["total"] += len(chunk)
+            records = [self.parse_record(row, None) for row in chunk]
+            self.resolve_issnls([r for r in records if r], issn_db)
+            yield from records
+
+    def index_file(self, db, *, replace: bool = False) -> Counter:
         """
         Transforms a KBART file into a dict of dicts; but basically a list of
         JSON objects, one per journal. KBART files can have multiple rows per
         journal (eg, different year spans), which is why this pass is needed.
+
+        replace works as for DirectoryLoader.index_file().
         """
         print(f"##### Loading {self.source_slug} KBART...", file=sys.stderr)
         counts: Counter = Counter()
-        kbart_dict: Dict[str, KbartRecord] = dict()
-        for row in self.open_file():
-            counts["total"] += 1
+        kbart_dict = self.aggregate_records(self.parse_records(db, counts), counts)
+        self.insert_records(db, kbart_dict, counts, replace=replace)
+        return counts
 
-            record = self.parse_record(row, db.issn_db)
+    def aggregate_records(
+        self,
+        records: Iterable[Optional[KbartRecord]],
+        counts: Counter,
+        resets: Optional[Set[str]] = None,
+    ) -> Dict[str, KbartRecord]:
+        """
+        Collapses records down to one per ISSN-L: the last record seen, with
+        the year spans of all the records merged.
+
+        A record with no years at all replaces any spans accumulated so far;
+        if a resets set is passed, the ISSN-Ls where that happened get added
+        to it.
+        """
+        kbart_dict: Dict[str, KbartRecord] = dict()
+        year_spans: Dict[str, YearSpans] = dict()
+        for record in records:
             if record is None:
                 counts["skip-parse"] += 1
                 continue
@@ -140,39 +351,55 @@ class KbartLoader:
                 counts["partial-missing-years"] += 1
             counts["parsed"] += 1
 
-            existing = kbart_dict.get(record.issnl, record)
+            old_spans = year_spans.get(record.issnl, YearSpans())
             if record.start_year and record.end_year:
-                old_spans = existing.year_spans or []
                 if not record.start_year <= record.end_year:
-                    new_spans = [[record.end_year, record.start_year]]
+                    new_spans = YearSpans([[record.end_year, record.start_year]])
                 else:
-                    new_spans = [[record.start_year, record.end_year]]
-                record.year_spans = merge_spans(old_spans, new_spans)
+                    new_spans = YearSpans([[record.start_year, record.end_year]])
+                year_spans[record.issnl] = old_spans | new_spans
             elif record.year_spans:
-                old_spans = existing.year_spans or []
-                record.year_spans = merge_spans(old_spans, record.year_spans)
+                year_spans[record.issnl] = old_spans | YearSpans(record.year_spans)
+            else:
+                year_spans[record.issnl] = YearSpans()
+                if resets is not None:
+                    resets.add(record.issnl)
             kbart_dict[record.issnl] = record
 
+        for issnl, record in kbart_dict.items():
+            record.year_spans = year_spans[issnl].to_json()
+        return kbart_dict
+
+    def insert_records(
+        self,
+        db,
+        kbart_dict: Dict[str, KbartRecord],
+        counts: Counter,
+        replace: bool = False,
+    ) -> None:
         counts["unique-issnl"] = len(kbart_dict)
+        if replace:
+            db.delete_source(self.source_slug)
         cur = db.db.cursor()
-        for issnl, record in kbart_dict.items():
-            info = DirectoryInfo(
-                directory_slug=self.source_slug,
-                issnl=record.issnl,
-                issne=record.issne,
-                issnp=record.issnp,
-                name=record.title,
-                publisher=record.publisher,
-                homepage_urls=[],
-                extra=dict(year_spans=record.year_spans),
-            )
-            if record.url:
-                info.homepage_urls.append(record.url)
-            status = db.insert_directory(info, cur=cur)
-            counts[status] += 1
+        for chunk in chunked(kbart_dict.values()):
+            infos = []
+            for record in chunk:
+                info = DirectoryInfo(
+                    directory_slug=self.source_slug,
+                    issnl=record.issnl,
+                    issne=record.issne,
+                    issnp=record.issnp,
+                    name=record.title,
+                    publisher=record.publisher,
+                    homepage_urls=[],
+                    extra=dict(year_spans=record.year_spans),
+                )
+                if record.url:
+                    info.homepage_urls.append(record.url)
+                infos.append(info)
+            counts.update(db.insert_directory_batch(infos, cur=cur, counts=counts))
         cur.close()
         db.db.commit()
-        return counts
 
 
 class OnixCsvLoader(KbartLoader):
@@ -192,16 +419,18 @@ class OnixCsvLoader(KbartLoader):
     """
 
     def open_file(self) -> Iterable:
-        f = open(self.file_path(), "r")
+        f = open_source(self.file_path(), "r")
         # skip first line of PKP PLN Onix file, which is a "generated date" header
         if self.source_slug == "pkp_pln":
             next(f)
         return csv.DictReader(f)
 
-    def parse_record(self, row: dict, issn_db: IssnDatabase) -> Optional[KbartRecord]:
+    def parse_record(
+        self, row: dict, issn_db: Optional[IssnDatabase]
+    ) -> Optional[KbartRecord]:
 
         raw_issn = clean_issn(row["ISSN"])
-        issnl = issn_db.issn2issnl(raw_issn or "")
+        issnl = issn_db.issn2issnl(raw_issn or "") if issn_db else None
         start_year = int(row["Published"][:4])
         start_volume = clean_str(row["Vol"])
         record = KbartRecord(
@@ -217,6 +446,7 @@ class OnixCsvLoader(KbartLoader):
             start_volume=start_volume,
             end_volume=start_volume,
             year_spans=[],
+            raw_issn=raw_issn,
         )
         return record
 
@@ -242,16 +472,18 @@ class CarinianaCsvLoader(KbartLoader):
     """
 
     def open_file(self) -> Iterable:
-        return csv.DictReader(open(self.file_path(), "r"))
+        return csv.DictReader(open_source(self.file_path(), "r"))
 
-    def parse_record(self, row: dict, issn_db: IssnDatabase) -> Optional[KbartRecord]:
+    def parse_record(
+        self, row: dict, issn_db: Optional[IssnDatabase]
+    ) -> Optional[KbartRecord]:
 
         raw_issn = clean_issn(row["ISSN"])
         issne = clean_issn(row["ISSN"])
-        issnl = issn_db.issn2issnl(raw_issn or issne or "")
+        issnl = issn_db.issn2issnl(raw_issn or issne or "") if issn_db else None
         # convert list of years to a set of year spans
         years = [int(y.strip()) for y in row["Preserved Years"].split(";") if y]
-        year_spans = merge_spans([], [[y, y] for y in years])
+        year_spans = YearSpans([[y, y] for y in years]).to_json()
         record = KbartRecord(
             issnl=issnl,
             issne=issne,
@@ -265,10 +497,41 @@ class CarinianaCsvLoader(KbartLoader):
             start_volume=None,
             end_volume=None,
             year_spans=year_spans,
+            raw_issn=raw_issn,
         )
         return record
 
 
+HATHIFILES_FIELDS = [
+    "htid",
+    "access",
+    "rights",
+    "ht_bib_key",
+    "description",
+    "source",
+    "source_bib_num",
+    "oclc_num",
+    "isbn",
+    "issn",
+    "lccn",
+    "title",
+    "imprint",
+    "rights_reason_code",
+    "rights_timestamp",
+    "us_gov_doc_flag",
+    "rights_date_used",
+    "pub_place",
+    "lang",
+    "bib_fmt",
+    "collection_code",
+    "content_provider_code",
+    "responsible_entity_code",
+    "digitization_agent_code",
+    "access_profile_code",
+    "author",
+]
+
+
 class HathifilesLoader(KbartLoader):
     """
     Similar to the KBART loader class, but for Hathifiles bulk format.
@@ -284,41 +547,103 @@ class HathifilesLoader(KbartLoader):
     - 19 lang (MARC format)
     """
 
+    # number of bytes of the file parsed as one unit of work
+    chunk_bytes = 64 * 1024 * 1024
+
     def open_file(self) -> Iterable:
         return csv.DictReader(
-            open(self.file_path(), "r"),
+            open_source(self.file_path(), "r"),
             delimiter="\t",
-            fieldnames=[
-                "htid",
-                "access",
-                "rights",
-                "ht_bib_key",
-                "description",
-                "source",
-                "source_bib_num",
-                "oclc_num",
-                "isbn",
-                "issn",
-                "lccn",
-                "title",
-                "imprint",
-                "rights_reason_code",
-                "rights_timestamp",
-                "us_gov_doc_flag",
-                "rights_date_used",
-                "pub_place",
-                "lang",
-                "bib_fmt",
-                "collection_code",
-                "content_provider_code",
-                "responsible_entity_code",
-                "digitization_agent_code",
-                "access_profile_code",
-                "author",
-            ],
+            fieldnames=HATHIFILES_FIELDS,
         )
 
-    def parse_record(self, row: dict, issn_db: IssnDatabase) -> Optional[KbartRecord]:
+    def index_file(self, db, *, workers: int = 1, replace: bool = False) -> Counter:
+        """
+        Same result as KbartLoader.index_file(), but the file is split into
+        byte-range chunks (on line boundaries) which are parsed and aggregated
+        separately, in a pool of worker processes if workers > 1, then merged
+        in file order. This process remains the only database writer.
+        """
+        print(f"##### Loading {self.source_slug} KBART...", file=sys.stderr)
+        counts: Counter = Counter()
+        offsets = line_chunk_offsets(self.file_path(), self.chunk_bytes)
+        if workers > 1 and len(offsets) > 1:
+            with ProcessPoolExecutor(
+                max_workers=min(workers, len(offsets)),
+                initializer=_init_hathifiles_worker,
+                initargs=(db.issn_db,),
+            ) as executor:
+                futures = [
+                    executor.submit(_parse_hathifiles_chunk, self, start, end)
+                    for start, end in offsets
+                ]
+                results = (f.result() for f in futures)
+                kbart_dict = self.merge_chunks(results, counts)
+        else:
+            results = (
+                self.parse_chunk(db.issn_db, start, end) for start, end in offsets
+            )
+            kbart_dict = self.merge_chunks(results, counts)
+        self.insert_records(db, kbart_dict, counts, replace=replace)
+        return counts
+
+    def parse_chunk(
+        self, issn_db: IssnDatabase, start: int, end: Optional[int]
+    ) -> Tuple[Counter, Dict[str, KbartRecord], Set[str]]:
+        """
+        Parses and aggregates the lines in one byte range of the file (to the
+        end of the stream if end is None; see iter_line_range()).
+
+        Most lines have no ISSN at all; these get counted and skipped before
+        any CSV parsing, by looking at the raw bytes of the issn column. This
+        assumes one row per line, which is true of Hathifiles (no quoting);
+        lines with a quote character always go through the CSV reader.
+
+        Returns counts, the aggregated records, and the set of ISSN-Ls whose
+        year spans were reset in this chunk (see aggregate_records()).
+        """
+        counts: Counter = Counter()
+        resets: Set[str] = set()
+
+        def lines() -> Iterator[str]:
+            for raw_line in iter_line_range(self.file_path(), start, end):
+                fields = raw_line.split(b"\t", 10)
+                if len(fields) > 10 and not fields[9].strip() and b'"' not in raw_line:
+                    counts["total"] += 1
+                    counts["skip-issnl"] += 1
+                    continue
+                yield raw_line.decode("utf-8")
+
+        rows = csv.DictReader(lines(), delimiter="\t", fieldnames=HATHIFILES_FIELDS)
+        records = self.parse_rows(rows, issn_db, counts)
+        kbart_dict = self.aggregate_records(records, counts, resets=resets)
+        return counts, kbart_dict, resets
+
+    def merge_chunks(
+        self,
+        results: Iterable[Tuple[Counter, Dict[str, KbartRecord], Set[str]]],
+        counts: Counter,
+    ) -> Dict[str, KbartRecord]:
+        """
+        Combines per-chunk results (in file order) the same way
+        aggregate_records() combines rows.
+        """
+        kbart_dict: Dict[str, KbartRecord] = dict()
+        for chunk_counts, chunk_dict, resets in results:
+            counts.update(chunk_counts)
+            for issnl, record in chunk_dict.items():
+                existing = kbart_dict.get(issnl)
+                if existing and issnl not in resets:
+                    record.year_spans = (
+                        YearSpans.from_json(existing.year_spans)
+                        | YearSpans.from_json(record.year_spans)
+                    ).to_json()
+                kbart_dict[issnl] = record
+        return kbart_dict
+
+    def parse_record(
+        self, row: dict, issn_db: Optional[IssnDatabase]
+    ) -> Optional[KbartRecord]:
 
         # unpack fields
         # access = dict(allow="bright", deny="dark")[row['access']]
@@ -326,7 +651,7 @@ class HathifilesLoader(KbartLoader):
         imprint = clean_str(row["imprint"])
         raw_date = row["rights_date_used"].strip()
 
-        issnl = issn_db.issn2issnl(raw_issn or "")
+        issnl = issn_db.issn2issnl(raw_issn or "") if issn_db else None
 
         rights_date: Optional[int] = None
         if raw_date.isdigit():
@@ -352,5 +677,23 @@ class HathifilesLoader(KbartLoader):
             start_volume=None,
             end_volume=None,
             year_spans=[],
+            raw_issn=raw_issn,
         )
         return record
+
+
+# set in each worker process by the pool initializer, so the ISSN database only
+# gets pickled once per worker, not once per chunk
+_worker_issn_db: Optional[IssnDatabase] = None
+
+
+def _init_hathifiles_worker(issn_db: IssnDatabase) -> None:
+    global _worker_issn_db
+    _worker_issn_db = issn_db
+
+
+def _parse_hathifiles_chunk(
+    loader: HathifilesLoader, start: int, end: Optional[int]
+) -> Tuple[Counter, Dict[str, KbartRecord], Set[str]]:
+    assert _worker_issn_db is not None
+    return loader.parse_chunk(_worker_issn_db, start, end)
@@ -12,7 +12,10 @@ class ChoculaConfig(SimpleNamespace):
         # convert all sub-tables to SimpleNamespace
         for k in list(sources.keys()):
             if isinstance(sources[k], dict):
-                if "filename" in sources[k]:
+                if sources[k].get("filename") == "-":
+                    # stdin
+                    sources[k]["filepath"] = "-"
+                elif "filename" in sources[k]:
                     sources[k]["filepath"] = sources_dir + sources[k]["filename"]
                 sources[k] = SimpleNamespace(**sources[k])
 
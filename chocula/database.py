@@ -1,17 +1,42 @@
 from __future__ import annotations
 
+import os
 import sys
-import json
+import pathlib
 import sqlite3
 from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
 from dataclasses import dataclass, field
-from typing import List, Dict, Tuple, Optional, Any
+from functools import lru_cache
+from importlib import metadata
+from itertools import groupby
+from typing import (
+    List,
+    Dict,
+    Tuple,
+    Optional,
+    Any,
+    Set,
+    Iterable,
+    Iterator,
+    Sequence,
+    TextIO,
+)
 
 import urlcanon
 import surt
-import tldextract
 import stdnum.issn
 
+from chocula import jsonio, public_suffix
+from chocula.fileio import (
+    STDIN_PATH,
+    line_chunk_offsets,
+    iter_line_range,
+    open_source,
+    source_file_path,
+)
+from chocula.issn_index import IssnIndex, load_or_build_cache
+
 from chocula import *
 from chocula.util import *
 
@@ -43,51 +68,193 @@ class HomepageUrl:
     def from_url(cls, url: str) -> Optional[HomepageUrl]:
         """
         Returns None if url is really bad (not a URL).
+
+        Results are cached by raw URL string: in memory (LRU), and on disk if
+        open_url_cache() has been called.
         """
         if not url:
             return None
-        if url.startswith("www."):
-            url = "http://" + url
-        if url.startswith("ttp://") or url.startswith("ttps://"):
-            url = "h" + url
-        url.replace("Http://", "http://")
-        url = str(urlcanon.semantic_precise(url))
-        if (
-            not url
-            or "://" not in url
-            or not url.lower().startswith("http")
-            or "mailto:" in url.lower()
-            or "LOCKSS_RESOLVER" in url
-            or "$result.AccessURL" in url
-            or "://firstsearch.oclc.org" in url
-            or "://bibpurl.oclc.org" in url
-            or "://books.google.com" in url
-            or "://translate.google.com" in url
-            or "://search.ebscohost.com" in url
-            or "://search.proquest.com" in url
-            or "://gateway.proquest.com" in url
-            or "://nbn-resolving.org/" in url
-            or "://e-helvetica.nb.admin.ch/" in url
-        ):
+        fields = _canonicalize_url(url)
+        if fields is None:
             return None
+        return HomepageUrl(*fields)
+
+
+# canonicalized URL fields, in HomepageUrl constructor order
+UrlFields = Tuple[str, str, Optional[str], Optional[str], Optional[str]]
+
+# number of distinct raw URLs to keep canonicalization results for in memory
+URL_CACHE_SIZE = 2 ** 17
+
+# bump when the canonicalization/filtering below changes, to invalidate on-disk
+# caches
+URL_CANON_VERSION = 1
+
+
+def _canonicalize_url_uncached(url: str) -> Optional[UrlFields]:
+    if url.startswith("www."):
+        url = "http://" + url
+    if url.startswith("ttp://") or url.startswith("ttps://"):
+        url = "h" + url
+    url.replace("Http://", "http://")
+    url = str(urlcanon.semantic_precise(url))
+    if (
+        not url
+        or "://" not in url
+        or not url.lower().startswith("http")
+        or "mailto:" in url.lower()
+        or "LOCKSS_RESOLVER" in url
+        or "$result.AccessURL" in url
+        or "://firstsearch.oclc.org" in url
+        or "://bibpurl.oclc.org" in url
+        or "://books.google.com" in url
+        or "://translate.google.com" in url
+        or "://search.ebscohost.com" in url
+        or "://search.proquest.com" in url
+        or "://gateway.proquest.com" in url
+        or "://nbn-resolving.org/" in url
+        or "://e-helvetica.nb.admin.ch/" in url
+    ):
+        return None
+
+    subdomain, domain, suffix = public_suffix.extract(url)
+    host = ".".join((subdomain, domain, suffix))
+    if host.startswith("."):
+        host = host[1:]
+    if not (domain and suffix):
+        return None
+    try:
+        url_surt = surt.surt(url)
+    except ValueError:
+        return None
+    return (url, url_surt, host, f"{domain}.{suffix}", suffix)
+
+
+@lru_cache(maxsize=URL_CACHE_SIZE)
+def _canonicalize_url(url: str) -> Optional[UrlFields]:
+    # immutable tuples are cached, not HomepageUrl objects, which callers may
+    # modify
+    disk_cache = _url_disk_cache
+    if disk_cache is None or disk_cache.pid != os.getpid():
+        return _canonicalize_url_uncached(url)
+    found, fields = disk_cache.get(url)
+    if not found:
+        fields = _canonicalize_url_uncached(url)
+        disk_cache.put(url, fields)
+    return fields
+
+
+class UrlCache:
+    """
+    On-disk (SQLite) cache of URL canonicalization results, keyed by raw URL
+    string, to skip re-parsing the same URLs in later runs.
 
-        tld = tldextract.extract(url)
-        host = ".".join(tld)
-        if host.startswith("."):
-            host = host[1:]
-        if not (tld.registered_domain and tld.suffix):
-            return None
-        try:
-            url_surt = surt.surt(url)
-        except ValueError:
-            return None
-        return HomepageUrl(
-            url=url,
-            surt=url_surt,
-            host=host,
-            domain=tld.registered_domain,
-            suffix=tld.suffix,
+    The cache is emptied when URL_CANON_VERSION or the versions of the URL
+    parsing libraries change. Only used by the process which opened it (not
+    forked worker processes).
+    """
+
+    # number of new results buffered before writing them out
+    flush_size = 10000
+
+    def __init__(self, path: str):
+        self.path = path
+        self.pid = os.getpid()
+        self.counts: Counter = Counter()
+        self.pending: List[Tuple] = []
+        self.db = sqlite3.connect(path)
+        self.db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS url_cache_meta (
+                key TEXT PRIMARY KEY, value TEXT
+            );
+            CREATE TABLE IF NOT EXISTS url_cache (
+                raw_url TEXT PRIMARY KEY,
+                url TEXT,
+                surt TEXT,
+                host TEXT,
+                domain TEXT,
+                suffix TEXT
+            );
+            """
         )
+        version = self.version()
+        row = self.db.execute(
+            "SELECT value FROM url_cache_meta WHERE key = 'version'"
+        ).fetchone()
+        if not row or row[0] != version:
+            self.db.execute("DELETE FROM url_cache")
+            self.db.execute(
+                "INSERT OR REPLACE INTO url_cache_meta VALUES ('version', ?)",
+                (version,),
+            )
+            self.db.commit()
+
+    @staticmethod
+    def version() -> str:
+        parts = [str(URL_CANON_VERSION), f"psl={public_suffix.snapshot_version()}"]
+        for package in ("urlcanon", "surt", "idna"):
+            try:
+                parts.append(f"{package}={metadata.version(package)}")
+            except metadata.PackageNotFoundError:
+                parts.append(f"{package}=unknown")
+        return " ".join(parts)
+
+    def get(self, raw_url: str) -> Tuple[bool, Optional[UrlFields]]:
+        """
+        Returns (found, fields); fields is None for cached rejected URLs.
+        """
+        row = self.db.execute(
+            "SELECT url, surt, host, domain, suffix FROM url_cache WHERE raw_url = ?",
+            (raw_url,),
+        ).fetchone()
+        if row is None:
+            self.counts["miss"] += 1
+            return False, None
+        self.counts["hit"] += 1
+        if row[0] is None:
+            return True, None
+        return True, (row[0], row[1], row[2], row[3], row[4])
+
+    def put(self, raw_url: str, fields: Optional[UrlFields]) -> None:
+        self.pending.append((raw_url,) + (fields or (None,) * 5))
+        if len(self.pending) >= self.flush_size:
+            self.flush()
+
+    def flush(self) -> None:
+        if self.pending:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO url_cache VALUES (?,?,?,?,?,?)", self.pending
+            )
+            self.db.commit()
+            self.pending = []
+
+    def close(self) -> None:
+        self.flush()
+        self.db.close()
+
+
+_url_disk_cache: Optional[UrlCache] = None
+
+
+def open_url_cache(path: str) -> UrlCache:
+    """
+    Starts using an on-disk URL canonicalization cache (see UrlCache) for
+    HomepageUrl.from_url().
+    """
+    global _url_disk_cache
+    close_url_cache()
+    _url_disk_cache = UrlCache(path)
+    return _url_disk_cache
+
+
+def close_url_cache() -> None:
+    global _url_disk_cache
+    if _url_disk_cache is not None:
+        _url_disk_cache.close()
+        _url_disk_cache = None
+    # in-memory results may have come from the disk cache
+    _canonicalize_url.cache_clear()
 
 
 def test_from_url():
@@ -177,7 +344,7 @@ class DirectoryInfo:
 
         extra_str: Optional[str] = None
         if extra_dict:
-            extra_str = json.dumps(extra_dict, sort_keys=True)
+            extra_str = jsonio.dumps(extra_dict, sort_keys=True)
 
         return (
             self.issnl,
@@ -198,38 +365,68 @@ class IssnDatabase:
     ISSN strings
     """
 
-    def __init__(self, issn_issnl_file_path: str):
-        self.issn_issnl_map: Dict[str, str] = dict()
-        self.read_issn_map_file(issn_issnl_file_path)
+    def __init__(
+        self,
+        issn_issnl_file_path: Optional[str] = None,
+        cache_dir: Optional[str] = None,
+    ):
+        """
+        If cache_dir is set, a pre-built index file is kept in that directory
+        and re-used as long as the ISSN-L TSV file doesn't change.
+        """
+        self.issn_index: IssnIndex = IssnIndex([], [])
+        self._repair_cache: Dict[str, Optional[str]] = dict()
+        if issn_issnl_file_path:
+            # (stdin can't be cached)
+            if cache_dir and issn_issnl_file_path != STDIN_PATH:
+                self.read_issn_map_cache(issn_issnl_file_path, cache_dir)
+            else:
+                self.read_issn_map_file(issn_issnl_file_path)
+
+    @classmethod
+    def from_index_file(cls, index_path: str) -> IssnDatabase:
+        """
+        Memory-maps a pre-built index file (as written by IssnIndex.save())
+        instead of parsing the ISSN-L TSV file.
+        """
+        issn_db = cls()
+        issn_db.issn_index = IssnIndex.load(index_path)
+        return issn_db
 
     def read_issn_map_file(self, issn_map_path: str):
         print("##### Loading ISSN-L map file...", file=sys.stderr)
-        with open(issn_map_path, "r") as issn_map_file:
-            for line in issn_map_file:
-                if line.startswith("ISSN") or len(line) == 0 or len(line.split()) < 2:
-                    continue
-                (issn, issnl) = line.split()[0:2]
-                self.issn_issnl_map[issn] = issnl
-                # double mapping makes lookups easy
-                if not issnl in self.issn_issnl_map:
-                    self.issn_issnl_map[issnl] = issnl
-        count = len(self.issn_issnl_map)
+        self.issn_index = IssnIndex.from_issn_map_file(issn_map_path)
+        count = len(self.issn_index)
         print(f"Got {count} ISSN-L mappings", file=sys.stderr)
 
+    def read_issn_map_cache(self, issn_map_path: str, cache_dir: str) -> str:
+        print("##### Loading ISSN-L map file (cached)...", file=sys.stderr)
+        self.issn_index, status = load_or_build_cache(issn_map_path, cache_dir)
+        count = len(self.issn_index)
+        print(f"Got {count} ISSN-L mappings (cache {status})", file=sys.stderr)
+        return status
+
     def issn2issnl(self, issn: str) -> Optional[str]:
-        return self.issn_issnl_map.get(issn)
+        return self.issn_index.lookup(issn)
 
-    def munge_issns(self, info: DirectoryInfo) -> DirectoryInfo:
+    def issn2issnl_many(self, issns: List[Optional[str]]) -> List[Optional[str]]:
         """
-        Cleans up the ISSN fields of a DirectoryInfo object, and tries to
-        lookup or confirm an ISSN-L mapping.
-
-        Note that if the passed ISSN-L number is not in the ISSN-L directory,
-        it will be wiped from the returned info object.
+        Batch version of issn2issnl(); returns a list of the same length as
+        the input, with None for unknown (or empty) ISSNs.
+        """
+        return self.issn_index.lookup_many(issns)
 
-        TODO: check what previous behavior was... passing through raw_issn?
+    def repair_issnl(self, issn: str) -> Optional[str]:
         """
+        Returns a candidate ISSN-L for an unknown ISSN which looks like a typo
+        (bad check digit, single wrong digit, or adjacent transposition) of a
+        known ISSN, or None. Results are memoized.
+        """
+        if issn not in self._repair_cache:
+            self._repair_cache[issn] = self.issn_index.repair(issn)
+        return self._repair_cache[issn]
 
+    def _clean_issns(self, info: DirectoryInfo) -> None:
         if info.issnl:
             info.issnl = clean_issn(info.issnl)
         if info.raw_issn:
@@ -239,6 +436,19 @@ class IssnDatabase:
         if info.issnp:
             info.issnp = clean_issn(info.issnp)
 
+    def munge_issns(self, info: DirectoryInfo) -> DirectoryInfo:
+        """
+        Cleans up the ISSN fields of a DirectoryInfo object, and tries to
+        lookup or confirm an ISSN-L mapping.
+
+        Note that if the passed ISSN-L number is not in the ISSN-L directory,
+        it will be wiped from the returned info object.
+
+        TODO: check what previous behavior was... passing through raw_issn?
+        """
+
+        self._clean_issns(info)
+
         issnl = None
         for lookup in (info.issnl, info.raw_issn, info.issne, info.issnp):
             if not lookup:
@@ -249,18 +459,96 @@ class IssnDatabase:
         info.issnl = issnl
         return info
 
+    def munge_issns_batch(self, infos: List[DirectoryInfo]) -> List[DirectoryInfo]:
+        """
+        Batch version of munge_issns(), with the same result.
+
+        Instead of trying each ISSN field in turn for every row, this resolves
+        a whole column at a time (issnl, then raw_issn, issne, issnp), only
+        looking up rows which haven't been resolved by an earlier column.
+        """
+        for info in infos:
+            self._clean_issns(info)
+
+        resolved: List[Optional[str]] = [None] * len(infos)
+        for column in ("issnl", "raw_issn", "issne", "issnp"):
+            todo = [
+                i
+                for i, info in enumerate(infos)
+                if resolved[i] is None and getattr(info, column)
+            ]
+            if not todo:
+                continue
+            issnls = self.issn2issnl_many([getattr(infos[i], column) for i in todo])
+            for i, issnl in zip(todo, issnls):
+                resolved[i] = issnl
+
+        for info, issnl in zip(infos, resolved):
+            info.issnl = issnl
+        return infos
+
+
+# ISSN-Ls which get a journal row. don't include new journals if they are
+# *only* in hathitrust KBART
+SUMMARIZE_ISSNLS_SQL = """
+    SELECT issnl FROM directory WHERE slug != 'hathitrust'
+    UNION
+    SELECT issnl FROM fatcat_container WHERE issnl IS NOT null
+"""
+
+JOURNAL_INSERT_SQL = "INSERT OR REPLACE INTO journal (issnl, issne, issnp, wikidata_qid, fatcat_ident, name, publisher, country, lang, is_oa, sherpa_color, is_longtail, is_active, publisher_type, has_dois, any_homepage, any_live_homepage, any_gwb_homepage, known_issnl, valid_issnl, release_count, ia_count, ia_frac, kbart_count, kbart_frac, preserved_count, preserved_frac) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)"
+
+# number of journal rows inserted at a time
+SUMMARIZE_BATCH_SIZE = 1000
+
+# number of bytes of the fatcat container export parsed as one unit of work
+FATCAT_CONTAINERS_CHUNK_BYTES = 64 * 1024 * 1024
+
+FATCAT_CONTAINER_INSERT_SQL = "INSERT OR REPLACE INTO fatcat_container (issnl, ident, revision, issne, issnp, wikidata_qid, name, container_type, publisher, country, lang) VALUES (?,?,?,?,?,?,?,?,?,?,?)"
+
+# number of ISSN-L ranges per worker process for parallel summarize
+SUMMARIZE_SHARDS_PER_WORKER = 8
+
+# number of exported lines written to output at a time
+EXPORT_BATCH_SIZE = 1000
+
+
+class IssnlGroups:
+    """
+    Wraps a cursor over rows ordered by an "issnl" column, and returns the
+    rows for each ISSN-L, for ISSN-Ls requested in ascending order.
+    """
+
+    def __init__(self, rows: Iterable[sqlite3.Row]):
+        self.groups = groupby(rows, key=lambda row: row["issnl"])
+        self.current = next(self.groups, None)
+
+    def get(self, issnl: str) -> List[sqlite3.Row]:
+        while self.current is not None and self.current[0] < issnl:
+            self.current = next(self.groups, None)
+        if self.current is None or self.current[0] != issnl:
+            return []
+        rows = list(self.current[1])
+        self.current = next(self.groups, None)
+        return rows
+
 
 class ChoculaDatabase:
     """
     Wraps a sqlite3 database
     """
 
-    def __init__(self, db_file, issn_db):
+    def __init__(self, db_file, issn_db, read_only: bool = False):
         """
         To create a temporary database, pass ":memory:" as db_file
         """
-        self.db = sqlite3.connect(db_file, isolation_level="EXCLUSIVE")
-        self.data = dict()
+        self.db_file = db_file
+        if read_only:
+            uri = pathlib.Path(db_file).absolute().as_uri() + "?mode=ro"
+            self.db = sqlite3.connect(uri, uri=True)
+        else:
+            self.db = sqlite3.connect(db_file, isolation_level="EXCLUSIVE")
+        self.data: Dict[str, Any] = dict()
         self.issn_db = issn_db
 
     def insert_directory(self, info: DirectoryInfo, cur: Any = None) -> str:
@@ -278,171 +566,457 @@ class ChoculaDatabase:
         - no-match
         """
 
-        info = self.issn_db.munge_issns(info)
-        if not (info.issnl or info.raw_issn or info.issne or info.issnp):
-            return "missing-issn"
-        if not info.issnl:
-            return "no-match"
+        return self.insert_directory_batch([info], cur=cur)[0]
 
+    def insert_directory_batch(
+        self,
+        infos: List[DirectoryInfo],
+        cur: Any = None,
+        counts: Optional[Counter] = None,
+    ) -> List[str]:
+        """
+        Batch version of insert_directory(): munges the ISSNs of all the info
+        objects in one pass, then inserts them (and their homepage URLs) with
+        one executemany() per table.
+
+        Duplicates (against existing rows, or earlier in the same batch) are
+        found up front with a single query, instead of by catching an
+        IntegrityError for each row.
+
+        Returns a list of statuses, one per info object. If counts is passed,
+        "no-match" records where an ISSN looks like a typo of a known ISSN (see
+        IssnDatabase.repair_issnl()) are also counted there, as
+        "no-match-repairable".
+        """
+        infos = self.issn_db.munge_issns_batch(infos)
         if not cur:
             cur = self.db.cursor()
 
-        try:
-            cur.execute("INSERT INTO directory VALUES (?,?,?,?,?)", info.to_db_tuple())
-        except sqlite3.IntegrityError as ie:
-            if str(ie).startswith("UNIQUE"):
-                return "duplicate"
-            raise ie
-
-        for url in info.homepage_urls:
-            self.insert_homepage(info.issnl, url, cur)
+        seen = self._existing_directory_keys(
+            [(info.issnl, info.directory_slug) for info in infos if info.issnl], cur
+        )
+        statuses: List[str] = []
+        new_infos: List[Tuple[str, DirectoryInfo]] = []
+        for info in infos:
+            issnl = info.issnl
+            if not (issnl or info.raw_issn or info.issne or info.issnp):
+                statuses.append("missing-issn")
+                continue
+            if not issnl:
+                statuses.append("no-match")
+                if counts is not None and self._is_repairable(info):
+                    counts["no-match-repairable"] += 1
+                continue
+            key = (issnl, info.directory_slug)
+            if key in seen:
+                statuses.append("duplicate")
+                continue
+            seen.add(key)
+            new_infos.append((issnl, info))
+            statuses.append("inserted")
+
+        if new_infos:
+            cur.executemany(
+                "INSERT OR IGNORE INTO directory VALUES (?,?,?,?,?)",
+                [info.to_db_tuple() for _, info in new_infos],
+            )
+            ignored = len(new_infos) - cur.rowcount
+            if ignored:
+                # duplicates were filtered out above, so this only happens if
+                # rows got inserted behind our back (eg, by another connection)
+                print(
+                    f"{ignored} new directory rows already existed, not inserted",
+                    file=sys.stderr,
+                )
+                if counts is not None:
+                    counts["insert-ignored"] += ignored
+            homepage_rows: Dict[str, List[Tuple]] = dict()
+            for issnl, info in new_infos:
+                homepage_rows.setdefault(info.directory_slug, []).extend(
+                    url.to_db_tuple(issnl) for url in info.homepage_urls
+                )
+            for slug, rows in homepage_rows.items():
+                self.insert_homepage_batch(rows, cur, slug=slug)
+        return statuses
 
+    def _existing_directory_keys(
+        self, keys: List[Tuple[str, str]], cur: Any
+    ) -> Set[Tuple[str, str]]:
+        """
+        Returns the subset of (issnl, slug) keys which already exist in the
+        directory table.
+        """
+        existing: Set[Tuple[str, str]] = set()
+        by_slug: Dict[str, Set[str]] = dict()
+        for issnl, slug in keys:
+            by_slug.setdefault(slug, set()).add(issnl)
+        for slug, issnls in by_slug.items():
+            issnl_list = list(issnls)
+            # stay well under the SQLite bound parameter limit
+            for i in range(0, len(issnl_list), 500):
+                batch = issnl_list[i : i + 500]
+                placeholders = ",".join("?" * len(batch))
+                cur.execute(
+                    f"SELECT issnl FROM directory WHERE slug = ? AND issnl IN ({placeholders})",
+                    [slug] + batch,
+                )
+                existing.update((row[0], slug) for row in cur.fetchall())
+        return existing
+
+    def _is_repairable(self, info: DirectoryInfo) -> bool:
+        for issn in (info.raw_issn, info.issne, info.issnp):
+            if issn and self.issn_db.repair_issnl(issn):
+                return True
+        return False
+
+    def insert_homepage(
+        self, issnl: str, homepage: HomepageUrl, cur: Any, slug: Optional[str] = None
+    ) -> str:
+        self.insert_homepage_batch([homepage.to_db_tuple(issnl)], cur, slug=slug)
         return "inserted"
 
-    def insert_homepage(self, issnl: str, homepage: HomepageUrl, cur: Any) -> str:
+    def insert_homepage_batch(
+        self, rows: List[Tuple], cur: Any, slug: Optional[str] = None
+    ) -> None:
+        """
+        Inserts rows from HomepageUrl.to_db_tuple(). Existing rows with the
+        same (issnl, surt) get replaced.
 
-        try:
-            cur.execute(
-                "INSERT OR REPLACE INTO homepage (issnl, surt, url, host, domain, suffix) VALUES (?,?,?,?,?,?)",
-                homepage.to_db_tuple(issnl),
+        If a source slug is passed, it gets recorded (in the homepage_source
+        table) as one of the sources of each row; see delete_source().
+        """
+        cur.executemany(
+            "INSERT OR REPLACE INTO homepage (issnl, surt, url, host, domain, suffix) VALUES (?,?,?,?,?,?)",
+            rows,
+        )
+        if slug:
+            cur.executemany(
+                "INSERT OR IGNORE INTO homepage_source (issnl, surt, slug) VALUES (?,?,?)",
+                [(row[0], row[1], slug) for row in rows],
             )
-        except sqlite3.IntegrityError as ie:
-            if str(ie).startswith("UNIQUE"):
-                return "duplicate"
-            raise ie
 
-        return "inserted"
+    def source_changed(self, slug: str, paths: List[str]) -> bool:
+        """
+        Checks the given source files against the fingerprints recorded by
+        record_source(). Files with the same size and mtime are assumed to be
+        unchanged; otherwise the content hash gets compared (and, if that
+        still matches, the new mtime recorded).
+        """
+        state = {
+            row[0]: row[1:]
+            for row in self.db.execute(
+                "SELECT path, size, mtime_ns, hash FROM source_state WHERE slug = ?",
+                [slug],
+            )
+        }
+        if set(state) != set(paths) or STDIN_PATH in paths:
+            return True
+        for path in paths:
+            current = file_fingerprint(source_file_path(path), with_hash=False)
+            size, mtime_ns, sha1 = state[path]
+            if current.size != size:
+                return True
+            if current.mtime_ns != mtime_ns:
+                if file_fingerprint(source_file_path(path)).sha1 != sha1:
+                    return True
+                self.db.execute(
+                    "UPDATE source_state SET mtime_ns = ? WHERE slug = ? AND path = ?",
+                    [current.mtime_ns, slug, path],
+                )
+        self.db.commit()
+        return False
+
+    def source_counts(self, slug: str) -> Counter:
+        """
+        Returns the counts recorded by record_source() for a source.
+        """
+        row = self.db.execute(
+            "SELECT counts FROM source_state WHERE slug = ? LIMIT 1", [slug]
+        ).fetchone()
+        return Counter(jsonio.loads(row[0])) if row and row[0] else Counter()
+
+    def record_source(self, slug: str, paths: List[str], counts: Counter) -> None:
+        """
+        Records the fingerprints of the files a source was just loaded from,
+        along with the resulting counts. Sources read from stdin can't be
+        fingerprinted, so they never get recorded (or skipped).
+        """
+        self.db.execute("DELETE FROM source_state WHERE slug = ?", [slug])
+        if STDIN_PATH in paths:
+            self.db.commit()
+            return
+        rows = []
+        for path in paths:
+            fp = file_fingerprint(source_file_path(path))
+            rows.append(
+                (slug, path, fp.size, fp.mtime_ns, fp.sha1, jsonio.dumps(counts))
+            )
+        self.db.executemany(
+            "INSERT INTO source_state (slug, path, size, mtime_ns, hash, counts) VALUES (?,?,?,?,?,?)",
+            rows,
+        )
+        self.db.commit()
+
+    def delete_source(self, slug: str) -> None:
+        """
+        Deletes the directory rows of a source, along with any homepage rows
+        which no other source contributed, so the source can be loaded again.
+
+        Doesn't commit, so that deleting and re-loading can happen in a single
+        transaction.
+        """
+        self.db.execute("DELETE FROM directory WHERE slug = ?", [slug])
+        self.db.execute(
+            """
+            DELETE FROM homepage WHERE
+                EXISTS (SELECT 1 FROM homepage_source s WHERE s.issnl = homepage.issnl AND s.surt = homepage.surt AND s.slug = ?)
+                AND NOT EXISTS (SELECT 1 FROM homepage_source s WHERE s.issnl = homepage.issnl AND s.surt = homepage.surt AND s.slug != ?)
+            """,
+            [slug, slug],
+        )
+        self.db.execute("DELETE FROM homepage_source WHERE slug = ?", [slug])
+        self.db.execute("DELETE FROM source_state WHERE slug = ?", [slug])
+
+    def stage_json_lines(
+        self, cur: Any, path: str, table: str, key: str, counts: Counter
+    ) -> None:
+        """
+        Bulk-loads the non-blank lines of a JSON lines file, unparsed, in to a
+        temporary (key, doc) table, keyed by the given top-level field. If a
+        key appears more than once, the last line wins.
+
+        Counts all lines as "total", and lines which were superseded as
+        "duplicate-{key}". Lines without the key field (or with it empty) are
+        counted as "missing-{key}" and dropped.
+        """
+        cur.execute(
+            f"CREATE TEMP TABLE IF NOT EXISTS {table} (key TEXT PRIMARY KEY, doc TEXT NOT NULL)"
+        )
+        cur.execute(f"DELETE FROM {table}")
+
+        def lines() -> Iterator[Tuple[str]]:
+            for line in open_source(path):
+                if not line.strip():
+                    continue
+                counts["total"] += 1
+                yield (line,)
+
+        cur.executemany(
+            f"INSERT OR REPLACE INTO {table} (key, doc) VALUES (json_extract(?1, '$.{key}'), ?1)",
+            lines(),
+        )
+        staged = cur.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+        counts[f"duplicate-{key}"] = counts["total"] - staged
+        cur.execute(f"DELETE FROM {table} WHERE key IS NULL OR key = ''")
+        if cur.rowcount:
+            counts[f"missing-{key}"] = cur.rowcount
 
     def load_homepage_status(self, config: ChoculaConfig) -> Counter:
+        """
+        Applies homepage crawl results (JSON lines, keyed by url) to all
+        homepage rows with a matching url. If a url appears more than once,
+        the last line wins.
+
+        Lines are bulk-loaded as-is in to a temporary staging table, and then
+        parsed and applied to the homepage table by a single UPDATE (with a
+        correlated subquery, rather than UPDATE ... FROM, which needs SQLite
+        3.33+).
+        """
         print("##### Loading IA Homepage Crawl Results...")
         counts: Counter = Counter()
         cur = self.db.cursor()
-        for line in open(config.homepage_status.filepath, "r"):
-            if not line.strip():
-                continue
-            row = json.loads(line)
-            counts["total"] += 1
-            url = row["url"]
-            assert url
-            if not (
-                row.get("gwb_url_success_dt")
-                and row["gwb_url_success_dt"].isdigit()
-                and len(row["gwb_url_success_dt"]) == 14
-            ):
-                row["gwb_url_success_dt"] = None
-            if not (
-                row.get("gwb_terminal_url_success_dt")
-                and row["gwb_terminal_url_success_dt"]
-                and len(row["gwb_terminal_url_success_dt"]) == 14
-            ):
-                row["gwb_terminal_url_success_dt"] = None
-            cur.execute(
-                "UPDATE homepage SET status_code=?, crawl_error=?, terminal_url=?, terminal_status_code=?, platform_software=?, issnl_in_body=?, blocked=?, gwb_url_success_dt=?, gwb_terminal_url_success_dt=? WHERE url=?",
-                (
-                    row.get("status_code") or -1,
-                    row.get("crawl_error"),
-                    row.get("terminal_url"),
-                    row.get("terminal_status_code"),
-                    row.get("platform_software"),
-                    row.get("issnl_in_body"),
-                    row.get("blocked"),
-                    row.get("gwb_url_success_dt"),
-                    row.get("gwb_terminal_url_success_dt"),
-                    url,
-                ),
+        self.stage_json_lines(
+            cur,
+            config.homepage_status.filepath,
+            "homepage_status_staging",
+            "url",
+            counts,
+        )
+        counts["no-match"] = cur.execute(
+            """
+            SELECT COUNT(*) FROM homepage_status_staging s
+            WHERE NOT EXISTS (SELECT 1 FROM homepage WHERE homepage.url = s.key)
+            """
+        ).fetchone()[0]
+        cur.execute(
+            """
+            UPDATE homepage SET (
+                status_code,
+                crawl_error,
+                terminal_url,
+                terminal_status_code,
+                platform_software,
+                issnl_in_body,
+                blocked,
+                gwb_url_success_dt,
+                gwb_terminal_url_success_dt
+            ) = (
+                SELECT
+                    COALESCE(NULLIF(json_extract(s.doc, '$.status_code'), 0), -1),
+                    json_extract(s.doc, '$.crawl_error'),
+                    json_extract(s.doc, '$.terminal_url'),
+                    json_extract(s.doc, '$.terminal_status_code'),
+                    json_extract(s.doc, '$.platform_software'),
+                    json_extract(s.doc, '$.issnl_in_body'),
+                    json_extract(s.doc, '$.blocked'),
+                    CASE
+                        WHEN typeof(json_extract(s.doc, '$.gwb_url_success_dt')) = 'text'
+                            AND length(json_extract(s.doc, '$.gwb_url_success_dt')) = 14
+                            AND json_extract(s.doc, '$.gwb_url_success_dt') NOT GLOB '*[^0-9]*'
+                        THEN json_extract(s.doc, '$.gwb_url_success_dt')
+                        END,
+                    CASE
+                        WHEN typeof(json_extract(s.doc, '$.gwb_terminal_url_success_dt')) = 'text'
+                            AND length(json_extract(s.doc, '$.gwb_terminal_url_success_dt')) = 14
+                        THEN json_extract(s.doc, '$.gwb_terminal_url_success_dt')
+                        END
+                FROM homepage_status_staging AS s
+                WHERE s.key = homepage.url
             )
-            counts["updated"] += 1
+            WHERE url IN (SELECT key FROM homepage_status_staging)
+            """
+        )
+        counts["updated"] = cur.rowcount
+        cur.execute("DELETE FROM homepage_status_staging")
         cur.close()
         self.db.commit()
         return counts
 
-    def load_fatcat_containers(self, config: ChoculaConfig) -> Counter:
+    def load_fatcat_containers(
+        self,
+        config: ChoculaConfig,
+        workers: int = 1,
+        chunk_bytes: int = FATCAT_CONTAINERS_CHUNK_BYTES,
+    ) -> Counter:
+        """
+        Loads active containers from a fatcat container export (JSON lines),
+        along with the homepage URLs of those with an ISSN-L. Containers
+        replace any existing row with the same ident.
+
+        The file gets split into byte-range chunks (on line boundaries),
+        which are parsed (see parse_fatcat_containers()) in a pool of worker
+        processes if workers > 1. This process inserts the results in file
+        order, so the outcome is the same as a serial load.
+        """
         print("##### Loading Fatcat Container Entities...")
-        # JSON
-        json_file = open(config.fatcat_containers.filepath, "r")
+        path = config.fatcat_containers.filepath
         counts: Counter = Counter()
         cur = self.db.cursor()
-        for line in json_file:
-            if not line:
-                continue
-            row = json.loads(line)
-            if row["state"] != "active":
-                continue
-            counts["total"] += 1
-            extra = row.get("extra", dict())
-            issne = extra.get("issne")
-            issnp = extra.get("issnp")
-            country = extra.get("country")
-            languages = extra.get("languages", [])
-            lang = None
-            if languages:
-                lang = languages[0]
-            try:
-                cur.execute(
-                    "INSERT OR REPLACE INTO fatcat_container (issnl, ident, revision, issne, issnp, wikidata_qid, name, container_type, publisher, country, lang) VALUES (?,?,?,?,?,?,?,?,?,?,?)",
-                    (
-                        row.get("issnl"),
-                        row["ident"],
-                        row["revision"],
-                        issne,
-                        issnp,
-                        row.get("wikidata_qid"),
-                        row["name"],
-                        row.get("container_type"),
-                        extra.get("publisher"),
-                        country,
-                        lang,
-                    ),
-                )
-            except sqlite3.IntegrityError as ie:
-                if str(ie).startswith("UNIQUE"):
-                    counts["existing"] += 1
-                    continue
-                else:
-                    raise ie
-            counts["inserted"] += 1
-            if row.get("issnl"):
-                urls = extra.get("urls", [])
-                for url in urls:
-                    homepage = HomepageUrl.from_url(url)
-                    if homepage:
-                        self.insert_homepage(row.get("issnl"), homepage, cur)
+        offsets = line_chunk_offsets(path, chunk_bytes)
+        if workers > 1 and len(offsets) > 1:
+            with ProcessPoolExecutor(
+                max_workers=min(workers, len(offsets))
+            ) as executor:
+                futures = [
+                    executor.submit(parse_fatcat_containers, path, start, end)
+                    for start, end in offsets
+                ]
+                for future in futures:
+                    self.insert_fatcat_containers(*future.result(), counts, cur)
+        else:
+            for start, end in offsets:
+                result = parse_fatcat_containers(path, start, end)
+                self.insert_fatcat_containers(*result, counts, cur)
         cur.close()
         self.db.commit()
         return counts
 
+    def insert_fatcat_containers(
+        self,
+        chunk_counts: Counter,
+        container_rows: List[Tuple],
+        homepage_rows: List[Tuple],
+        counts: Counter,
+        cur: Any,
+    ) -> None:
+        counts.update(chunk_counts)
+        cur.executemany(FATCAT_CONTAINER_INSERT_SQL, container_rows)
+        counts["inserted"] += len(container_rows)
+        self.insert_homepage_batch(homepage_rows, cur, slug="fatcat")
+
     def load_fatcat_stats(self, config: ChoculaConfig) -> Counter:
+        """
+        Applies fatcat container release stats (JSON lines, keyed by issnl) to
+        all containers with a matching ISSN-L. If an ISSN-L appears more than
+        once, the last line wins.
+
+        As with load_homepage_status(), lines get bulk-loaded in to a staging
+        table, then parsed and applied (with the fractions computed in SQL)
+        by a single UPDATE with a correlated subquery. Stats for ISSN-Ls
+        without a container are counted as "no-match".
+        """
         print("##### Loading Fatcat Container Stats...")
-        # JSON
-        json_file = open(config.fatcat_stats.filepath, "r")
         counts: Counter = Counter()
         cur = self.db.cursor()
-        for line in json_file:
-            if not line:
-                continue
-            row = json.loads(line)
-            total = int(row["total"])
-            ia_frac: Optional[float] = None
-            preserved_frac: Optional[float] = None
-            if total > 0:
-                ia_frac = float(row["in_web"]) / total
-                preserved_frac = float(row["is_preserved"]) / total
-            cur.execute(
-                "UPDATE fatcat_container SET release_count = ?, ia_count = ?, ia_frac = ?, preserved_count = ?, preserved_frac = ? WHERE issnl = ?",
-                (
-                    total,
-                    row["in_web"],
-                    ia_frac,
-                    row["is_preserved"],
-                    preserved_frac,
-                    row["issnl"],
-                ),
+        self.stage_json_lines(
+            cur, config.fatcat_stats.filepath, "fatcat_stats_staging", "issnl", counts
+        )
+        counts["no-match"] = cur.execute(
+            """
+            SELECT COUNT(*) FROM fatcat_stats_staging s
+            WHERE NOT EXISTS (SELECT 1 FROM fatcat_container WHERE fatcat_container.issnl = s.key)
+            """
+        ).fetchone()[0]
+        cur.execute(
+            """
+            UPDATE fatcat_container SET (
+                release_count,
+                ia_count,
+                ia_frac,
+                preserved_count,
+                preserved_frac
+            ) = (
+                SELECT
+                    s.total,
+                    s.in_web,
+                    CASE WHEN s.total > 0 THEN CAST(s.in_web AS REAL) / s.total END,
+                    s.is_preserved,
+                    CASE WHEN s.total > 0 THEN CAST(s.is_preserved AS REAL) / s.total END
+                FROM (
+                    SELECT
+                        CAST(json_extract(doc, '$.total') AS INTEGER) AS total,
+                        json_extract(doc, '$.in_web') AS in_web,
+                        json_extract(doc, '$.is_preserved') AS is_preserved
+                    FROM fatcat_stats_staging
+                    WHERE key = fatcat_container.issnl
+                ) AS s
             )
-            counts["updated"] += 1
+            WHERE issnl IN (SELECT key FROM fatcat_stats_staging)
+            """
+        )
+        counts["updated"] = cur.rowcount
+        cur.execute("DELETE FROM fatcat_stats_staging")
         cur.close()
         self.db.commit()
         return counts
 
+    def fix_issnl(self) -> Counter:
+        """
+        Prints a TSV of fatcat containers with an invalid (by checksum)
+        ISSN-L, and the corrected ISSN-L if the invalid one looks like a typo
+        of a known ISSN. Output is in the format consumed by
+        extra/fix_invalid_issnl.py; fixed_issnl is blank if there is no
+        (unambiguous) fix.
+        """
+        counts: Counter = Counter()
+        self.db.row_factory = sqlite3.Row
+        cur = self.db.execute(
+            "SELECT issnl, ident, name FROM fatcat_container WHERE issnl IS NOT NULL ORDER BY issnl;"
+        )
+        print("\t".join(("fixed_issnl", "issnl", "fatcat_ident", "name")))
+        for row in cur:
+            counts["total"] += 1
+            if stdnum.issn.is_valid(row["issnl"]):
+                counts["valid"] += 1
+                continue
+            counts["invalid"] += 1
+            fixed_issnl = self.issn_db.repair_issnl(row["issnl"]) or ""
+            if fixed_issnl:
+                counts["fixed"] += 1
+            name = " ".join((row["name"] or "").split())
+            print("\t".join((fixed_issnl, row["issnl"], row["ident"], name)))
+        return counts
+
     def export_urls(self) -> Counter:
         counts: Counter = Counter()
         cur = self.db.cursor()
@@ -455,217 +1029,356 @@ class ChoculaDatabase:
             print("\t".join((hrow["issnl"], hrow["url"])))
         return counts
 
-    def summarize(self) -> Counter:
-        print("##### Summarizing Everything...")
+    def summarize(self, workers: int = 1, incremental: bool = False) -> Counter:
+        """
+        (Re-)builds the journal table, with one row per ISSN-L which appears
+        in fatcat or any directory (except if only in hathitrust).
+
+        With workers > 1, ISSN-L ranges get summarized in parallel by worker
+        processes (see summarize_parallel()); this process writes all the
+        rows. In-memory databases are always summarized serially.
+
+        With incremental, only ISSN-Ls in the dirty_issnl table (filled by
+        triggers on the directory, homepage and fatcat_container tables) are
+        re-summarized, and their journal rows are removed if they no longer
+        qualify. Either way, dirty_issnl is empty afterwards.
+        """
         counts: Counter = Counter()
-        cur = self.db.cursor()
         self.db.row_factory = sqlite3.Row
-        # don't include new journals if they are *only* in hathitrust KBART
-        index_issnls = list(
-            cur.execute(
-                "SELECT DISTINCT issnl FROM directory WHERE slug != 'hathitrust'"
+        where = "1"
+        if incremental:
+            print("##### Summarizing Changed ISSN-Ls...")
+            where = "issnl IN (SELECT issnl FROM dirty_issnl)"
+            self.db.execute(f"DELETE FROM journal WHERE {where}")
+        else:
+            print("##### Summarizing Everything...")
+        total = self.db.execute(
+            f"SELECT COUNT(*) FROM ({SUMMARIZE_ISSNLS_SQL}) WHERE {where}"
+        ).fetchone()[0]
+        print("{} total ISSN-Ls".format(total))
+        if workers > 1 and self.db_file != ":memory:":
+            self.summarize_parallel(counts, workers, where)
+        else:
+            self.insert_journal_rows(self.summarize_rows(counts, where))
+        self.db.execute("DELETE FROM dirty_issnl")
+        self.db.commit()
+        return counts
+
+    def insert_journal_rows(self, rows: Iterable[Tuple]) -> None:
+        cur = self.db.cursor()
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= SUMMARIZE_BATCH_SIZE:
+                cur.executemany(JOURNAL_INSERT_SQL, batch)
+                batch = []
+        if batch:
+            cur.executemany(JOURNAL_INSERT_SQL, batch)
+        cur.close()
+        self.db.commit()
+
+    def summarize_parallel(
+        self, counts: Counter, workers: int, where: str = "1", params: Tuple = ()
+    ) -> None:
+        """
+        Splits the ISSN-Ls (optionally limited by a where clause, as for
+        summarize_rows()) in to ranges, each summarized by a worker process
+        with its own read-only connection, and inserts the resulting rows (in
+        ISSN-L order) as they come back.
+
+        So that workers can read while this connection writes, the database
+        is temporarily switched out of exclusive locking mode (see init_db())
+        and in to WAL journal mode.
+        """
+        self.db.commit()
+        locking_mode = self.db.execute("PRAGMA main.locking_mode").fetchone()[0]
+        self.db.execute("PRAGMA main.locking_mode = NORMAL")
+        # any lock held in exclusive mode only gets released on the next access
+        self.db.execute("SELECT 1 FROM sqlite_master LIMIT 1").fetchall()
+        journal_mode = self.db.execute("PRAGMA main.journal_mode").fetchone()[0]
+        self.db.execute("PRAGMA main.journal_mode = WAL")
+        try:
+            shards = self.summarize_shards(
+                workers * SUMMARIZE_SHARDS_PER_WORKER, where, params
             )
-        )
-        fatcat_issnls = list(
-            cur.execute(
-                "SELECT DISTINCT issnl FROM fatcat_container WHERE issnl IS NOT null"
+            with ProcessPoolExecutor(
+                max_workers=workers,
+                initializer=_init_summarize_worker,
+                initargs=(self.db_file, self.issn_db),
+            ) as executor:
+                for shard_counts, rows in executor.map(_summarize_shard, shards):
+                    counts.update(shard_counts)
+                    self.insert_journal_rows(rows)
+        finally:
+            self.db.commit()
+            self.db.execute(f"PRAGMA main.journal_mode = {journal_mode}")
+            self.db.execute(f"PRAGMA main.locking_mode = {locking_mode}")
+
+    def summarize_shards(
+        self, count: int, where: str = "1", params: Tuple = ()
+    ) -> List[Tuple[str, Tuple]]:
+        """
+        Returns up to count (where, params) pairs for summarize_rows(), each
+        covering a range of roughly the same number of ISSN-Ls, together
+        covering all of the ISSN-Ls matching the given where clause.
+        """
+        issnls = [
+            row[0]
+            for row in self.db.execute(
+                f"SELECT issnl FROM ({SUMMARIZE_ISSNLS_SQL}) WHERE {where} ORDER BY issnl",
+                params,
             )
-        )
-        all_issnls = set([i[0] for i in index_issnls + fatcat_issnls])
-        print("{} total ISSN-Ls".format(len(all_issnls)))
-        for issnl in all_issnls:
-            # print(issnl)
-            counts["total"] += 1
-
-            out = dict()
+        ]
+        if not issnls:
+            return [(where, params)]
+        bounds = sorted(set(issnls[i * len(issnls) // count] for i in range(1, count)))
+        if not bounds:
+            return [(where, params)]
+        ranges: List[Tuple[str, Tuple[Any, ...]]] = [("issnl < ?", (bounds[0],))]
+        for low, high in zip(bounds, bounds[1:]):
+            ranges.append(("issnl >= ? AND issnl < ?", (low, high)))
+        ranges.append(("issnl >= ?", (bounds[-1],)))
+        return [
+            (f"({where}) AND {range_where}", params + range_params)
+            for range_where, range_params in ranges
+        ]
+
+    def summarize_rows(
+        self, counts: Counter, where: str = "1", params: Sequence = ()
+    ) -> Iterator[Tuple]:
+        """
+        Yields journal table rows (in JOURNAL_INSERT_SQL column order), in
+        ISSN-L order.
+
+        Instead of querying each table for every ISSN-L, the fatcat, directory
+        and homepage tables are each read in a single pass ordered by ISSN-L
+        (which their indexes already give), and merged here. The optional
+        where clause (SQL with params, on the issnl column) limits which
+        ISSN-Ls get summarized.
+        """
 
-            # check if ISSN-L is good. this is here because of fatcat import
-            out["known_issnl"] = self.issn_db.issn2issnl(issnl) == issnl
-            if not out["known_issnl"]:
-                counts["unknown-issnl"] += 1
-            out["valid_issnl"] = stdnum.issn.is_valid(issnl)
-            if not out["valid_issnl"]:
-                counts["invalid-issnl"] += 1
+        def stream(query: str, query_params: Sequence) -> IssnlGroups:
+            cur = self.db.cursor()
+            cur.row_factory = sqlite3.Row
+            return IssnlGroups(cur.execute(query, query_params))
 
-            fatcat_row = list(
-                self.db.execute(
-                    "SELECT * FROM fatcat_container WHERE issnl = ?;", [issnl]
-                )
+        params = tuple(params)
+        fatcat = stream(
+            f"SELECT * FROM fatcat_container WHERE issnl IS NOT NULL AND ({where}) ORDER BY issnl, rowid",
+            params,
+        )
+        directory = stream(
+            f"SELECT * FROM directory WHERE {where} ORDER BY issnl, slug", params
+        )
+        homepage = stream(
+            f"SELECT * FROM homepage WHERE {where} ORDER BY issnl, surt", params
+        )
+        issnls = self.db.cursor().execute(
+            f"SELECT issnl FROM ({SUMMARIZE_ISSNLS_SQL}) WHERE {where} ORDER BY issnl",
+            params,
+        )
+        for (issnl,) in issnls:
+            yield self.summarize_journal(
+                issnl,
+                fatcat.get(issnl),
+                directory.get(issnl),
+                homepage.get(issnl),
+                counts,
             )
-            if fatcat_row:
-                frow = fatcat_row[0]
-                out["fatcat_ident"] = frow["ident"]
+
+    def summarize_journal(
+        self,
+        issnl: str,
+        fatcat_rows: List[sqlite3.Row],
+        directory_rows: List[sqlite3.Row],
+        homepage_rows: List[sqlite3.Row],
+        counts: Counter,
+    ) -> Tuple:
+        """
+        Merges all the rows for a single ISSN-L in to a journal table row.
+        """
+        counts["total"] += 1
+
+        out = dict()
+
+        # check if ISSN-L is good. this is here because of fatcat import
+        out["known_issnl"] = self.issn_db.issn2issnl(issnl) == issnl
+        if not out["known_issnl"]:
+            counts["unknown-issnl"] += 1
+        out["valid_issnl"] = stdnum.issn.is_valid(issnl)
+        if not out["valid_issnl"]:
+            counts["invalid-issnl"] += 1
+
+        if fatcat_rows:
+            frow = fatcat_rows[0]
+            out["fatcat_ident"] = frow["ident"]
+            for k in (
+                "name",
+                "publisher",
+                "issne",
+                "issnp",
+                "wikidata_qid",
+                "lang",
+                "country",
+                "release_count",
+                "ia_count",
+                "ia_frac",
+                "kbart_count",
+                "kbart_frac",
+                "preserved_count",
+                "preserved_frac",
+            ):
+                if not out.get(k) and frow[k] != None:
+                    out[k] = frow[k]
+
+        for irow in directory_rows:
+            if irow["slug"] in ("crossref",):
+                out["has_dois"] = True
+            # TODO: other DOI registrars (japan, datacite)
+            if irow["slug"] == "wikidata":
+                out["wikidata_qid"] = irow["identifier"]
+            if irow["slug"] in ("vanished_disapeared", "vanished_inactive"):
+                out["is_active"] = False
+            elif irow["slug"] in ("doaj"):
+                # inactive publications get removed from DOAJ
+                out["is_active"] = True
+            for k in ("name",):
+                if not out.get(k) and irow[k]:
+                    out[k] = irow[k]
+            if irow["extra"]:
+                extra = jsonio.loads(irow["extra"])
                 for k in (
-                    "name",
-                    "publisher",
+                    "country",
                     "issne",
                     "issnp",
-                    "wikidata_qid",
-                    "lang",
-                    "country",
-                    "release_count",
-                    "ia_count",
-                    "ia_frac",
-                    "kbart_count",
-                    "kbart_frac",
-                    "preserved_count",
-                    "preserved_frac",
-                ):
-                    if not out.get(k) and frow[k] != None:
-                        out[k] = frow[k]
-
-            cur = self.db.execute("SELECT * FROM directory WHERE issnl = ?;", [issnl])
-            for irow in cur:
-                if irow["slug"] in ("crossref",):
-                    out["has_dois"] = True
-                # TODO: other DOI registrars (japan, datacite)
-                if irow["slug"] == "wikidata":
-                    out["wikidata_qid"] = irow["identifier"]
-                if irow["slug"] in ("vanished_disapeared", "vanished_inactive"):
-                    out["is_active"] = False
-                elif irow["slug"] in ("doaj"):
-                    # inactive publications get removed from DOAJ
-                    out["is_active"] = True
-                for k in ("name",):
-                    if not out.get(k) and irow[k]:
-                        out[k] = irow[k]
-                if irow["extra"]:
-                    extra = json.loads(irow["extra"])
-                    for k in (
-                        "country",
-                        "issne",
-                        "issnp",
-                        "publisher",
-                        "platform",
-                        "original_name",
-                    ):
-                        if not out.get(k) and extra.get(k):
-                            out[k] = extra[k]
-                    if not out.get("lang") and extra.get("langs") and extra["langs"][0]:
-                        out["lang"] = extra["langs"][0]
-                if irow["slug"] in ("doaj", "road", "szczepanski", "gold_oa"):
-                    out["is_oa"] = True
-                if irow["slug"] == "sherpa_romeo":
-                    extra = json.loads(irow["extra"])
-                    if extra.get("color"):
-                        out["sherpa_color"] = extra["color"]
-                        if extra["color"] == "green":
-                            out["is_oa"] = True
-
-            # filter out "NA" ISSNs
-            for k in ("issne", "issnp"):
-                if out.get(k) and (len(out[k]) != 9 or out[k][4] != "-"):
-                    out.pop(k)
-
-            cur = self.db.execute("SELECT * FROM homepage WHERE issnl = ?;", [issnl])
-            for hrow in cur:
-                out["any_homepage"] = True
-                if (
-                    hrow["terminal_status_code"] == 200
-                    and hrow["host"] != "web.archive.org"
+                    "publisher",
+                    "platform",
+                    "original_name",
                 ):
-                    out["any_live_homepage"] = True
-                if hrow["gwb_url_success_dt"] or hrow["gwb_terminal_url_success_dt"]:
-                    out["any_gwb_homepage"] = True
-                if not out.get("platform"):
-                    if hrow["domain"] == "wordpress.com":
-                        out["platform"] = "wordpress"
-                    elif hrow["domain"] == "hypotheses.org":
-                        out["platform"] = "hypotheses"
-
-            if out.get("wikidata_qid"):
-                assert out["wikidata_qid"].startswith("Q")
-                assert out["wikidata_qid"][1].isdigit()
-                assert out["wikidata_qid"][-1].isdigit()
-
-            # define publisher types
-            publisher = out.get("publisher")
-            pl = out.get("publisher", "").lower().strip()
-            if out.get("platform") == "scielo":
-                out["publisher_type"] = "scielo"
-            elif (
-                publisher in BIG5_PUBLISHERS
-                or "elsevier" in pl
-                or "springer" in pl
-                or "wiley" in pl
-            ):
-                out["publisher_type"] = "big5"
-            elif publisher in OA_PUBLISHERS:
-                out["publisher_type"] = "oa"
-            elif (
-                publisher in COMMERCIAL_PUBLISHERS
-                or "wolters kluwer" in pl
-                or "wolters-kluwer" in pl
-            ):
-                out["publisher_type"] = "commercial"
-            elif publisher in ARCHIVE_PUBLISHERS:
-                out["publisher_type"] = "archive"
-            elif publisher in REPOSITORY_PUBLISHERS or "repository" in pl:
-                out["publisher_type"] = "repository"
-            elif publisher in OTHER_PUBLISHERS:
-                out["publisher_type"] = "other"
-            elif (
-                publisher in SOCIETY_PUBLISHERS
-                or "society" in pl
-                or "association" in pl
-                or "academy of " in pl
-                or "institute of" in pl
-                or "ieee" in pl
-                or "ieee" in out.get("name", "")
-            ):
-                out["publisher_type"] = "society"
-            elif publisher in UNI_PRESS_PUBLISHERS or "university " in pl or "universität" in pl:
-                out["publisher_type"] = "unipress"
-            elif "scielo" in pl:
-                out["publisher_type"] = "scielo"
-            elif out.get("is_oa") and (
-                not out.get("has_dois")
-                or out.get("lang") not in (None, "en", "de", "fr", "ja")
-                or out.get("country") not in (None, "us", "gb", "nl", "cn", "jp", "de")
+                    if not out.get(k) and extra.get(k):
+                        out[k] = extra[k]
+                if not out.get("lang") and extra.get("langs") and extra["langs"][0]:
+                    out["lang"] = extra["langs"][0]
+            if irow["slug"] in ("doaj", "road", "szczepanski", "gold_oa"):
+                out["is_oa"] = True
+            if irow["slug"] == "sherpa_romeo":
+                extra = jsonio.loads(irow["extra"])
+                if extra.get("color"):
+                    out["sherpa_color"] = extra["color"]
+                    if extra["color"] == "green":
+                        out["is_oa"] = True
+
+        # filter out "NA" ISSNs
+        for k in ("issne", "issnp"):
+            if out.get(k) and (len(out[k]) != 9 or out[k][4] != "-"):
+                out.pop(k)
+
+        for hrow in homepage_rows:
+            out["any_homepage"] = True
+            if (
+                hrow["terminal_status_code"] == 200
+                and hrow["host"] != "web.archive.org"
             ):
-                # current informal definition of longtail
-                out["publisher_type"] = "longtail"
-                out["is_longtail"] = True
-
-            if out.get("lang"):
-                assert len(out["lang"]) == 2
-
-            cur.execute(
-                "INSERT OR REPLACE INTO journal (issnl, issne, issnp, wikidata_qid, fatcat_ident, name, publisher, country, lang, is_oa, sherpa_color, is_longtail, is_active, publisher_type, has_dois, any_homepage, any_live_homepage, any_gwb_homepage, known_issnl, valid_issnl, release_count, ia_count, ia_frac, kbart_count, kbart_frac, preserved_count, preserved_frac) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)",
-                (
-                    issnl,
-                    out.get("issne"),
-                    out.get("issnp"),
-                    out.get("wikidata_qid"),
-                    out.get("fatcat_ident"),
-                    out.get("name"),
-                    # out.get("original_name"),
-                    out.get("publisher"),
-                    out.get("country"),
-                    out.get("lang"),
-                    out.get("is_oa", False),
-                    out.get("sherpa_color"),
-                    out.get("is_longtail", False),
-                    out.get("is_active"),
-                    out.get("publisher_type"),
-                    out.get("has_dois", False),
-                    out.get("any_homepage", False),
-                    out.get("any_live_homepage", False),
-                    out.get("any_gwb_homepage", False),
-                    out.get("known_issnl"),
-                    out.get("valid_issnl"),
-                    out.get("release_count"),
-                    out.get("ia_count"),
-                    out.get("ia_frac"),
-                    out.get("kbart_count"),
-                    out.get("kbart_frac"),
-                    out.get("preserved_count"),
-                    out.get("preserved_frac"),
-                ),
-            )
-        cur.close()
-        self.db.commit()
-        return counts
+                out["any_live_homepage"] = True
+            if hrow["gwb_url_success_dt"] or hrow["gwb_terminal_url_success_dt"]:
+                out["any_gwb_homepage"] = True
+            if not out.get("platform"):
+                if hrow["domain"] == "wordpress.com":
+                    out["platform"] = "wordpress"
+                elif hrow["domain"] == "hypotheses.org":
+                    out["platform"] = "hypotheses"
+
+        if out.get("wikidata_qid"):
+            assert out["wikidata_qid"].startswith("Q")
+            assert out["wikidata_qid"][1].isdigit()
+            assert out["wikidata_qid"][-1].isdigit()
+
+        # define publisher types
+        publisher = out.get("publisher")
+        pl = out.get("publisher", "").lower().strip()
+        if out.get("platform") == "scielo":
+            out["publisher_type"] = "scielo"
+        elif (
+            publisher in BIG5_PUBLISHERS
+            or "elsevier" in pl
+            or "springer" in pl
+            or "wiley" in pl
+        ):
+            out["publisher_type"] = "big5"
+        elif publisher in OA_PUBLISHERS:
+            out["publisher_type"] = "oa"
+        elif (
+            publisher in COMMERCIAL_PUBLISHERS
+            or "wolters kluwer" in pl
+            or "wolters-kluwer" in pl
+        ):
+            out["publisher_type"] = "commercial"
+        elif publisher in ARCHIVE_PUBLISHERS:
+            out["publisher_type"] = "archive"
+        elif publisher in REPOSITORY_PUBLISHERS or "repository" in pl:
+            out["publisher_type"] = "repository"
+        elif publisher in OTHER_PUBLISHERS:
+            out["publisher_type"] = "other"
+        elif (
+            publisher in SOCIETY_PUBLISHERS
+            or "society" in pl
+            or "association" in pl
+            or "academy of " in pl
+            or "institute of" in pl
+            or "ieee" in pl
+            or "ieee" in out.get("name", "")
+        ):
+            out["publisher_type"] = "society"
+        elif (
+            publisher in UNI_PRESS_PUBLISHERS
+            or "university " in pl
+            or "universität" in pl
+        ):
+            out["publisher_type"] = "unipress"
+        elif "scielo" in pl:
+            out["publisher_type"] = "scielo"
+        elif out.get("is_oa") and (
+            not out.get("has_dois")
+            or out.get("lang") not in (None, "en", "de", "fr", "ja")
+            or out.get("country") not in (None, "us", "gb", "nl", "cn", "jp", "de")
+        ):
+            # current informal definition of longtail
+            out["publisher_type"] = "longtail"
+            out["is_longtail"] = True
+
+        if out.get("lang"):
+            assert len(out["lang"]) == 2
+
+        return (
+            issnl,
+            out.get("issne"),
+            out.get("issnp"),
+            out.get("wikidata_qid"),
+            out.get("fatcat_ident"),
+            out.get("name"),
+            # out.get("original_name"),
+            out.get("publisher"),
+            out.get("country"),
+            out.get("lang"),
+            out.get("is_oa", False),
+            out.get("sherpa_color"),
+            out.get("is_longtail", False),
+            out.get("is_active"),
+            out.get("publisher_type"),
+            out.get("has_dois", False),
+            out.get("any_homepage", False),
+            out.get("any_live_homepage", False),
+            out.get("any_gwb_homepage", False),
+            out.get("known_issnl"),
+            out.get("valid_issnl"),
+            out.get("release_count"),
+            out.get("ia_count"),
+            out.get("ia_frac"),
+            out.get("kbart_count"),
+            out.get("kbart_frac"),
+            out.get("preserved_count"),
+            out.get("preserved_frac"),
+        )
 
     def export(self) -> Counter:
         def dict_factory(cursor, row):
@@ -678,15 +1391,37 @@ class ChoculaDatabase:
         self.db.row_factory = dict_factory
         cur = self.db.cursor()
         for row in cur.execute("SELECT * FROM journal"):
-            print(json.dumps(row))
+            print(jsonio.dumps(row))
             counts["total"] += 1
         return counts
 
-    def export_fatcat(self):
+    def export_fatcat(self, output: Optional[TextIO] = None) -> Counter:
+        """
+        Writes fatcat container JSON documents (one per line) to output
+        (stdout by default), for journals with a valid ISSN-L, in ISSN-L
+        order.
+
+        The journal, homepage and directory tables are each read once,
+        ordered by ISSN-L, and grouped here, instead of querying homepage and
+        directory rows separately for every journal.
+        """
+        if output is None:
+            output = sys.stdout
         counts: Counter = Counter()
         self.db.row_factory = sqlite3.Row
+
+        def stream(query: str) -> IssnlGroups:
+            cur = self.db.cursor()
+            cur.row_factory = sqlite3.Row
+            return IssnlGroups(cur.execute(query))
+
+        homepage = stream("SELECT * FROM homepage ORDER BY issnl, surt")
+        directory = stream("SELECT * FROM directory ORDER BY issnl, slug")
+        lines: List[str] = []
         cur = self.db.cursor()
-        for row in cur.execute("SELECT * FROM journal WHERE valid_issnl = 1"):
+        for row in cur.execute(
+            "SELECT * FROM journal WHERE valid_issnl = 1 ORDER BY issnl"
+        ):
             counts["total"] += 1
 
             name = row["name"]
@@ -733,10 +1468,7 @@ class ChoculaDatabase:
 
             urls = []
             webarchive_urls = []
-            cur = self.db.execute(
-                "SELECT * FROM homepage WHERE issnl = ?;", [row["issnl"]]
-            )
-            for hrow in cur:
+            for hrow in homepage.get(row["issnl"]):
                 if "LOCKSS_RESOLVER" in hrow["url"]:
                     continue
                 if "web.archive.org/web" in hrow["url"]:
@@ -819,13 +1551,10 @@ class ChoculaDatabase:
             extra["webarchive_urls"] = webarchive_urls
             extra["urls"] = urls
 
-            cur = self.db.execute(
-                "SELECT * FROM directory WHERE issnl = ?;", [row["issnl"]]
-            )
-            for drow in cur:
+            for drow in directory.get(row["issnl"]):
                 dextra = dict()
                 if drow["extra"]:
-                    dextra = json.loads(drow["extra"])
+                    dextra = jsonio.loads(drow["extra"])
                 if drow["slug"] == "ezb":
                     extra["ezb"] = dict(
                         ezb_id=drow["identifier"], color=dextra["ezb_color"]
@@ -881,7 +1610,12 @@ class ChoculaDatabase:
                     extra["platform"] = dextra["platform"]
 
             out["extra"] = extra
-            print(json.dumps(out))
+            lines.append(jsonio.dumps(out) + "\n")
+            if len(lines) >= EXPORT_BATCH_SIZE:
+                output.write("".join(lines))
+                lines = []
+        output.write("".join(lines))
+        output.flush()
         return counts
 
     def init_db(self):
@@ -897,3 +1631,68 @@ class ChoculaDatabase:
         with open("chocula_schema.sql", "r") as fschema:
             self.db.executescript(fschema.read())
         print("Done!", file=sys.stderr)
+
+
+# read-only database for summarize worker processes, set by the pool
+# initializer
+_summarize_worker_db: Optional[ChoculaDatabase] = None
+
+
+def _init_summarize_worker(db_file: str, issn_db: IssnDatabase) -> None:
+    global _summarize_worker_db
+    _summarize_worker_db = ChoculaDatabase(db_file, issn_db, read_only=True)
+
+
+def _summarize_shard(shard: Tuple[str, Tuple]) -> Tuple[Counter, List[Tuple]]:
+    assert _summarize_worker_db is not None
+    where, params = shard
+    counts: Counter = Counter()
+    rows = list(_summarize_worker_db.summarize_rows(counts, where, params))
+    return counts, rows
+
+
+def parse_fatcat_containers(
+    path: str, start: int, end: Optional[int]
+) -> Tuple[Counter, List[Tuple], List[Tuple]]:
+    """
+    Parses a byte range (from line_chunk_offsets(), so end may be None) of a
+    fatcat container export. Returns counts, fatcat_container rows (in
+    FATCAT_CONTAINER_INSERT_SQL column order) for the active containers, and
+    homepage rows (from HomepageUrl.to_db_tuple()) for their URLs.
+    """
+    counts: Counter = Counter()
+    container_rows: List[Tuple] = []
+    homepage_rows: List[Tuple] = []
+    for line in iter_line_range(path, start, end):
+        if not line:
+            continue
+        row = jsonio.loads(line)
+        if row["state"] != "active":
+            continue
+        counts["total"] += 1
+        extra = row.get("extra", dict())
+        languages = extra.get("languages", [])
+        lang = None
+        if languages:
+            lang = languages[0]
+        container_rows.append(
+            (
+                row.get("issnl"),
+                row["ident"],
+                row["revision"],
+                extra.get("issne"),
+                extra.get("issnp"),
+                row.get("wikidata_qid"),
+                row["name"],
+                row.get("container_type"),
+                extra.get("publisher"),
+                extra.get("country"),
+                lang,
+            )
+        )
+        if row.get("issnl"):
+            for url in extra.get("urls", []):
+                homepage = HomepageUrl.from_url(url)
+                if homepage:
+                    homepage_rows.append(homepage.to_db_tuple(row["issnl"]))
+    return counts, container_rows, homepage_rows
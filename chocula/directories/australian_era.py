@@ -2,6 +2,7 @@ from typing import Iterable, Optional
 import csv
 
 from chocula.util import clean_str
+from chocula.fileio import open_source
 from chocula.common import DirectoryLoader
 from chocula.database import DirectoryInfo
 
@@ -33,7 +34,7 @@ class AustralianEraLoader(DirectoryLoader):
     source_slug = "australian_era"
 
     def open_file(self) -> Iterable:
-        return csv.DictReader(open(self.config.australian_era.filepath))
+        return csv.DictReader(open_source(self.config.australian_era.filepath))
 
     def parse_record(self, row) -> Optional[DirectoryInfo]:
         info = DirectoryInfo(
@@ -1,7 +1,8 @@
 from typing import Iterable, Optional
-import json
 
 from chocula.util import clean_str, clean_issn, parse_lang
+from chocula import jsonio
+from chocula.fileio import open_source
 from chocula.common import DirectoryLoader
 from chocula.database import DirectoryInfo, HomepageUrl
 
@@ -51,10 +52,10 @@ class AwolLoader(DirectoryLoader):
     source_slug = "awol"
 
     def open_file(self) -> Iterable:
-        return open(self.config.awol.filepath)
+        return open_source(self.config.awol.filepath)
 
     def parse_record(self, line) -> Optional[DirectoryInfo]:
-        record = json.loads(line)
+        record = jsonio.loads(line)
 
         issn_info = record.get("identifiers", {}).get("issn", {})
         # sometimes is a list
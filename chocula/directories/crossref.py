@@ -2,6 +2,7 @@ from typing import Iterable, Optional
 import csv
 
 from chocula.util import clean_str
+from chocula.fileio import open_source
 from chocula.common import DirectoryLoader
 from chocula.database import DirectoryInfo
 
@@ -17,7 +18,7 @@ class CrossrefLoader(DirectoryLoader):
     source_slug = "crossref"
 
     def open_file(self) -> Iterable:
-        return csv.DictReader(open(self.config.crossref.filepath))
+        return csv.DictReader(open_source(self.config.crossref.filepath))
 
     def parse_record(self, record) -> Optional[DirectoryInfo]:
         info = DirectoryInfo(
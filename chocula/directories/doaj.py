@@ -6,6 +6,7 @@ from chocula.util import (
     parse_country,
     parse_lang,
 )
+from chocula.fileio import open_source
 from chocula.common import DirectoryLoader
 from chocula.database import DirectoryInfo, HomepageUrl
 
@@ -72,7 +73,7 @@ class DoajLoader(DirectoryLoader):
     source_slug = "doaj"
 
     def open_file(self) -> Iterable:
-        return csv.DictReader(open(self.config.doaj.filepath))
+        return csv.DictReader(open_source(self.config.doaj.filepath))
 
     def parse_record(self, row) -> Optional[DirectoryInfo]:
         # TODO: Subjects, Permanent article identifiers, work_level stuff
@@ -1,7 +1,8 @@
-from typing import Iterable, Optional
+from typing import Iterable, Optional, List
 import csv
 
 from chocula.util import clean_str
+from chocula.fileio import open_source
 from chocula.common import DirectoryLoader
 from chocula.database import DirectoryInfo
 
@@ -21,8 +22,11 @@ class EntrezLoader(DirectoryLoader):
 
     source_slug = "entrez"
 
+    def source_paths(self) -> List[str]:
+        return [self.config.entrez_simple.filepath]
+
     def open_file(self) -> Iterable:
-        return csv.DictReader(open(self.config.entrez_simple.filepath))
+        return csv.DictReader(open_source(self.config.entrez_simple.filepath))
 
     def parse_record(self, record) -> Optional[DirectoryInfo]:
         if not (record.get("ISSN (Online)") or record.get("ISSN (Print)")):
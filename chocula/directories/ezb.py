@@ -1,7 +1,8 @@
 from typing import Iterable, Optional
-import json
 
 from chocula.util import clean_str
+from chocula import jsonio
+from chocula.fileio import open_source
 from chocula.common import DirectoryLoader
 from chocula.database import DirectoryInfo, HomepageUrl
 
@@ -15,13 +16,13 @@ class EzbLoader(DirectoryLoader):
     source_slug = "ezb"
 
     def open_file(self) -> Iterable:
-        return open(self.config.ezb.filepath, "r")
+        return open_source(self.config.ezb.filepath, "r")
 
     def parse_record(self, row) -> Optional[DirectoryInfo]:
 
         if not row:
             return None
-        row = json.loads(row)
+        row = jsonio.loads(row)
 
         info = DirectoryInfo(
             directory_slug=self.source_slug,
@@ -2,6 +2,7 @@ from typing import Iterable, Optional
 import csv
 
 from chocula.util import clean_str
+from chocula.fileio import open_source
 from chocula.common import DirectoryLoader
 from chocula.database import DirectoryInfo
 
@@ -16,7 +17,9 @@ class GoldOALoader(DirectoryLoader):
     source_slug = "gold_oa"
 
     def open_file(self) -> Iterable:
-        return csv.DictReader(open(self.config.gold_oa.filepath, encoding="ISO-8859-1"))
+        return csv.DictReader(
+            open_source(self.config.gold_oa.filepath, encoding="ISO-8859-1")
+        )
 
     def parse_record(self, row) -> Optional[DirectoryInfo]:
 
@@ -1,7 +1,8 @@
 from typing import Iterable, Optional
-import json
 
 from chocula.util import clean_str, clean_issn, parse_country
+from chocula import jsonio
+from chocula.fileio import open_source
 from chocula.common import DirectoryLoader
 from chocula.database import DirectoryInfo, HomepageUrl
 
@@ -23,11 +24,11 @@ class IssnMetaLoader(DirectoryLoader):
     source_slug = "issn_meta"
 
     def open_file(self) -> Iterable:
-        return open(self.config.issn_meta.filepath, "r")
+        return open_source(self.config.issn_meta.filepath, "r")
 
     def parse_record(self, row) -> Optional[DirectoryInfo]:
 
-        row = json.loads(row)
+        row = jsonio.loads(row)
 
         info = DirectoryInfo(
             directory_slug=self.source_slug,
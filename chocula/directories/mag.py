@@ -2,6 +2,7 @@ from typing import Iterable, Optional
 import csv
 
 from chocula.util import clean_str, clean_issn
+from chocula.fileio import open_source
 from chocula.common import DirectoryLoader
 from chocula.database import DirectoryInfo, HomepageUrl
 
@@ -28,7 +29,7 @@ class MagLoader(DirectoryLoader):
 
     def open_file(self) -> Iterable:
         return csv.DictReader(
-            open(self.config.mag.filepath, "r"),
+            open_source(self.config.mag.filepath, "r"),
             delimiter="\t",
             fieldnames=[
                 "JournalId",
@@ -1,6 +1,7 @@
 import csv
 from typing import Iterable, Optional
 
+from chocula.fileio import open_source
 from chocula.common import DirectoryLoader
 from chocula.database import DirectoryInfo, HomepageUrl
 
@@ -11,7 +12,7 @@ class ManualHomepageLoader(DirectoryLoader):
 
     def open_file(self) -> Iterable:
         return csv.DictReader(
-            open(self.config.manual_homepages.filepath),
+            open_source(self.config.manual_homepages.filepath),
             delimiter="\t",
         )
 
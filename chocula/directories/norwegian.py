@@ -2,6 +2,7 @@ from typing import Iterable, Optional
 import csv
 
 from chocula.util import clean_str, parse_lang, parse_country
+from chocula.fileio import open_source
 from chocula.common import DirectoryLoader
 from chocula.database import DirectoryInfo, HomepageUrl
 
@@ -52,7 +53,8 @@ class NorwegianLoader(DirectoryLoader):
 
     def open_file(self) -> Iterable:
         return csv.DictReader(
-            open(self.config.norwegian.filepath, encoding="ISO-8859-1"), delimiter=";"
+            open_source(self.config.norwegian.filepath, encoding="ISO-8859-1"),
+            delimiter=";",
         )
 
     def parse_record(self, row) -> Optional[DirectoryInfo]:
@@ -2,6 +2,7 @@ from typing import Iterable, Optional
 import csv
 
 from chocula.util import clean_str, clean_issn
+from chocula.fileio import open_source
 from chocula.common import DirectoryLoader
 from chocula.database import DirectoryInfo, HomepageUrl
 
@@ -32,7 +33,7 @@ class OpenAlexLoader(DirectoryLoader):
 
     def open_file(self) -> Iterable:
         return csv.DictReader(
-            open(self.config.openalex.filepath, "r"),
+            open_source(self.config.openalex.filepath, "r"),
             delimiter="\t",
             fieldnames=[
                 "JournalId",
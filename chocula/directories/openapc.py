@@ -2,6 +2,7 @@ from typing import Iterable, Optional
 import csv
 
 from chocula.util import clean_str
+from chocula.fileio import open_source
 from chocula.common import DirectoryLoader
 from chocula.database import DirectoryInfo, HomepageUrl
 
@@ -16,7 +17,7 @@ class OpenAPCLoader(DirectoryLoader):
     source_slug = "openapc"
 
     def open_file(self) -> Iterable:
-        return csv.DictReader(open(self.config.openapc.filepath))
+        return csv.DictReader(open_source(self.config.openapc.filepath))
 
     def parse_record(self, row) -> Optional[DirectoryInfo]:
 
@@ -2,6 +2,7 @@ from typing import Iterable, Optional
 import csv
 
 from chocula.util import clean_str, parse_lang
+from chocula.fileio import open_source
 from chocula.common import DirectoryLoader
 from chocula.database import DirectoryInfo, HomepageUrl
 
@@ -26,7 +27,7 @@ class RoadLoader(DirectoryLoader):
 
     def open_file(self) -> Iterable:
         return csv.DictReader(
-            open(self.config.road.filepath),
+            open_source(self.config.road.filepath),
             delimiter="\t",
             fieldnames=(
                 "ISSN",
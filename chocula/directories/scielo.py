@@ -1,7 +1,8 @@
 from typing import Iterable, Optional
-import json
 
 from chocula.util import clean_str, clean_issn, parse_lang
+from chocula import jsonio
+from chocula.fileio import open_source
 from chocula.common import DirectoryLoader
 from chocula.database import DirectoryInfo, HomepageUrl
 
@@ -11,10 +12,10 @@ class ScieloLoader(DirectoryLoader):
     source_slug = "scielo"
 
     def open_file(self) -> Iterable:
-        return open(self.config.scielo.filepath)
+        return open_source(self.config.scielo.filepath)
 
     def parse_record(self, line) -> Optional[DirectoryInfo]:
-        record = json.loads(line)
+        record = jsonio.loads(line)
         extra = dict(
             status=clean_str(record.get("current_status")),
             first_year=record.get("first_year"),
@@ -1,10 +1,11 @@
 import sys
-from typing import Iterable, Optional, Dict, Any
+from typing import Iterable, Optional, Dict, Any, List
 import csv
 
 import ftfy
 
 from chocula.util import clean_str, parse_country
+from chocula.fileio import iter_fixed_lines, open_source
 from chocula.common import DirectoryLoader
 from chocula.database import DirectoryInfo
 
@@ -22,25 +23,27 @@ class SherpaRomeoLoader(DirectoryLoader):
     source_slug = "sherpa_romeo"
     sherpa_policies: Dict[str, Any] = dict()
 
+    def source_paths(self) -> List[str]:
+        return [
+            self.config.sherpa_romeo_journals_simple.filepath,
+            self.config.sherpa_romeo_policies_simple.filepath,
+        ]
+
     def open_file(self) -> Iterable:
 
         # first load policies
         print("##### Loading SHERPA/ROMEO policies...", file=sys.stderr)
         fixed_policy_file = ftfy.fix_file(
-            open(self.config.sherpa_romeo_policies_simple.filepath, "rb")
+            open_source(self.config.sherpa_romeo_policies_simple.filepath, "rb")
         )
         policy_reader = csv.DictReader(fixed_policy_file)
         for row in policy_reader:
             self.sherpa_policies[row["RoMEO Record ID"]] = row
 
         # then open regular file
-        raw_file = (
-            open(self.config.sherpa_romeo_journals_simple.filepath, "rb")
-            .read()
-            .decode(errors="replace")
+        return csv.DictReader(
+            iter_fixed_lines(self.config.sherpa_romeo_journals_simple.filepath)
         )
-        fixed_file = ftfy.fix_text(raw_file)
-        return csv.DictReader(fixed_file.split("\n"))
 
     def parse_record(self, row) -> Optional[DirectoryInfo]:
         # super mangled :(
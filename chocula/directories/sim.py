@@ -6,6 +6,7 @@ from chocula.util import (
     parse_lang,
     gaps_to_spans,
 )
+from chocula.fileio import open_source
 from chocula.common import DirectoryLoader
 from chocula.database import DirectoryInfo
 
@@ -25,7 +26,7 @@ class SimLoader(DirectoryLoader):
     source_slug = "sim"
 
     def open_file(self) -> Iterable:
-        return csv.DictReader(open(self.config.sim.filepath))
+        return csv.DictReader(open_source(self.config.sim.filepath))
 
     def parse_record(self, row) -> Optional[DirectoryInfo]:
 
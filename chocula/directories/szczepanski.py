@@ -1,7 +1,8 @@
 from typing import Iterable, Optional
-import json
 
 from chocula.util import clean_str
+from chocula import jsonio
+from chocula.fileio import open_source
 from chocula.common import DirectoryLoader
 from chocula.database import DirectoryInfo, HomepageUrl
 
@@ -15,14 +16,14 @@ class SzczepanskiLoader(DirectoryLoader):
     source_slug = "szczepanski"
 
     def open_file(self) -> Iterable:
-        return open(self.config.szczepanski.filepath, "r")
+        return open_source(self.config.szczepanski.filepath, "r")
 
     def parse_record(self, row) -> Optional[DirectoryInfo]:
 
         if not row:
             return None
 
-        row = json.loads(row)
+        row = jsonio.loads(row)
 
         info = DirectoryInfo(
             directory_slug=self.source_slug,
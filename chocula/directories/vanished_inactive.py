@@ -2,6 +2,7 @@ import csv
 from typing import Iterable, Optional
 
 from chocula.util import clean_str, clean_issn
+from chocula.fileio import open_source
 from chocula.common import DirectoryLoader
 from chocula.database import DirectoryInfo, HomepageUrl
 
@@ -23,7 +24,7 @@ class VanishedInactiveLoader(DirectoryLoader):
 
     def open_file(self) -> Iterable:
         return csv.DictReader(
-            open(self.config.vanished_inactive.filepath), delimiter=";"
+            open_source(self.config.vanished_inactive.filepath), delimiter=";"
         )
 
     def parse_record(self, record) -> Optional[DirectoryInfo]:
@@ -2,6 +2,7 @@ from typing import Iterable, Optional
 import csv
 
 from chocula.util import clean_str
+from chocula.fileio import open_source
 from chocula.common import DirectoryLoader
 from chocula.database import DirectoryInfo, HomepageUrl
 
@@ -15,7 +16,9 @@ class WikidataLoader(DirectoryLoader):
     source_slug = "wikidata"
 
     def open_file(self) -> Iterable:
-        return csv.DictReader(open(self.config.wikidata.filepath), delimiter="\t")
+        return csv.DictReader(
+            open_source(self.config.wikidata.filepath), delimiter="\t"
+        )
 
     def parse_record(self, row) -> Optional[DirectoryInfo]:
 
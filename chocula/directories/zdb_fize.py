@@ -1,6 +1,7 @@
-import json
 from typing import Iterable, Optional
 
+from chocula import jsonio
+from chocula.fileio import open_source
 from chocula.common import DirectoryLoader
 from chocula.database import DirectoryInfo, HomepageUrl
 
@@ -16,13 +17,13 @@ class ZdbFizeLoader(DirectoryLoader):
     source_slug = "zdb_fize"
 
     def open_file(self) -> Iterable:
-        return open(self.config.zdb_fize.filepath, "r")
+        return open_source(self.config.zdb_fize.filepath, "r")
 
     def parse_record(self, record) -> Optional[DirectoryInfo]:
 
         if not record.strip():
             return None
-        record = json.loads(record)
+        record = jsonio.loads(record)
 
         info = DirectoryInfo(directory_slug=self.source_slug, issnl=record["issn"])
 
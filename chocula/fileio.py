@@ -0,0 +1,308 @@
+"""
+Helpers for reading (large) source files.
+"""
+
+import io
+import os
+import sys
+import bz2
+import gzip
+import lzma
+import fnmatch
+import zipfile
+from typing import IO, Iterator, List, Optional, Tuple, cast
+
+import ftfy
+
+from chocula.util import ftfy_needed
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None  # type: ignore
+
+# source path meaning standard input
+STDIN_PATH = "-"
+
+COMPRESSED_SUFFIXES = (".gz", ".bz2", ".xz", ".zst", ".zip")
+
+
+def split_archive_member(path: str) -> Tuple[str, Optional[str]]:
+    """
+    Splits a path like "archive.zip#pattern" in to the archive path and the
+    member name (glob) pattern. Other paths have no member.
+    """
+    archive, sep, member = path.rpartition("#")
+    if sep and archive.lower().endswith(".zip"):
+        return archive, member
+    return path, None
+
+
+def source_file_path(path: str) -> str:
+    """
+    The path of the file on disk a source path reads from (eg, the archive
+    for a zip member). Useful for fingerprinting.
+    """
+    return split_archive_member(path)[0]
+
+
+def is_plain_file(path: str) -> bool:
+    """
+    True if the path is an uncompressed file on disk, which can be read from
+    any offset (see line_chunk_offsets()).
+    """
+    return path != STDIN_PATH and not source_file_path(path).lower().endswith(
+        COMPRESSED_SUFFIXES
+    )
+
+
+def open_source(
+    path: str,
+    mode: str = "r",
+    encoding: Optional[str] = None,
+    errors: Optional[str] = None,
+) -> IO:
+    """
+    Opens a source file for reading, in text ("r", the default) or binary
+    ("rb") mode, like open().
+
+    Files ending in .gz, .bz2, .xz or .zst (which needs the optional zstandard
+    package) are decompressed on the fly. A member of a zip archive can be
+    read with a path like "issnltables.zip#*.ISSN-to-ISSN-L.txt", where the
+    part after "#" is a glob pattern which has to match exactly one member; a
+    bare ".zip" path works for archives with a single member. "-" reads
+    standard input.
+    """
+    if mode not in ("r", "rb"):
+        raise ValueError(f"unsupported mode for source files: {mode}")
+    archive, member = split_archive_member(path)
+    suffix = os.path.splitext(archive)[1].lower()
+    raw: IO[bytes]
+    if path == STDIN_PATH:
+        raw = sys.stdin.buffer
+    elif suffix == ".gz":
+        # (GzipFile isn't declared as an IO[bytes], unlike BZ2File and LZMAFile)
+        raw = cast(IO[bytes], gzip.open(archive, "rb"))
+    elif suffix == ".bz2":
+        raw = bz2.open(archive, "rb")
+    elif suffix == ".xz":
+        raw = lzma.open(archive, "rb")
+    elif suffix == ".zst":
+        if zstandard is None:
+            raise ImportError(f"reading {path} requires the zstandard package")
+        reader = zstandard.ZstdDecompressor().stream_reader(
+            open(archive, "rb"), read_across_frames=True
+        )
+        raw = io.BufferedReader(reader)  # type: ignore
+    elif suffix == ".zip":
+        raw = open_zip_member(archive, member)
+    else:
+        return open(path, mode, encoding=encoding, errors=errors)
+    if mode == "rb":
+        return raw
+    return io.TextIOWrapper(raw, encoding=encoding, errors=errors)
+
+
+def open_zip_member(archive: str, pattern: Optional[str]) -> IO[bytes]:
+    zf = zipfile.ZipFile(archive)
+    names = [name for name in zf.namelist() if not name.endswith("/")]
+    if pattern is not None:
+        names = fnmatch.filter(names, pattern)
+    if len(names) != 1:
+        raise ValueError(
+            f"expected one member of {archive} matching {pattern!r}, found: {names}"
+        )
+    return zf.open(names[0])
+
+
+def iter_fixed_lines(path: str) -> Iterator[str]:
+    """
+    Streams lines of text from a file, decoding as UTF-8 (with replacement
+    characters for invalid bytes) and repairing mangled text with ftfy. Lines
+    are returned without trailing newlines, ready to be passed to a CSV reader.
+
+    This gives the same lines as decoding the whole file, running
+    ftfy.fix_text() on the result, and splitting on newlines, but memory use
+    doesn't depend on file size, and ftfy only gets run on the (relatively
+    few) lines where it could possibly change something.
+
+    Like fix_text(), once a line with a "<" has been seen, HTML entities are
+    no longer unescaped in that or any later line.
+    """
+    unescape_html = True
+    # splitting text on newlines always results in a final (maybe empty) line
+    ends_with_newline = True
+    with open_source(path, "rb") as f:
+        # binary file iteration splits only on b"\n", which is also where
+        # fix_text() splits text into segments
+        for raw_line in f:
+            line = raw_line.decode("utf-8", errors="replace")
+            if unescape_html and "<" in line:
+                unescape_html = False
+            if ftfy_needed(line.rstrip("\n"), unescape_html=unescape_html):
+                if unescape_html:
+                    line = ftfy.fix_text(line)
+                else:
+                    line = ftfy.fix_text(line, unescape_html=False)
+            # fixing can turn other line break characters in to newlines
+            pieces = line.split("\n")
+            ends_with_newline = line.endswith("\n")
+            if ends_with_newline:
+                pieces.pop()
+            yield from pieces
+    if ends_with_newline:
+        yield ""
+
+
+def line_chunk_offsets(path: str, chunk_bytes: int) -> List[Tuple[int, Optional[int]]]:
+    """
+    Splits a file into (start, end) byte ranges of roughly chunk_bytes each,
+    with every boundary at the start of a line. The ranges cover the whole
+    file, in order; an empty file gives a single empty range.
+
+    Sources which can't be read from an offset (compressed files, stdin; see
+    is_plain_file()) give a single (0, None) range, for the whole stream.
+    """
+    if not is_plain_file(path):
+        return [(0, None)]
+    size = os.path.getsize(path)
+    offsets: List[Tuple[int, Optional[int]]] = []
+    start = 0
+    with open(path, "rb") as f:
+        while start + chunk_bytes < size:
+            f.seek(start + chunk_bytes)
+            f.readline()
+            end = f.tell()
+            if end >= size:
+                break
+            offsets.append((start, end))
+            start = end
+    offsets.append((start, size))
+    return offsets
+
+
+def iter_line_range(path: str, start: int, end: Optional[int]) -> Iterator[bytes]:
+    """
+    Yields the raw lines (including newlines) in a byte range of a file, as
+    returned by line_chunk_offsets(). If end is None, reads to the end of the
+    stream (which must be from the start, for non-plain files).
+    """
+    with open_source(path, "rb") as f:
+        if end is None:
+            if start and not is_plain_file(path):
+                raise ValueError(f"can't read {path} from offset {start}")
+            if start:
+                f.seek(start)
+            yield from f
+            return
+        f.seek(start)
+        remaining = end - start
+        for line in f:
+            if remaining <= 0:
+                break
+            remaining -= len(line)
+            yield line
+
+
+def test_iter_fixed_lines(tmp_path):
+    raw = b"".join(
+        [
+            b"plain,ascii\r\n",
+            "cafÃ©,AT&amp;T\n".encode("utf-8"),
+            b"bad \xff byte\n",
+            b"form\x0cfeed,bell\x07\n",
+            b"tab\tseparated\n",
+            b"a<b,AT&amp;T\n",
+            b"AT&amp;T\n",
+            b"one\rtwo\n",
+            b"no final newline",
+        ]
+    )
+    path = tmp_path / "test.txt"
+    path.write_bytes(raw)
+
+    expected = ftfy.fix_text(raw.decode(errors="replace")).split("\n")
+    assert list(iter_fixed_lines(str(path))) == expected
+    assert expected[1] == "café,AT&T"
+    assert expected[6] == "AT&amp;T"
+
+
+def test_line_chunk_offsets(tmp_path):
+    path = tmp_path / "test.txt"
+    raw = b"".join(b"line %d\n" % i for i in range(100)) + b"partial"
+    path.write_bytes(raw)
+    for chunk_bytes in (1, 7, 50, 1000):
+        offsets = line_chunk_offsets(str(path), chunk_bytes)
+        assert offsets[0][0] == 0
+        assert offsets[-1][1] == len(raw)
+        for (_, end), (start, _) in zip(offsets, offsets[1:]):
+            assert end == start
+            assert raw[start - 1 : start] == b"\n"
+        lines = [
+            line
+            for start, end in offsets
+            for line in iter_line_range(str(path), start, end)
+        ]
+        assert b"".join(lines) == raw
+        assert len(lines) == 101
+
+    empty = tmp_path / "empty.txt"
+    empty.write_bytes(b"")
+    assert line_chunk_offsets(str(empty), 10) == [(0, 0)]
+    assert list(iter_line_range(str(empty), 0, 0)) == []
+
+
+def test_open_source(tmp_path):
+    raw = "one,two\ncafé,ünïcode\n".encode("utf-8")
+    plain = tmp_path / "test.csv"
+    plain.write_bytes(raw)
+    paths = [str(plain)]
+    for suffix, module in ((".gz", gzip), (".bz2", bz2), (".xz", lzma)):
+        path = tmp_path / f"test.csv{suffix}"
+        path.write_bytes(module.compress(raw))
+        paths.append(str(path))
+    with zipfile.ZipFile(tmp_path / "test.zip", "w") as zf:
+        zf.writestr("dir/README.txt", "readme")
+        zf.writestr("dir/test.csv", raw)
+    paths.append(str(tmp_path / "test.zip") + "#*.csv")
+    if zstandard is not None:
+        path = tmp_path / "test.csv.zst"
+        path.write_bytes(zstandard.ZstdCompressor().compress(raw))
+        paths.append(str(path))
+
+    for path in paths:
+        with open_source(path, "rb") as f:
+            assert f.read() == raw
+        with open_source(path, encoding="utf-8") as f:
+            assert list(f) == ["one,two\n", "café,ünïcode\n"]
+        assert list(iter_fixed_lines(path)) == ["one,two", "café,ünïcode", ""]
+        offsets = line_chunk_offsets(path, 4)
+        assert (
+            b"".join(
+                line
+                for start, end in offsets
+                for line in iter_line_range(path, start, end)
+            )
+            == raw
+        )
+        assert is_plain_file(path) == (path == str(plain))
+        assert (len(offsets) > 1) == is_plain_file(path)
+        if not is_plain_file(path):
+            try:
+                list(iter_line_range(path, 4, None))
+            except ValueError:
+                pass
+            else:
+                assert False, path
+
+    zip_path = str(tmp_path / "test.zip")
+    assert source_file_path(zip_path + "#*.csv") == zip_path
+    assert source_file_path(str(plain)) == str(plain)
+    # archives with more than one (or no) matching member
+    for path in (zip_path, zip_path + "#*.json"):
+        try:
+            open_source(path)
+        except ValueError:
+            pass
+        else:
+            assert False, path
@@ -0,0 +1,627 @@
+"""
+Compact ISSN to ISSN-L index.
+
+Every ISSN is packed into a single 32-bit integer (the seven leading digits
+times eleven, plus the check digit, with "X" counting as ten). The index itself
+is just two parallel, sorted typed arrays (ISSN keys and ISSN-L values), and
+lookups are a binary search over the keys. Compared to a dict of millions of
+short python strings this is a few tens of MB instead of several hundred.
+
+The upstream table has a handful of entries which can't be packed this way (eg,
+a lower-case "x" check digit); these are kept as strings in a small dict on the
+side, so lookups behave exactly as they did with the plain dict.
+
+The arrays can be written to a flat binary file and memory-mapped back in
+(read-only), so multiple processes end up sharing a single copy via the OS page
+cache. load_or_build_cache() uses this to keep a pre-built index in a cache
+directory, tagged with the size, mtime and hash of the TSV it was built from,
+and only re-parses the TSV when that changes.
+"""
+
+import os
+
+import sys
+import mmap
+import struct
+from array import array
+from bisect import bisect_left
+from typing import Optional, Iterable, Tuple, Sequence, List, Dict, Literal, Set
+
+from chocula.util import FileFingerprint, file_fingerprint
+from chocula.fileio import open_source, source_file_path
+
+# unsigned 32-bit integers
+ARRAY_TYPECODE: Literal["I"] = "I"
+assert array(ARRAY_TYPECODE).itemsize == 4
+
+ISSN_INDEX_MAGIC = b"CHOCISSN"
+ISSN_INDEX_VERSION = 2
+ISSN_INDEX_CACHE_SUFFIX = ".idx"
+
+# magic, format version, number of entries, length of "irregular" entries
+# section (bytes), then source file size, mtime (nanoseconds) and SHA-1 (all
+# zeros if unknown); always little-endian
+HEADER_FORMAT = "<8sIIIQq20s"
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+
+_MASK32 = 0xFFFFFFFF
+
+
+def encode_issn(issn: str) -> Optional[int]:
+    """
+    Packs a formatted ISSN string (eg, "1234-567X") into an integer. Returns
+    None if the string isn't shaped like an ISSN.
+
+    The check digit is not verified, only stored.
+    """
+    if len(issn) != 9 or issn[4] != "-":
+        return None
+    digits = issn[:4] + issn[5:8]
+    if not (digits.isascii() and digits.isdigit()):
+        return None
+    check = issn[8]
+    if check == "X":
+        check_val = 10
+    elif "0" <= check <= "9":
+        check_val = ord(check) - 48
+    else:
+        return None
+    return int(digits) * 11 + check_val
+
+
+def decode_issn(value: int) -> str:
+    """
+    Inverse of encode_issn().
+    """
+    digits, check_val = divmod(value, 11)
+    check = "X" if check_val == 10 else str(check_val)
+    digits_str = "%07d" % digits
+    return f"{digits_str[:4]}-{digits_str[4:]}{check}"
+
+
+def test_encode_issn():
+    for issn in ("0000-0000", "0140-6736", "1474-547X", "9999-999X"):
+        assert decode_issn(encode_issn(issn)) == issn
+    assert encode_issn("9999-999X") < 2**32
+    assert encode_issn("0140-6736") < encode_issn("1474-547X")
+    assert encode_issn("") is None
+    assert encode_issn("1234-567x") is None
+    assert encode_issn("12345678") is None
+    assert encode_issn("ABCD-EFGH") is None
+    assert encode_issn("1234-56789") is None
+
+
+# ISSN check digit weights for the seven leading digits
+CHECK_WEIGHTS = (8, 7, 6, 5, 4, 3, 2)
+# multiplicative inverses of the weights, mod 11
+_WEIGHT_INVERSES = tuple(pow(w, -1, 11) for w in CHECK_WEIGHTS)
+
+
+def _check_char(value: int) -> str:
+    return "X" if value == 10 else str(value)
+
+
+def issn_checksum_valid(issn: str) -> bool:
+    key = encode_issn(issn)
+    if key is None:
+        return False
+    digits, check_val = divmod(key, 11)
+    total = sum(w * int(d) for w, d in zip(CHECK_WEIGHTS, "%07d" % digits))
+    return (total + check_val) % 11 == 0
+
+
+def near_miss_candidates(issn: str) -> List[str]:
+    """
+    For an ISSN-shaped string with an *invalid* check digit, returns all the
+    valid ISSNs which are a single "typo" away:
+
+    - same digits, with a recomputed check digit
+    - a single substituted digit (check digit unchanged)
+    - two adjacent characters transposed
+
+    The mod-11 checksum catches every single substitution and adjacent
+    transposition, so there are at most a handful of candidates (at most one
+    per position), and they can be computed directly instead of enumerating
+    every variant of every known ISSN.
+
+    Returns an empty list if the input isn't ISSN-shaped, or already valid.
+    """
+    key = encode_issn(issn)
+    if key is None or issn_checksum_valid(issn):
+        return []
+    digits_val, check_val = divmod(key, 11)
+    digits = [int(d) for d in "%07d" % digits_val]
+    total = sum(w * d for w, d in zip(CHECK_WEIGHTS, digits))
+    candidates: List[str] = []
+
+    def add(new_digits: List[int], new_check: int) -> None:
+        s = "".join(str(d) for d in new_digits)
+        candidate = f"{s[:4]}-{s[4:]}{_check_char(new_check)}"
+        if candidate != issn and candidate not in candidates:
+            candidates.append(candidate)
+
+    # recomputed check digit
+    add(digits, (-total) % 11)
+
+    # single substitutions
+    for i, (w, w_inv) in enumerate(zip(CHECK_WEIGHTS, _WEIGHT_INVERSES)):
+        rest = total - w * digits[i]
+        d = (-(rest + check_val) * w_inv) % 11
+        if d <= 9 and d != digits[i]:
+            add(digits[:i] + [d] + digits[i + 1 :], check_val)
+
+    # adjacent transpositions (including last digit and check digit)
+    chars = digits + [check_val]
+    for i in range(7):
+        if chars[i] == chars[i + 1] or chars[i + 1] == 10:
+            continue
+        swapped = chars[:i] + [chars[i + 1], chars[i]] + chars[i + 2 :]
+        if (sum(w * d for w, d in zip(CHECK_WEIGHTS, swapped)) + swapped[7]) % 11 == 0:
+            add(swapped[:7], swapped[7])
+
+    return candidates
+
+
+def test_near_miss_candidates():
+    # "The Lancet" is 0140-6736
+    assert issn_checksum_valid("0140-6736")
+    assert not issn_checksum_valid("0140-6737")
+    assert not issn_checksum_valid("bogus")
+    assert near_miss_candidates("0140-6736") == []
+    assert near_miss_candidates("bogus") == []
+    # bad check digit
+    assert "0140-6736" in near_miss_candidates("0140-6737")
+    # substitution
+    assert "0140-6736" in near_miss_candidates("0140-6636")
+    # transpositions
+    assert "0140-6736" in near_miss_candidates("0410-6736")
+    assert "0140-6736" in near_miss_candidates("0140-6763")
+    for issn in ("0140-6737", "0140-6636", "0410-6736", "1474-5470"):
+        candidates = near_miss_candidates(issn)
+        assert candidates
+        assert all(issn_checksum_valid(c) for c in candidates)
+
+
+class IssnIndex:
+    """
+    Sorted-array ISSN to ISSN-L index. Construct with from_issn_map_file() or
+    load(), not directly.
+    """
+
+    def __init__(
+        self,
+        keys: Sequence[int],
+        values: Sequence[int],
+        irregular: Optional[Dict[str, str]] = None,
+    ):
+        assert len(keys) == len(values)
+        self.keys = keys
+        self.values = values
+        self.irregular: Dict[str, str] = irregular or dict()
+        # fingerprint of the TSV file this index was built from, if known
+        self.source: Optional[FileFingerprint] = None
+        # keep a reference to any backing mmap, so it doesn't get closed
+        self._mmap: Optional[mmap.mmap] = None
+        # index file the mmap is of
+        self.path: Optional[str] = None
+
+    def __len__(self) -> int:
+        return len(self.keys) + len(self.irregular)
+
+    def __reduce__(self):
+        # memory-mapped indexes (which can't be pickled) get mapped again from
+        # the same file when unpickled, eg in worker processes
+        if self._mmap is not None and self.path:
+            return (IssnIndex.load, (self.path,))
+        state = dict(source=self.source, _mmap=None, path=None)
+        return (
+            IssnIndex,
+            (
+                array(ARRAY_TYPECODE, self.keys),
+                array(ARRAY_TYPECODE, self.values),
+                self.irregular,
+            ),
+            state,
+        )
+
+    def lookup_int(self, key: int) -> Optional[int]:
+        keys = self.keys
+        i = bisect_left(keys, key)
+        if i < len(keys) and keys[i] == key:
+            return self.values[i]
+        return None
+
+    def lookup(self, issn: str) -> Optional[str]:
+        if self.irregular and issn in self.irregular:
+            return self.irregular[issn]
+        key = encode_issn(issn)
+        if key is None:
+            return None
+        value = self.lookup_int(key)
+        if value is None:
+            return None
+        return decode_issn(value)
+
+    def lookup_many(self, issns: Sequence[Optional[str]]) -> List[Optional[str]]:
+        """
+        Batch version of lookup(). The distinct ISSNs are encoded and sorted
+        once, then resolved in a single forward pass over the index (each
+        binary search starts where the previous one ended), instead of an
+        independent search per input row.
+
+        Empty (or None) inputs map to None.
+        """
+        found: Dict[str, Optional[str]] = dict()
+        encoded: List[Tuple[int, str]] = []
+        for issn in set(issns):
+            if not issn:
+                continue
+            if issn in self.irregular:
+                found[issn] = self.irregular[issn]
+                continue
+            key = encode_issn(issn)
+            if key is None:
+                found[issn] = None
+            else:
+                encoded.append((key, issn))
+        encoded.sort()
+
+        keys = self.keys
+        values = self.values
+        count = len(keys)
+        i = 0
+        for key, issn in encoded:
+            i = bisect_left(keys, key, i)
+            if i < count and keys[i] == key:
+                found[issn] = decode_issn(values[i])
+            else:
+                found[issn] = None
+        return [found[issn] if issn else None for issn in issns]
+
+    def repair(self, issn: str) -> Optional[str]:
+        """
+        Tries to resolve an unknown ISSN with an invalid check digit to an
+        ISSN-L, by looking up its near_miss_candidates(). Only returns an
+        ISSN-L if all the candidates which are known resolve to the same one.
+        """
+        issnls = set()
+        for candidate in near_miss_candidates(issn):
+            issnl = self.lookup(candidate)
+            if issnl:
+                issnls.add(issnl)
+        if len(issnls) == 1:
+            return issnls.pop()
+        return None
+
+    @classmethod
+    def from_pairs(cls, pairs: Iterable[Tuple[str, str]]) -> "IssnIndex":
+        """
+        Builds an index from (ISSN, ISSN-L) string pairs.
+
+        Same semantics as the old dict-based map: if an ISSN shows up multiple
+        times, the last mapping wins, and every ISSN-L also maps to itself
+        ("double mapping") unless it has an explicit mapping of its own.
+        Pairs which can't be integer-encoded end up in the "irregular" dict.
+        """
+        packed = array("Q")
+        irregular: Dict[str, str] = dict()
+        irregular_issnls: Set[int] = set()
+        for issn, issnl in pairs:
+            key = encode_issn(issn)
+            value = encode_issn(issnl)
+            if key is None or value is None:
+                irregular[issn] = issnl
+                if value is not None:
+                    # regular ISSN-L; gets a self-mapping below, unless it
+                    # has an explicit mapping of its own
+                    irregular_issnls.add(value)
+                elif issnl not in irregular:
+                    irregular[issnl] = issnl
+                continue
+            if irregular:
+                # a later regular mapping overrides an earlier irregular one
+                irregular.pop(issn, None)
+            packed.append((key << 32) | value)
+
+        # ISSNs which ended up in the irregular dict (because their ISSN-L
+        # couldn't be encoded) take precedence over earlier regular mappings
+        shadowed: Set[int] = set()
+        for issn in irregular:
+            key = encode_issn(issn)
+            if key is not None:
+                shadowed.add(key)
+
+        # stable sort on just the key, so file order is retained for duplicates
+        keys = array(ARRAY_TYPECODE)
+        values = array(ARRAY_TYPECODE)
+        for p in sorted(packed, key=lambda p: p >> 32):
+            key = p >> 32
+            if key in shadowed:
+                continue
+            if keys and keys[-1] == key:
+                values[-1] = p & _MASK32
+                continue
+            keys.append(key)
+            values.append(p & _MASK32)
+        del packed
+
+        # find ISSN-Ls which don't have their own explicit mapping (by walking
+        # both sorted sequences in parallel), and add them as self-mappings
+        missing: List[int] = []
+        i = 0
+        for value in sorted(set(values) | irregular_issnls):
+            while i < len(keys) and keys[i] < value:
+                i += 1
+            if (i == len(keys) or keys[i] != value) and value not in shadowed:
+                missing.append(value)
+        if missing:
+            merged = sorted(list(zip(keys, values)) + [(m, m) for m in missing])
+            keys = array(ARRAY_TYPECODE, [k for k, _ in merged])
+            values = array(ARRAY_TYPECODE, [v for _, v in merged])
+
+        return cls(keys, values, irregular)
+
+    @classmethod
+    def from_issn_map_file(cls, issn_map_path: str) -> "IssnIndex":
+        """
+        Parses the ISSN-to-ISSN-L.txt TSV file distributed by the ISSN
+        organization.
+        """
+
+        def iter_pairs(issn_map_file):
+            for line in issn_map_file:
+                if line.startswith("ISSN") or len(line) == 0:
+                    continue
+                fields = line.split()
+                if len(fields) < 2:
+                    continue
+                yield (fields[0], fields[1])
+
+        with open_source(issn_map_path) as issn_map_file:
+            return cls.from_pairs(iter_pairs(issn_map_file))
+
+    def save(self, path: str) -> None:
+        """
+        Writes out a flat binary file (header, keys, values, then irregular
+        entries as TSV) which can be loaded (and memory-mapped) with load().
+        """
+        keys = array(ARRAY_TYPECODE, self.keys)
+        values = array(ARRAY_TYPECODE, self.values)
+        if sys.byteorder != "little":
+            keys.byteswap()
+            values.byteswap()
+        irregular = "".join(
+            f"{issn}\t{issnl}\n" for issn, issnl in self.irregular.items()
+        ).encode("utf-8")
+        # write to a temporary file and rename, so that concurrent readers (or
+        # existing memory maps) never see a partially written file
+        tmp_path = f"{path}.tmp{os.getpid()}"
+        with open(tmp_path, "wb") as f:
+            f.write(
+                struct.pack(
+                    HEADER_FORMAT,
+                    ISSN_INDEX_MAGIC,
+                    ISSN_INDEX_VERSION,
+                    len(keys),
+                    len(irregular),
+                    self.source.size if self.source else 0,
+                    self.source.mtime_ns if self.source else 0,
+                    (
+                        bytes.fromhex(self.source.sha1)
+                        if self.source and self.source.sha1
+                        else bytes(20)
+                    ),
+                )
+            )
+            keys.tofile(f)
+            values.tofile(f)
+            f.write(irregular)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str, use_mmap: bool = True) -> "IssnIndex":
+        """
+        Loads an index written by save(). By default the file is memory-mapped
+        read-only, so nothing is actually read until lookups happen, and
+        processes loading the same file share memory.
+
+        Raises ValueError if the file isn't a valid index file.
+        """
+        with open(path, "rb") as f:
+            header = f.read(HEADER_SIZE)
+            if len(header) != HEADER_SIZE:
+                raise ValueError(f"truncated ISSN index file: {path}")
+            (
+                magic,
+                version,
+                count,
+                irregular_size,
+                source_size,
+                source_mtime_ns,
+                source_sha1,
+            ) = struct.unpack(HEADER_FORMAT, header)
+            if magic != ISSN_INDEX_MAGIC or version != ISSN_INDEX_VERSION:
+                raise ValueError(f"not an ISSN index file (or wrong version): {path}")
+            array_size = 4 * count
+            f.seek(HEADER_SIZE + 2 * array_size)
+            irregular_raw = f.read(irregular_size)
+            if len(irregular_raw) != irregular_size or f.read(1):
+                raise ValueError(f"truncated or corrupt ISSN index file: {path}")
+            irregular: Dict[str, str] = dict()
+            for line in irregular_raw.decode("utf-8").splitlines():
+                issn, issnl = line.split("\t")
+                irregular[issn] = issnl
+            source: Optional[FileFingerprint] = None
+            if source_sha1 != bytes(20):
+                source = FileFingerprint(
+                    size=source_size, mtime_ns=source_mtime_ns, sha1=source_sha1.hex()
+                )
+
+            if use_mmap and sys.byteorder == "little" and count > 0:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                view = memoryview(mm)
+                offset = HEADER_SIZE
+                keys = view[offset : offset + array_size].cast(ARRAY_TYPECODE)
+                offset += array_size
+                values = view[offset : offset + array_size].cast(ARRAY_TYPECODE)
+                index = cls(keys, values, irregular)
+                index._mmap = mm
+                index.path = path
+                index.source = source
+                return index
+
+            f.seek(HEADER_SIZE)
+            keys_arr = array(ARRAY_TYPECODE)
+            values_arr = array(ARRAY_TYPECODE)
+            keys_arr.fromfile(f, count)
+            values_arr.fromfile(f, count)
+        if sys.byteorder != "little":
+            keys_arr.byteswap()
+            values_arr.byteswap()
+        index = cls(keys_arr, values_arr, irregular)
+        index.source = source
+        return index
+
+
+def test_issn_index_pairs():
+    index = IssnIndex.from_pairs(
+        [
+            ("0140-6736", "0140-6736"),
+            ("1474-547X", "0140-6736"),
+            ("2000-0001", "2000-0002"),
+            ("2000-0003", "2000-0003"),
+            ("2000-0003", "2000-0001"),
+        ]
+    )
+    assert len(index) == 5
+    assert index.lookup("0140-6736") == "0140-6736"
+    assert index.lookup("1474-547X") == "0140-6736"
+    # ISSN-L without a line of its own maps to itself
+    assert index.lookup("2000-0002") == "2000-0002"
+    # last mapping wins
+    assert index.lookup("2000-0003") == "2000-0001"
+    # un-encodable entries are passed through as-is
+    irregular = IssnIndex.from_pairs([("0042-465x", "0042-465x")])
+    assert irregular.lookup("0042-465x") == "0042-465x"
+    assert irregular.lookup("0042-465X") is None
+    # ... and don't shadow an explicit mapping of a regular ISSN-L
+    for pairs in (
+        [("1474-547x", "1474-547X"), ("1474-547X", "0140-6736")],
+        [("1474-547X", "0140-6736"), ("1474-547x", "1474-547X")],
+    ):
+        mixed = IssnIndex.from_pairs(pairs)
+        assert len(mixed) == 3
+        assert mixed.lookup("1474-547x") == "1474-547X"
+        assert mixed.lookup("1474-547X") == "0140-6736"
+        assert mixed.lookup("0140-6736") == "0140-6736"
+    mixed = IssnIndex.from_pairs([("1474-547x", "1474-547X")])
+    assert mixed.lookup("1474-547X") == "1474-547X"
+    # irregular ISSN-L overriding an earlier regular one, and the reverse
+    mixed = IssnIndex.from_pairs(
+        [
+            ("2000-0001", "2000-0002"),
+            ("2000-0001", "bogus"),
+            ("2000-0003", "bogus"),
+            ("2000-0003", "2000-0002"),
+        ]
+    )
+    assert len(mixed) == 4
+    assert mixed.lookup("2000-0001") == "bogus"
+    assert mixed.lookup("2000-0003") == "2000-0002"
+    assert mixed.lookup("2000-0002") == "2000-0002"
+    assert mixed.lookup("bogus") == "bogus"
+    assert index.lookup("1234-5678") is None
+    assert index.lookup("bogus") is None
+    assert index.lookup("") is None
+
+    queries = ["1474-547X", "", None, "bogus", "2000-0002", "1474-547X", "9999-9999"]
+    assert index.lookup_many(queries) == [
+        "0140-6736",
+        None,
+        None,
+        None,
+        "2000-0002",
+        "0140-6736",
+        None,
+    ]
+
+
+def cache_path_for(issn_map_path: str, cache_dir: str) -> str:
+    # for a zip archive member, the cache is named after the archive
+    name = os.path.basename(source_file_path(issn_map_path))
+    return os.path.join(cache_dir, name + ISSN_INDEX_CACHE_SUFFIX)
+
+
+def build_cache(issn_map_path: str, cache_dir: str) -> IssnIndex:
+    """
+    Parses the ISSN-L TSV file and (re-)writes the cached index in cache_dir
+    (which is created if needed). Failure to write the cache file (eg,
+    read-only directory) is not fatal.
+    """
+    source = file_fingerprint(source_file_path(issn_map_path))
+    index = IssnIndex.from_issn_map_file(issn_map_path)
+    index.source = source
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        index.save(cache_path_for(issn_map_path, cache_dir))
+    except OSError as oe:
+        print(f"failed to write ISSN-L index cache: {oe}", file=sys.stderr)
+    return index
+
+
+def load_or_build_cache(issn_map_path: str, cache_dir: str) -> Tuple[IssnIndex, str]:
+    """
+    Returns an index for the given ISSN-L TSV file, using the cached index file
+    in cache_dir if that was built from an identical TSV file.
+
+    The cache is trusted without hashing if the TSV file size and mtime match;
+    if only the mtime changed (eg, file was copied or touched) the hash is
+    compared, and the cache re-tagged if it still matches.
+
+    Also returns a status: "hit", "rehashed", or "rebuilt".
+    """
+    cache_path = cache_path_for(issn_map_path, cache_dir)
+    current = file_fingerprint(source_file_path(issn_map_path), with_hash=False)
+    try:
+        index = IssnIndex.load(cache_path)
+    except (OSError, ValueError):
+        return build_cache(issn_map_path, cache_dir), "rebuilt"
+
+    cached = index.source
+    if cached is None or cached.size != current.size:
+        return build_cache(issn_map_path, cache_dir), "rebuilt"
+    if cached.mtime_ns == current.mtime_ns:
+        return index, "hit"
+
+    current = file_fingerprint(source_file_path(issn_map_path))
+    if cached.sha1 != current.sha1:
+        return build_cache(issn_map_path, cache_dir), "rebuilt"
+    index.source = current
+    try:
+        index.save(cache_path)
+    except OSError as oe:
+        print(f"failed to write ISSN-L index cache: {oe}", file=sys.stderr)
+    return index, "rehashed"
+
+
+def verify_cache(issn_map_path: str, cache_dir: str) -> Optional[str]:
+    """
+    Checks that the cached index exists, is readable, and matches the full
+    fingerprint (including hash) of the ISSN-L TSV file.
+
+    Returns None if all is well, or a description of the problem.
+    """
+    cache_path = cache_path_for(issn_map_path, cache_dir)
+    try:
+        index = IssnIndex.load(cache_path)
+    except (OSError, ValueError) as e:
+        return f"can't load cache: {e}"
+    if index.source is None:
+        return "cache has no source fingerprint"
+    current = file_fingerprint(source_file_path(issn_map_path))
+    if index.source.size != current.size or index.source.sha1 != current.sha1:
+        return f"cache fingerprint doesn't match {issn_map_path}"
+    keys = index.keys
+    if any(keys[i] >= keys[i + 1] for i in range(len(keys) - 1)):
+        return "cache keys are not sorted"
+    return None
@@ -0,0 +1,83 @@
+"""
+JSON decoding (and encoding) for source loaders and exporters.
+
+Decoding uses orjson (or msgspec) if installed, falling back to the standard
+library json module otherwise. The fast backends reject a few things the json
+module accepts (NaN, lone surrogates, integers over 64 bits); those documents
+get handled by the json module instead, so results never depend on which
+backend is installed.
+
+Encoding always goes through the json module, with its default settings
+(ASCII-escaped, ", " and ": " separators). The fast backends can't produce
+those same bytes, and export output shouldn't depend on which optional
+library happens to be installed.
+"""
+
+import json
+import math
+from typing import Any, Union
+
+try:
+    import orjson  # type: ignore
+except ImportError:
+    orjson = None  # type: ignore
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None  # type: ignore
+
+
+def _json_loads(data: Union[str, bytes]) -> Any:
+    return json.loads(data)
+
+
+if orjson is not None:
+    BACKEND = "orjson"
+
+    def loads(data: Union[str, bytes]) -> Any:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            return json.loads(data)
+
+elif msgspec is not None:
+    BACKEND = "msgspec"
+    _decoder = msgspec.json.Decoder()
+
+    def loads(data: Union[str, bytes]) -> Any:
+        try:
+            return _decoder.decode(data)
+        except msgspec.DecodeError:
+            return json.loads(data)
+
+else:
+    BACKEND = "json"
+    loads = _json_loads
+
+
+def dumps(obj: Any, sort_keys: bool = False) -> str:
+    """
+    Same as json.dumps(obj, sort_keys=sort_keys), whatever the backend.
+    """
+    return json.dumps(obj, sort_keys=sort_keys)
+
+
+def test_jsonio():
+    docs = [
+        '{"a": 1, "b": [true, false, null], "c": {"d": 1.5}}',
+        '{"name": "caf\\u00e9 \\u2603", "plain": "café"}',
+        '{"lone": "\\ud800", "big": 123456789012345678901234567890}',
+        "[]",
+    ]
+    for doc in docs:
+        obj = loads(doc)
+        assert obj == json.loads(doc)
+        assert loads(doc.encode("utf-8")) == obj
+        assert loads(dumps(obj)) == obj
+        assert dumps(obj) == json.dumps(obj)
+        assert dumps(obj, sort_keys=True) == json.dumps(obj, sort_keys=True)
+
+    assert math.isnan(loads('{"nan": NaN}')["nan"])
+    assert dumps({"b": 1, "a": "café"}) == '{"b": 1, "a": "caf\\u00e9"}'
+    assert dumps({"b": 1, "a": "x"}, sort_keys=True) == '{"a": "x", "b": 1}'
@@ -0,0 +1,209 @@
+"""
+Offline Public Suffix List (PSL) matching, for splitting hostnames in to
+subdomain, registered domain, and suffix.
+
+Uses a pinned snapshot of the list (public_suffix_list.dat, from
+https://publicsuffix.org/list/, as bundled with tldextract 3.1.2), never the
+network, so results are reproducible. The ICANN section of the list is
+compiled once in to a trie keyed by reversed hostname labels, and lookups
+give the same results as tldextract.extract() with that list and private
+domains excluded.
+"""
+
+import os
+import re
+import socket
+import hashlib
+from functools import lru_cache
+from typing import Dict, List, Tuple
+from urllib.parse import scheme_chars
+
+import idna
+
+PSL_SNAPSHOT_PATH = os.path.join(os.path.dirname(__file__), "public_suffix_list.dat")
+
+PSL_PRIVATE_SEPARATOR = "// ===BEGIN PRIVATE DOMAINS==="
+PSL_RULE_RE = re.compile(r"^(?P<suffix>[.*!]*\w[\S]*)", re.UNICODE | re.MULTILINE)
+SCHEME_RE = re.compile(r"^([" + scheme_chars + "]+:)?//")
+IP_OCTET = r"([0-9]|[1-9][0-9]|1[0-9]{2}|2[0-4][0-9]|25[0-5])"
+IP_RE = re.compile(r"^(" + IP_OCTET + r"\.){3}" + IP_OCTET + "$")
+
+
+class SuffixNode:
+    __slots__ = ("children", "suffix", "wildcard", "exception")
+
+    def __init__(self) -> None:
+        self.children: Dict[str, "SuffixNode"] = dict()
+        # this node's labels are a suffix ("co.uk")
+        self.suffix = False
+        # any single label under this node is a suffix ("*.kawasaki.jp")
+        self.wildcard = False
+        # ... but this node isn't, despite a wildcard ("!city.kawasaki.jp")
+        self.exception = False
+
+
+class PublicSuffixTrie:
+    def __init__(self, rules: List[str]):
+        self.root = SuffixNode()
+        for rule in rules:
+            exception = rule.startswith("!")
+            labels = rule.lstrip("!").split(".")
+            wildcard = labels[0] == "*"
+            if wildcard:
+                labels = labels[1:]
+            node = self.root
+            for label in reversed(labels):
+                node = node.children.setdefault(label, SuffixNode())
+            if exception:
+                node.exception = True
+            elif wildcard:
+                node.wildcard = True
+            else:
+                node.suffix = True
+
+    @classmethod
+    def from_file(cls, path: str = PSL_SNAPSHOT_PATH) -> "PublicSuffixTrie":
+        with open(path, "r", encoding="utf-8") as f:
+            text = f.read()
+        icann_text = text.partition(PSL_PRIVATE_SEPARATOR)[0]
+        return cls([m.group("suffix") for m in PSL_RULE_RE.finditer(icann_text)])
+
+    def suffix_index(self, labels: List[str]) -> int:
+        """
+        Returns the index of the first label of the longest matching public
+        suffix (lowercase, unicode labels), or len(labels) if none matches.
+        """
+        index = len(labels)
+        node = self.root
+        for i in range(len(labels) - 1, -1, -1):
+            if node.wildcard:
+                index = i
+            child = node.children.get(labels[i])
+            if child is None:
+                break
+            if child.exception:
+                index = i + 1
+            elif child.suffix:
+                index = i
+            node = child
+        return index
+
+    def extract(self, url: str) -> Tuple[str, str, str]:
+        """
+        Splits the hostname of a URL in to (subdomain, domain, suffix), like
+        tldextract. IP addresses are returned as the domain.
+        """
+        netloc = (
+            SCHEME_RE.sub("", url)
+            .partition("/")[0]
+            .partition("?")[0]
+            .partition("#")[0]
+            .split("@")[-1]
+            .partition(":")[0]
+            .strip()
+            .rstrip(".")
+        )
+        labels = netloc.split(".")
+        index = self.suffix_index([_decode_label(label) for label in labels])
+        suffix = ".".join(labels[index:])
+        if not suffix and netloc and _looks_like_ip(netloc):
+            return ("", netloc, "")
+        subdomain = ".".join(labels[: index - 1]) if index else ""
+        domain = labels[index - 1] if index else ""
+        return (subdomain, domain, suffix)
+
+
+def _decode_label(label: str) -> str:
+    lowered = label.lower()
+    if lowered.startswith("xn--"):
+        try:
+            return idna.decode(label.encode("ascii")).lower()
+        except (UnicodeError, IndexError):
+            pass
+    return lowered
+
+
+def _looks_like_ip(maybe_ip: str) -> bool:
+    if not maybe_ip[0].isdigit():
+        return False
+    try:
+        socket.inet_aton(maybe_ip)
+        return True
+    except (AttributeError, UnicodeError):
+        if IP_RE.match(maybe_ip):
+            return True
+    except OSError:
+        pass
+    return False
+
+
+@lru_cache(maxsize=None)
+def default_trie() -> PublicSuffixTrie:
+    return PublicSuffixTrie.from_file(PSL_SNAPSHOT_PATH)
+
+
+@lru_cache(maxsize=None)
+def snapshot_version() -> str:
+    """
+    Short hash of the pinned PSL snapshot file, for invalidating caches.
+    """
+    with open(PSL_SNAPSHOT_PATH, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()[:12]
+
+
+def extract(url: str) -> Tuple[str, str, str]:
+    return default_trie().extract(url)
+
+
+def test_extract():
+    assert extract("http://forums.news.cnn.com/") == ("forums.news", "cnn", "com")
+    assert extract("http://forums.bbc.co.uk/") == ("forums", "bbc", "co.uk")
+    assert extract("https://thing.core.ac.uk:8080/a?b#c") == (
+        "thing",
+        "core",
+        "ac.uk",
+    )
+    assert extract("HTTP://WWW.Example.COM.") == ("WWW", "Example", "COM")
+    assert extract("http://user:pw@example.org/") == ("", "example", "org")
+    # wildcard and exception rules
+    assert extract("http://a.b.kawasaki.jp") == ("", "a", "b.kawasaki.jp")
+    assert extract("http://a.city.kawasaki.jp") == ("a", "city", "kawasaki.jp")
+    assert extract("http://www.ck") == ("", "www", "ck")
+    assert extract("http://foo.bar.ck") == ("", "foo", "bar.ck")
+    # private domains aren't suffixes
+    assert extract("http://someone.github.io") == ("someone", "github", "io")
+    # internationalized
+    assert extract("http://xn--85x722f.xn--55qx5d.cn") == (
+        "",
+        "xn--85x722f",
+        "xn--55qx5d.cn",
+    )
+    # no suffix
+    assert extract("http://127.0.0.1:8080/") == ("", "127.0.0.1", "")
+    assert extract("http://localhost/") == ("", "localhost", "")
+    assert extract("http://nonexistent-tld.qqqq/") == ("nonexistent-tld", "qqqq", "")
+    assert extract("") == ("", "", "")
+
+
+def test_extract_matches_tldextract():
+    # tldextract using the same (bundled) list, without network access
+    import tldextract
+
+    extractor = tldextract.TLDExtract(suffix_list_urls=None, cache_dir=None)
+    urls = [
+        "http://a.b.c.kobe.jp",
+        "http://city.kobe.jp",
+        "http://www.city.kobe.jp",
+        "http://foo.nom.br",
+        "http://a.foo.nom.br",
+        "https://journals.plos.org/plosone/",
+        "http://www.scielo.org.ar",
+        "http://revistas.unal.edu.co",
+        "http://ejournal.undip.ac.id",
+        "http://1.2.3.4.5",
+        "http://999.1.1.1",
+        "http://xn--fiqs8s.xn--fiqs8s",
+        "http://Example.XN--P1AI",
+    ]
+    for url in urls:
+        assert extract(url) == tuple(extractor(url)), url
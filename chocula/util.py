@@ -1,5 +1,11 @@
+import os
+import re
 import sys
-from typing import Optional, List
+import hashlib
+from dataclasses import dataclass
+from bisect import bisect_right
+from functools import lru_cache
+from typing import Optional, List, Iterable, Sequence, Tuple, Dict, Any
 
 import ftfy
 import pycountry
@@ -125,18 +131,65 @@ OTHER_PUBLISHERS = [
 ]
 
 
+def pycountry_table(db: Any) -> Dict[str, Any]:
+    """
+    Builds a dict from lower-case strings to the entries of a pycountry
+    database (eg, pycountry.languages), giving the same results as
+    db.lookup() (which scans every entry when there is no exact match) with a
+    single dict lookup.
+
+    This replicates the lookup precedence of the pinned pycountry version:
+    first exact matches in each index (in index order), then case-insensitive
+    matches on any field of the first entry (in database order) which has one.
+    """
+    table: Dict[str, Any] = dict()
+    for entry in db:
+        for value in entry._fields.values():
+            if value is not None:
+                table.setdefault(value.lower(), entry)
+    exact: Dict[str, Any] = dict()
+    for index in db.indices.values():
+        for value, entry in index.items():
+            if isinstance(value, str) and value == value.lower():
+                exact.setdefault(value, entry)
+    table.update(exact)
+    return table
+
+
+@lru_cache(maxsize=None)
+def language_table() -> Dict[str, Any]:
+    return pycountry_table(pycountry.languages)
+
+
+@lru_cache(maxsize=None)
+def country_table() -> Dict[str, Any]:
+    return pycountry_table(pycountry.countries)
+
+
+@lru_cache(maxsize=None)
+def subdivision_table() -> Dict[str, Any]:
+    return pycountry_table(pycountry.subdivisions)
+
+
+@lru_cache(maxsize=None)
 def parse_lang(s: str) -> Optional[str]:
+    """
+    Returns a lower-case ISO 639-1 (two-letter) language code, or None.
+
+    Uses precomputed tables (see pycountry_table()), and memoizes results for
+    every distinct input, including unknown ones.
+    """
     if not s or s in ("Not applicable", "Multiple languages", "Unknown"):
         return None
     s = s.strip().split(",")[0].split()[0]
-    try:
-        lang = pycountry.languages.lookup(s)
-        if lang.alpha_3 in ("mul", "mis"):
-            return None
-        return lang.alpha_2.lower()
-    except LookupError:
+    lang = language_table().get(s.lower())
+    if lang is None:
         # print(f"unknown lang: {s}", file=sys.stderr)
         return None
+    if lang.alpha_3 in ("mul", "mis"):
+        return None
+    try:
+        return lang.alpha_2.lower()
     except AttributeError:
         print(f"partial lang for s={s}: {lang}", file=sys.stderr)
         return None
@@ -152,7 +205,13 @@ def test_parse_lang():
     assert parse_lang("Portuguese") == "pt"
 
 
+@lru_cache(maxsize=None)
 def parse_country(s: str) -> Optional[str]:
+    """
+    Returns a lower-case ISO 3166-1 (two-letter) country code, or None.
+
+    Like parse_lang(), uses precomputed tables and memoizes results.
+    """
     if not s or s in ("Unknown"):
         return None
 
@@ -181,17 +240,10 @@ def parse_country(s: str) -> Optional[str]:
         return "uk"
     s = s.replace(" (Republic)", "").replace(" (Federation)", "")
 
-    try:
-        country = pycountry.countries.lookup(s)
-    except LookupError:
-        country = None
-
+    country = country_table().get(s.lower())
     if country:
         return country.alpha_2.lower()
-    try:
-        sub = pycountry.subdivisions.lookup(s)
-    except LookupError:
-        sub = None
+    sub = subdivision_table().get(s.lower())
 
     s = s.replace(" (State)", "").replace(" (Province)", "")
     if sub:
@@ -214,6 +266,27 @@ def test_parse_country():
     assert parse_country("Japan") == "jp"
 
 
+def test_pycountry_tables():
+    # same results as the (slow) pycountry lookups, for field values of a
+    # sample of entries
+    for db, table in (
+        (pycountry.languages, language_table()),
+        (pycountry.countries, country_table()),
+        (pycountry.subdivisions, subdivision_table()),
+    ):
+        queries = {"asdf blah"}
+        for entry in list(db)[::50]:
+            for value in entry._fields.values():
+                if value is not None:
+                    queries.update((value, value.upper()))
+        for query in queries:
+            try:
+                expected = db.lookup(query)
+            except LookupError:
+                expected = None
+            assert table.get(query.lower()) is expected, query
+
+
 def parse_mimetypes(val: str) -> Optional[List[str]]:
     # XXX: multiple mimetypes?
     if not val:
@@ -236,30 +309,25 @@ def test_parse_mimetypes():
 
 
 def gaps_to_spans(first, last, gaps):
+    """
+    Converts a first and last year, and a list of missing years ("gaps"), to
+    a list of [start, end] year spans. Gaps outside of first/last are ignored.
+    """
     if not gaps:
         return [[first, last]]
     if not (last >= first and max(gaps) < last and min(gaps) > first):
         # years seem mangled? will continue though
         print("mangled years: {}".format((first, last, gaps)), file=sys.stderr)
-    full = list(range(first, last + 1))
-    for missing in gaps:
-        if missing in full:
-            full.remove(missing)
     spans = []
-    low = None
-    last = None
-    for year in full:
-        if not low:
-            low = year
-            last = year
+    start = first
+    for missing in sorted(set(gaps)):
+        if missing < first or missing > last:
             continue
-        if year != last + 1:
-            spans.append([low, last])
-            low = year
-            last = year
-        last = year
-    if low:
-        spans.append([low, last])
+        if missing > start:
+            spans.append([start, missing - 1])
+        start = missing + 1
+    if start <= last:
+        spans.append([start, last])
     return spans
 
 
@@ -272,44 +340,108 @@ def test_gaps():
         [1957, 1964],
         [1966, 1970],
     ]
+    # unsorted, duplicated, and out-of-range gaps
+    assert gaps_to_spans(1950, 1960, [1959, 1940, 1952, 1952, 1953, 1970]) == [
+        [1950, 1951],
+        [1954, 1958],
+        [1960, 1960],
+    ]
+    assert gaps_to_spans(1950, 1952, [1950, 1951, 1952]) == []
+    assert gaps_to_spans(1960, 1950, [1955]) == []
+
+
+class YearSpans:
+    """
+    A set of years, stored as sorted, non-overlapping, non-adjacent inclusive
+    [start, end] intervals; the "year_spans" stored in directory extra
+    metadata.
+
+    Spans with start after end are empty, and get dropped.
+    """
+
+    __slots__ = ("spans",)
+
+    def __init__(self, spans: Iterable[Sequence[int]] = ()):
+        self.spans: List[Tuple[int, int]] = []
+        for start, end in sorted((s[0], s[1]) for s in spans if s[0] <= s[1]):
+            if self.spans and start <= self.spans[-1][1] + 1:
+                if end > self.spans[-1][1]:
+                    self.spans[-1] = (self.spans[-1][0], end)
+            else:
+                self.spans.append((start, end))
+
+    @classmethod
+    def from_json(cls, spans: Optional[List[List[int]]]) -> "YearSpans":
+        return cls(spans or [])
+
+    def to_json(self) -> List[List[int]]:
+        return [[start, end] for start, end in self.spans]
+
+    def union(self, other: "YearSpans") -> "YearSpans":
+        return YearSpans(self.spans + other.spans)
+
+    def intersection(self, other: "YearSpans") -> "YearSpans":
+        result = YearSpans()
+        i = j = 0
+        while i < len(self.spans) and j < len(other.spans):
+            start = max(self.spans[i][0], other.spans[j][0])
+            end = min(self.spans[i][1], other.spans[j][1])
+            if start <= end:
+                result.spans.append((start, end))
+            if self.spans[i][1] < other.spans[j][1]:
+                i += 1
+            else:
+                j += 1
+        return result
+
+    def coverage(self) -> int:
+        """
+        Number of years covered.
+        """
+        return sum(end - start + 1 for start, end in self.spans)
+
+    __or__ = union
+    __and__ = intersection
+
+    def __contains__(self, year: int) -> bool:
+        # last span starting at or before the year
+        i = bisect_right(self.spans, (year + 1,)) - 1
+        return i >= 0 and year <= self.spans[i][1]
+
+    def __bool__(self) -> bool:
+        return bool(self.spans)
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, YearSpans) and self.spans == other.spans
+
+    def __repr__(self) -> str:
+        return f"YearSpans({self.to_json()})"
+
+
+def test_year_spans():
+    spans = YearSpans([[2000, 2005], [1990, 1995], [1996, 1996], [2003, 2010]])
+    assert spans.to_json() == [[1990, 1996], [2000, 2010]]
+    assert YearSpans.from_json(spans.to_json()) == spans
+    assert YearSpans.from_json(None) == YearSpans() == YearSpans([[2000, 1990]])
+    assert not YearSpans()
+    assert spans.coverage() == 7 + 11
+    assert 1990 in spans and 1996 in spans and 2000 in spans and 2010 in spans
+    assert 1997 not in spans and 1989 not in spans and 2011 not in spans
+
+    other = YearSpans([[1995, 2001], [2010, 2020]])
+    assert (spans | other).to_json() == [[1990, 2020]]
+    assert (spans & other).to_json() == [[1995, 1996], [2000, 2001], [2010, 2010]]
+    assert (spans & YearSpans()).to_json() == []
+    assert (spans & other) == (other & spans)
 
 
 def merge_spans(old, new):
+    """
+    Merges two lists of [start, end] year spans; see YearSpans.
+    """
     if not new:
         return old
-    if not old:
-        old = []
-    old.extend(new)
-    years = set()
-    for span in old:
-        for y in range(span[0], span[1] + 1):
-            years.add(y)
-    if not years:
-        return []
-    spans = []
-    start = None
-    last = None
-    todo = False
-    for y in sorted(list(years)):
-        if start == None:
-            # very first
-            start = y
-            last = y
-            todo = True
-            continue
-        if y == last + 1:
-            # span continues
-            last = y
-            todo = True
-            continue
-        # a gap just happened!
-        spans.append([start, last])
-        start = y
-        last = y
-        todo = True
-    if todo:
-        spans.append([start, last])
-    return spans
+    return YearSpans(old or []).union(YearSpans(new)).to_json()
 
 
 def test_merge_spans():
@@ -319,6 +451,36 @@ def test_merge_spans():
     assert merge_spans([], []) == []
     assert merge_spans([[9, 11]], []) == [[9, 11]]
     assert merge_spans([[2000, 2000]], [[1450, 1900]]) == [[1450, 1900], [2000, 2000]]
+    assert merge_spans([[1990, 2000]], [[2010, 2000]]) == [[1990, 2000]]
+
+
+# ASCII characters which ftfy might change: HTML entities, control characters
+# (including terminal escapes), and carriage returns
+FTFY_ASCII_TRIGGERS = re.compile(r"[&\x00-\x08\x0b-\x1f\x7f]")
+FTFY_ASCII_TRIGGERS_NO_HTML = re.compile(r"[\x00-\x08\x0b-\x1f\x7f]")
+
+
+def ftfy_needed(s: str, unescape_html: bool = True) -> bool:
+    """
+    Cheap check for whether ftfy.fix_text() could possibly change a string.
+    Plain ASCII text can't be mojibake, so this is only true for non-ASCII
+    strings, or ASCII strings with HTML entities (if unescape_html) or control
+    characters.
+    """
+    if not s.isascii():
+        return True
+    if unescape_html:
+        return FTFY_ASCII_TRIGGERS.search(s) is not None
+    return FTFY_ASCII_TRIGGERS_NO_HTML.search(s) is not None
+
+
+def test_ftfy_needed():
+    for s in ("", "plain", "tabs\tare fine", "a < b"):
+        assert not ftfy_needed(s)
+        assert ftfy.fix_text(s) == s
+    for s in ("café", "cafÃ©", "AT&amp;T", "one\rtwo", "bell\x07", "\x1b[36mcolor"):
+        assert ftfy_needed(s)
+    assert not ftfy_needed("AT&amp;T", unescape_html=False)
 
 
 def unquote(s: str) -> str:
@@ -331,6 +493,11 @@ def unquote(s: str) -> str:
     return s.strip()
 
 
+# number of distinct strings to memoize clean_str() results for; publisher
+# names in particular repeat a lot
+CLEAN_STR_CACHE_SIZE = 2 ** 16
+
+
 def clean_str(s: Optional[str]) -> Optional[str]:
     """
     Takes a generic string and "cleans" it:
@@ -343,10 +510,20 @@ def clean_str(s: Optional[str]) -> Optional[str]:
 
     This version of the function is pretty aggressive; it is intended for
     journal titles, publisher names, etc, not things like article titles.
+
+    ftfy is skipped for strings it couldn't change (see ftfy_needed()), and
+    results are memoized.
     """
     if not s:
         return None
-    s = unquote(ftfy.fix_text(s))
+    return _clean_str(s)
+
+
+@lru_cache(maxsize=CLEAN_STR_CACHE_SIZE)
+def _clean_str(s: str) -> Optional[str]:
+    if ftfy_needed(s):
+        s = ftfy.fix_text(s)
+    s = unquote(s)
     # these unicode characters are used by, eg, ISSN portal to mare prefixes as
     # non-sorting
     s.replace("\u02dc", "")
@@ -363,6 +540,9 @@ def test_clean_str():
     assert clean_str("" "") is None
     assert clean_str(" Bloody work.") == "Bloody work"
     assert clean_str('"Bloody work."') == "Bloody work"
+    assert clean_str(" AT&amp;T ") == "AT&T"
+    assert clean_str("cafÃ©") == "café"
+    assert clean_str("N/A") is None
 
 
 def clean_issn(s: str) -> Optional[str]:
@@ -380,3 +560,27 @@ def test_clean_issn():
     assert clean_issn(" 12345678") == "1234-5678"
     assert clean_issn("123445678") == None
     assert clean_issn("2249 - 8257") == "2249-8257"
+
+
+@dataclass(frozen=True)
+class FileFingerprint:
+    size: int
+    mtime_ns: int
+    # hex; None if not computed
+    sha1: Optional[str] = None
+
+
+def file_fingerprint(path: str, with_hash: bool = True) -> FileFingerprint:
+    """
+    Returns size and modification time of a file, and optionally a SHA-1 hash
+    of the full contents (which is much slower for large files).
+    """
+    stat = os.stat(path)
+    sha1: Optional[str] = None
+    if with_hash:
+        h = hashlib.sha1()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                h.update(chunk)
+        sha1 = h.hexdigest()
+    return FileFingerprint(size=stat.st_size, mtime_ns=stat.st_mtime_ns, sha1=sha1)
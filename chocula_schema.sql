@@ -82,3 +82,62 @@ CREATE TABLE IF NOT EXISTS homepage
      UNIQUE(issnl, surt)
     );
 CREATE INDEX IF NOT EXISTS homepage_url_idx ON homepage(url);
+
+-- which sources (directory slug, or 'fatcat') each homepage row came from
+CREATE TABLE IF NOT EXISTS homepage_source
+    (issnl TEXT NOT NULL,
+     surt TEXT NOT NULL,
+     slug TEXT NOT NULL,
+     PRIMARY KEY(issnl, surt, slug)
+    ) WITHOUT ROWID;
+
+-- fingerprints of the files each source was last loaded from (by
+-- 'everything'), and the resulting counts as JSON
+CREATE TABLE IF NOT EXISTS source_state
+    (slug TEXT NOT NULL,
+     path TEXT NOT NULL,
+     size INTEGER NOT NULL,
+     mtime_ns INTEGER NOT NULL,
+     hash TEXT NOT NULL,
+     counts TEXT,
+     PRIMARY KEY(slug, path)
+    );
+
+-- ISSN-Ls with directory, homepage or fatcat_container changes since the
+-- last summarize (see 'summarize --incremental')
+CREATE TABLE IF NOT EXISTS dirty_issnl
+    (issnl TEXT NOT NULL PRIMARY KEY
+    ) WITHOUT ROWID;
+
+CREATE TRIGGER IF NOT EXISTS directory_insert_dirty AFTER INSERT ON directory
+    BEGIN INSERT OR IGNORE INTO dirty_issnl VALUES (NEW.issnl); END;
+CREATE TRIGGER IF NOT EXISTS directory_update_dirty AFTER UPDATE ON directory
+    BEGIN INSERT OR IGNORE INTO dirty_issnl VALUES (OLD.issnl), (NEW.issnl); END;
+CREATE TRIGGER IF NOT EXISTS directory_delete_dirty AFTER DELETE ON directory
+    BEGIN INSERT OR IGNORE INTO dirty_issnl VALUES (OLD.issnl); END;
+
+CREATE TRIGGER IF NOT EXISTS homepage_insert_dirty AFTER INSERT ON homepage
+    BEGIN INSERT OR IGNORE INTO dirty_issnl VALUES (NEW.issnl); END;
+CREATE TRIGGER IF NOT EXISTS homepage_update_dirty AFTER UPDATE ON homepage
+    BEGIN INSERT OR IGNORE INTO dirty_issnl VALUES (OLD.issnl), (NEW.issnl); END;
+CREATE TRIGGER IF NOT EXISTS homepage_delete_dirty AFTER DELETE ON homepage
+    BEGIN INSERT OR IGNORE INTO dirty_issnl VALUES (OLD.issnl); END;
+
+-- INSERT OR REPLACE doesn't fire delete triggers, so also catch the ISSN-L of
+-- any row about to be replaced
+CREATE TRIGGER IF NOT EXISTS fatcat_container_replace_dirty BEFORE INSERT ON fatcat_container
+    BEGIN
+        INSERT OR IGNORE INTO dirty_issnl
+            SELECT issnl FROM fatcat_container WHERE ident = NEW.ident AND issnl IS NOT NULL;
+    END;
+CREATE TRIGGER IF NOT EXISTS fatcat_container_insert_dirty AFTER INSERT ON fatcat_container
+    WHEN NEW.issnl IS NOT NULL
+    BEGIN INSERT OR IGNORE INTO dirty_issnl VALUES (NEW.issnl); END;
+CREATE TRIGGER IF NOT EXISTS fatcat_container_update_dirty AFTER UPDATE ON fatcat_container
+    BEGIN
+        INSERT OR IGNORE INTO dirty_issnl SELECT OLD.issnl WHERE OLD.issnl IS NOT NULL;
+        INSERT OR IGNORE INTO dirty_issnl SELECT NEW.issnl WHERE NEW.issnl IS NOT NULL;
+    END;
+CREATE TRIGGER IF NOT EXISTS fatcat_container_delete_dirty AFTER DELETE ON fatcat_container
+    WHEN OLD.issnl IS NOT NULL
+    BEGIN INSERT OR IGNORE INTO dirty_issnl VALUES (OLD.issnl); END;
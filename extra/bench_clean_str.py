@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+
+"""
+Micro-benchmark for chocula.util.clean_str().
+
+Records every string passed to clean_str() while loading all the directory
+and KBART sources in tests/files (in to an in-memory database), then times
+the current clean_str() against the original version (ftfy on every call,
+no memoization) over that same sequence of inputs. Run from the repository
+root like:
+
+    PYTHONPATH=. ./extra/bench_clean_str.py
+"""
+
+import sys
+import timeit
+from typing import List, Optional
+
+import ftfy
+
+import chocula.util
+from chocula import (
+    ChoculaConfig,
+    ChoculaDatabase,
+    IssnDatabase,
+    ALL_CHOCULA_DIR_CLASSES,
+    ALL_CHOCULA_KBART_CLASSES,
+)
+from chocula.util import clean_str, unquote
+
+
+def clean_str_original(s: Optional[str]) -> Optional[str]:
+    if not s:
+        return None
+    s = unquote(ftfy.fix_text(s))
+    s.replace("\u02dc", "")
+    s.replace("\u0153", "")
+    if s.lower() in ("null", "n/a", "unknown"):
+        return None
+    return s or None
+
+
+def record_inputs() -> List[Optional[str]]:
+    inputs: List[Optional[str]] = []
+
+    def recording_clean_str(s: Optional[str]) -> Optional[str]:
+        inputs.append(s)
+        return clean_str(s)
+
+    # loader modules import clean_str by name, so patch every reference
+    patched = [
+        module
+        for name, module in list(sys.modules.items())
+        if name.startswith("chocula")
+        and getattr(module, "clean_str", None) is clean_str
+    ]
+    for module in patched:
+        setattr(module, "clean_str", recording_clean_str)
+    try:
+        config = ChoculaConfig.from_file(sources_dir="tests/files/")
+        issn_db = IssnDatabase("tests/files/ISSN-to-ISSN-L.txt")
+        db = ChoculaDatabase(":memory:", issn_db)
+        db.init_db()
+        for cls in ALL_CHOCULA_DIR_CLASSES + ALL_CHOCULA_KBART_CLASSES:
+            cls(config).index_file(db)
+    finally:
+        for module in patched:
+            setattr(module, "clean_str", clean_str)
+    return inputs
+
+
+def run() -> None:
+    inputs = record_inputs()
+    distinct = len(set(inputs))
+    print(f"{len(inputs)} clean_str() calls, {distinct} distinct inputs")
+
+    assert [clean_str(s) for s in inputs] == [clean_str_original(s) for s in inputs]
+
+    def bench(func) -> float:
+        # best of several runs, with a cold cache each time
+        best = None
+        for _ in range(5):
+            chocula.util._clean_str.cache_clear()
+            elapsed = timeit.timeit(lambda: [func(s) for s in inputs], number=1)
+            best = elapsed if best is None else min(best, elapsed)
+        assert best is not None
+        return best * 1e9 / len(inputs)
+
+    before = bench(clean_str_original)
+    after = bench(clean_str)
+    print(f"before: {before:8.0f} ns/call")
+    print(f"after:  {after:8.0f} ns/call ({before / after:.1f}x)")
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,152 @@
+import io
+import json
+import time
+import socket
+import asyncio
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import aiohttp
+
+import check_issn_urls
+from check_issn_urls import check_url, check_url_async, check_gwb_async, run_async
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+    in_flight = 0
+    max_in_flight = 0
+    lock = threading.Lock()
+
+    def log_message(self, *args):
+        pass
+
+    def respond(self, status, body, content_type="text/html; charset=utf-8"):
+        data = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        path = self.path.split("?")[0]
+        if path == "/journal":
+            self.respond(
+                200,
+                '<meta name="generator" content="Open Journal Systems 3.1">'
+                "ISSN 1234-5678",
+            )
+        elif path == "/moved":
+            self.send_response(301)
+            self.send_header("Location", "/journal")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+        elif path == "/blocked":
+            self.respond(403, "go away")
+        elif path == "/cdx/search/cdx":
+            self.respond(
+                200,
+                "org,example)/journal 20200102030405 http://example.org/journal text/html 200\n",
+                content_type="text/plain",
+            )
+        elif path == "/cdx-malformed/short":
+            self.respond(200, "garbage\n", content_type="text/plain")
+        elif path == "/cdx-malformed/timestamp":
+            self.respond(
+                200,
+                "org,example)/journal 2020-01-02 http://example.org/journal\n",
+                content_type="text/plain",
+            )
+        elif path.startswith("/slow"):
+            with self.lock:
+                StandInHandler.in_flight += 1
+                StandInHandler.max_in_flight = max(
+                    StandInHandler.max_in_flight, StandInHandler.in_flight
+                )
+            time.sleep(0.05)
+            with self.lock:
+                StandInHandler.in_flight -= 1
+            self.respond(200, "slow")
+        else:
+            self.respond(404, "not found")
+
+
+def start_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def unused_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def test_check_url_async(monkeypatch):
+    server, base = start_server()
+    monkeypatch.setattr(check_issn_urls, "CDX_API_URL", base + "/cdx/search/cdx")
+    urls = [
+        base + "/journal",
+        base + "/moved",
+        base + "/blocked",
+        base + "/missing",
+        f"http://127.0.0.1:{unused_port()}/",
+        "ftp://example.org/journal",
+        "example.org/journal",
+        "https://www.jstor.org/journal/abc",
+    ]
+
+    async def check_all():
+        async with aiohttp.ClientSession() as session:
+            return [await check_url_async(session, "1234-5678", url) for url in urls]
+
+    try:
+        expected = [check_url("1234-5678", url) for url in urls]
+        assert asyncio.run(check_all()) == expected
+    finally:
+        server.shutdown()
+    assert expected[1]["status_code"] == 301
+    assert expected[1]["terminal_url"] == base + "/journal"
+    assert expected[1]["software_platform"] == "ojs"
+    assert expected[1]["gwb_url_success_dt"] == "20200102030405"
+    assert expected[2]["blocked"] is True
+    assert expected[4]["error"] == "ConnectionError"
+
+
+def test_check_gwb_async_malformed(monkeypatch):
+    server, base = start_server()
+
+    async def check(cdx_path):
+        monkeypatch.setattr(check_issn_urls, "CDX_API_URL", base + cdx_path)
+        async with aiohttp.ClientSession() as session:
+            return await check_gwb_async(session, "http://example.org/journal")
+
+    try:
+        assert asyncio.run(check("/cdx/search/cdx")) == "20200102030405"
+        assert asyncio.run(check("/cdx-malformed/short")) is None
+        assert asyncio.run(check("/cdx-malformed/timestamp")) is None
+    finally:
+        server.shutdown()
+
+
+def test_run_async(monkeypatch):
+    server, base = start_server()
+    monkeypatch.setattr(check_issn_urls, "CDX_API_URL", base + "/cdx/search/cdx")
+    StandInHandler.max_in_flight = 0
+    lines = [f"1234-5678\t{base}/slow/{i}\n" for i in range(30)]
+    out = io.StringIO()
+    try:
+        asyncio.run(run_async(lines, out=out, concurrency=20, per_host=3))
+    finally:
+        server.shutdown()
+    records = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert sorted(r["url"] for r in records) == sorted(
+        line.split("\t")[1].strip() for line in lines
+    )
+    assert all(r["terminal_status_code"] == 200 for r in records)
+    assert 1 <= StandInHandler.max_in_flight <= 3
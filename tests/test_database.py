@@ -1,4 +1,16 @@
-from chocula.database import IssnDatabase
+import os
+import pickle
+from collections import Counter
+
+from chocula.database import (
+    ChoculaDatabase,
+    IssnDatabase,
+    DirectoryInfo,
+    HomepageUrl,
+    open_url_cache,
+    close_url_cache,
+)
+from chocula.issn_index import IssnIndex, verify_cache
 
 
 def test_issn_database():
@@ -11,3 +23,184 @@ def test_issn_database():
     # "The Lancet"
     assert issn_db.issn2issnl("0140-6736") == "0140-6736"
     assert issn_db.issn2issnl("1474-547X") == "0140-6736"
+    assert issn_db.issn2issnl("1474-547x") == "1474-547X"
+
+
+def test_issn_database_index_file(tmp_path):
+
+    issn_db = IssnDatabase(issn_issnl_file_path="tests/files/ISSN-to-ISSN-L.txt")
+    index_path = str(tmp_path / "issnl.index")
+    issn_db.issn_index.save(index_path)
+
+    mapped_db = IssnDatabase.from_index_file(index_path)
+    assert len(mapped_db.issn_index) == len(issn_db.issn_index)
+    assert mapped_db.issn2issnl("1234-5678") is None
+    assert mapped_db.issn2issnl("0140-6736") == "0140-6736"
+    assert mapped_db.issn2issnl("1474-547X") == "0140-6736"
+
+    # no mmap
+    copied_db = IssnDatabase()
+    copied_db.issn_index = IssnIndex.load(index_path, use_mmap=False)
+    assert copied_db.issn2issnl("1474-547X") == "0140-6736"
+    assert copied_db.issn2issnl("0042-465x") == "0042-465x"
+
+    # pickling (eg, to worker processes) works with and without mmap
+    for index in (mapped_db.issn_index, copied_db.issn_index):
+        unpickled = pickle.loads(pickle.dumps(index))
+        assert len(unpickled) == len(index)
+        assert unpickled.lookup("1474-547X") == "0140-6736"
+        assert unpickled.lookup("0042-465x") == "0042-465x"
+
+
+def test_issn_database_cache(tmp_path):
+
+    issn_map_path = str(tmp_path / "ISSN-to-ISSN-L.txt")
+    with open("tests/files/ISSN-to-ISSN-L.txt", "r") as src:
+        raw = src.read()
+    with open(issn_map_path, "w") as dst:
+        dst.write(raw)
+
+    cache_dir = str(tmp_path / "cache")
+
+    issn_db = IssnDatabase()
+    assert issn_db.read_issn_map_cache(issn_map_path, cache_dir) == "rebuilt"
+    assert issn_db.read_issn_map_cache(issn_map_path, cache_dir) == "hit"
+    assert issn_db.issn2issnl("1474-547X") == "0140-6736"
+    assert verify_cache(issn_map_path, cache_dir) is None
+    assert os.listdir(cache_dir) == ["ISSN-to-ISSN-L.txt.idx"]
+
+    # only mtime changed
+    os.utime(issn_map_path, ns=(0, 0))
+    assert issn_db.read_issn_map_cache(issn_map_path, cache_dir) == "rehashed"
+    assert issn_db.read_issn_map_cache(issn_map_path, cache_dir) == "hit"
+
+    # contents changed
+    with open(issn_map_path, "w") as dst:
+        dst.write(raw.replace("1474-547X\t0140-6736", "1474-547X\t1474-547X"))
+    assert verify_cache(issn_map_path, cache_dir) is not None
+    assert issn_db.read_issn_map_cache(issn_map_path, cache_dir) == "rebuilt"
+    assert issn_db.issn2issnl("1474-547X") == "1474-547X"
+    assert verify_cache(issn_map_path, cache_dir) is None
+
+
+def test_munge_issns_batch():
+
+    issn_db = IssnDatabase(issn_issnl_file_path="tests/files/ISSN-to-ISSN-L.txt")
+
+    def make_infos():
+        return [
+            DirectoryInfo(directory_slug="test", issnl="1474-547x"),
+            DirectoryInfo(directory_slug="test", raw_issn=" 1474547X"),
+            DirectoryInfo(directory_slug="test", issnl="1234-5678", issnp="0140-6736"),
+            DirectoryInfo(directory_slug="test", issne="1234-5678"),
+            DirectoryInfo(directory_slug="test", issnp="bogus"),
+            DirectoryInfo(directory_slug="test"),
+        ]
+
+    single = [issn_db.munge_issns(info) for info in make_infos()]
+    batch = issn_db.munge_issns_batch(make_infos())
+    assert batch == single
+    assert [info.issnl for info in batch] == [
+        "0140-6736",
+        "0140-6736",
+        "0140-6736",
+        None,
+        None,
+        None,
+    ]
+
+
+def test_repair_issnl(capsys):
+
+    issn_db = IssnDatabase(issn_issnl_file_path="tests/files/ISSN-to-ISSN-L.txt")
+
+    # bad check digit, substitution, transposition of "The Lancet" (electronic)
+    assert issn_db.repair_issnl("1474-5470") == "0140-6736"
+    assert issn_db.repair_issnl("1474-557X") == "0140-6736"
+    assert issn_db.repair_issnl("1447-547X") == "0140-6736"
+    # valid (or not ISSN-shaped) inputs are never "repaired"
+    assert issn_db.repair_issnl("1474-547X") is None
+    assert issn_db.repair_issnl("1234-5679") is None
+    assert issn_db.repair_issnl("bogus") is None
+
+    db = ChoculaDatabase(db_file=":memory:", issn_db=issn_db)
+    db.init_db()
+    db.db.executemany(
+        "INSERT INTO fatcat_container (ident, revision, issnl, name) VALUES (?,?,?,?)",
+        [
+            ("aaaaaaaaaaaaaaaaaaaaaaaaaa", "r1", "0140-6736", "The Lancet"),
+            ("bbbbbbbbbbbbbbbbbbbbbbbbbb", "r2", "1474-5470", "The Lancet (typo)"),
+            ("cccccccccccccccccccccccccc", "r3", "1234-5670", "Unknown"),
+        ],
+    )
+    counts = Counter()
+    statuses = db.insert_directory_batch(
+        [
+            DirectoryInfo(directory_slug="test", raw_issn="1474-5470"),
+            DirectoryInfo(directory_slug="test", raw_issn="1234-5670"),
+        ],
+        counts=counts,
+    )
+    assert statuses == ["no-match", "no-match"]
+    assert counts == Counter({"no-match-repairable": 1})
+
+    capsys.readouterr()
+    counts = db.fix_issnl()
+    assert counts["total"] == 3
+    assert counts["invalid"] == 2
+    assert counts["fixed"] == 1
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[0] == "fixed_issnl\tissnl\tfatcat_ident\tname"
+    assert lines[1:] == [
+        "\t1234-5670\tcccccccccccccccccccccccccc\tUnknown",
+        "0140-6736\t1474-5470\tbbbbbbbbbbbbbbbbbbbbbbbbbb\tThe Lancet (typo)",
+    ]
+
+
+def test_insert_directory_batch_ignored(monkeypatch):
+
+    issn_db = IssnDatabase(issn_issnl_file_path="tests/files/ISSN-to-ISSN-L.txt")
+    db = ChoculaDatabase(db_file=":memory:", issn_db=issn_db)
+    db.init_db()
+
+    def make_infos():
+        return [
+            DirectoryInfo(directory_slug="test", issnl="0140-6736"),
+            DirectoryInfo(directory_slug="test", issnl="0000-0019"),
+        ]
+
+    counts = Counter()
+    db.insert_directory_batch(make_infos()[:1], counts=counts)
+    # as if the first row had been inserted by another writer after the
+    # duplicate check
+    monkeypatch.setattr(db, "_existing_directory_keys", lambda keys, cur: set())
+    statuses = db.insert_directory_batch(make_infos(), counts=counts)
+    assert statuses == ["inserted", "inserted"]
+    assert counts == Counter({"insert-ignored": 1})
+    assert db.db.execute("SELECT COUNT(*) FROM directory").fetchone()[0] == 2
+
+
+def test_url_cache(tmp_path):
+
+    cache_path = str(tmp_path / "urls.sqlite")
+    url_cache = open_url_cache(cache_path)
+    try:
+        first = HomepageUrl.from_url("http://thing.core.ac.uk")
+        assert first is not None
+        assert HomepageUrl.from_url("mailto:bogus@example.com") is None
+        # in-memory hit gives an equal, but separate, object
+        second = HomepageUrl.from_url("http://thing.core.ac.uk")
+        assert second == first and second is not first
+        assert url_cache.counts["miss"] == 2
+    finally:
+        close_url_cache()
+
+    # results persist across runs
+    url_cache = open_url_cache(cache_path)
+    try:
+        assert HomepageUrl.from_url("http://thing.core.ac.uk") == first
+        assert HomepageUrl.from_url("mailto:bogus@example.com") is None
+        assert url_cache.counts["hit"] == 2
+        assert url_cache.counts["miss"] == 0
+    finally:
+        close_url_cache()
@@ -1,5 +1,20 @@
+import io
+import os
+import bz2
+import gzip
+import json
+import lzma
+import time
+import types
+import sqlite3
+import zipfile
+from collections import Counter
+
 import pytest
 from chocula import *
+import chocula.common
+from chocula.common import chunked, index_directories_parallel, KbartLoader
+from chocula.database import JOURNAL_INSERT_SQL
 
 
 @pytest.fixture
@@ -40,3 +55,538 @@ def test_all(config, database):
     database.summarize()
     database.export_fatcat()
     database.export_urls()
+
+
+def test_parallel_directories(config, issn_db):
+
+    serial_db = ChoculaDatabase(db_file=":memory:", issn_db=issn_db)
+    serial_db.init_db()
+    serial_counts = dict()
+    for cls in ALL_CHOCULA_DIR_CLASSES:
+        serial_counts[cls.source_slug] = cls(config).index_file(serial_db)
+
+    parallel_db = ChoculaDatabase(db_file=":memory:", issn_db=issn_db)
+    parallel_db.init_db()
+    parallel_counts = dict(
+        index_directories_parallel(ALL_CHOCULA_DIR_CLASSES, config, parallel_db, 4)
+    )
+    assert parallel_counts == serial_counts
+
+    for table in ("directory", "homepage"):
+        query = f"SELECT * FROM {table} ORDER BY issnl, rowid"
+        serial_rows = list(serial_db.db.execute(query))
+        assert serial_rows
+        assert list(parallel_db.db.execute(query)) == serial_rows
+
+
+class OneRowBatchDoajLoader(DoajLoader):
+    # many small batches, so a source is "large" without a large test file
+    def parse_batches(self, counts):
+        for chunk in chunked(self.open_file(), size=1):
+            counts["total"] += len(chunk)
+            yield [info for info in self.parse_records(chunk) if info]
+
+
+class BrokenLoader(DoajLoader):
+    def open_file(self):
+        raise ValueError("unparseable")
+
+
+def test_parallel_directories_parse_ahead(config, issn_db, monkeypatch):
+
+    # slow down the writer on the first source; every later source should be
+    # completely parsed (not waiting on the writer) by the time it is reached
+    classes = [DoajLoader] + [OneRowBatchDoajLoader] * 3
+    db = ChoculaDatabase(db_file=":memory:", issn_db=issn_db)
+    db.init_db()
+    insert_directory_batch = db.insert_directory_batch
+
+    def slow_insert_directory_batch(infos, **kwargs):
+        if infos and infos[0].directory_slug == "doaj" and not slow_insert.done:
+            slow_insert.done = True
+            time.sleep(2.0)
+        return insert_directory_batch(infos, **kwargs)
+
+    slow_insert = types.SimpleNamespace(done=False)
+    monkeypatch.setattr(db, "insert_directory_batch", slow_insert_directory_batch)
+
+    parsed_ahead = []
+    iter_spilled_batches = chocula.common._iter_spilled_batches
+
+    def checked_iter_spilled_batches(spill_path, future):
+        parsed_ahead.append(future.done())
+        return iter_spilled_batches(spill_path, future)
+
+    monkeypatch.setattr(
+        chocula.common, "_iter_spilled_batches", checked_iter_spilled_batches
+    )
+
+    results = list(index_directories_parallel(classes, config, db, len(classes)))
+    assert parsed_ahead[1:] == [True, True, True]
+    assert results[0][1]["total"] > 4
+    assert [counts["total"] for _, counts in results] == [results[0][1]["total"]] * 4
+
+
+def test_parallel_directories_worker_error(config, database):
+
+    with pytest.raises(ValueError, match="unparseable"):
+        list(
+            index_directories_parallel([DoajLoader, BrokenLoader], config, database, 2)
+        )
+
+
+def test_reindex_duplicates(config, database):
+
+    first = DoajLoader(config).index_file(database)
+    assert first["inserted"] > 5
+    second = DoajLoader(config).index_file(database)
+    assert second["inserted"] == 0
+    assert second["duplicate"] == first["inserted"] + first["duplicate"]
+    assert second["total"] == first["total"]
+
+
+def test_hathifiles_chunks(config, issn_db):
+
+    serial_db = ChoculaDatabase(db_file=":memory:", issn_db=issn_db)
+    serial_db.init_db()
+    serial_counts = KbartLoader.index_file(HathitrustLoader(config), serial_db)
+    assert serial_counts["skip-issnl"] > 0
+
+    for workers in (1, 3):
+        loader = HathitrustLoader(config)
+        # force lots of chunks
+        loader.chunk_bytes = 500
+        chunked_db = ChoculaDatabase(db_file=":memory:", issn_db=issn_db)
+        chunked_db.init_db()
+        assert loader.index_file(chunked_db, workers=workers) == serial_counts
+
+        query = "SELECT * FROM directory ORDER BY issnl, rowid"
+        serial_rows = list(serial_db.db.execute(query))
+        assert serial_rows
+        assert list(chunked_db.db.execute(query)) == serial_rows
+
+
+def test_hathifiles_chunks_year_spans(config, issn_db, tmp_path):
+
+    # "The Lancet" under both ISSNs, with an unknown (9999) year in the middle
+    years = [1900, 1901, 1950, 9999, 1990, 1991, 1995, 2000]
+    lines = []
+    for i, year in enumerate(years):
+        issn = ("0140-6736", "1474-547X")[i % 2]
+        fields = [""] * 26
+        fields[0] = f"test.{i}"
+        fields[9] = issn
+        fields[11] = "The Lancet"
+        fields[16] = str(year)
+        lines.append("\t".join(fields))
+        lines.append("\t".join([f"noissn.{i}"] + [""] * 25))
+    path = tmp_path / "hathi.tsv"
+    path.write_text("\n".join(lines) + "\n")
+
+    class TestLoader(HathitrustLoader):
+        def file_path(self) -> str:
+            return str(path)
+
+    serial_db = ChoculaDatabase(db_file=":memory:", issn_db=issn_db)
+    serial_db.init_db()
+    serial_counts = KbartLoader.index_file(TestLoader(config), serial_db)
+    assert serial_counts["skip-issnl"] == len(years)
+
+    for chunk_bytes in (10, 100, 1000):
+        loader = TestLoader(config)
+        loader.chunk_bytes = chunk_bytes
+        chunked_db = ChoculaDatabase(db_file=":memory:", issn_db=issn_db)
+        chunked_db.init_db()
+        assert loader.index_file(chunked_db) == serial_counts
+        query = "SELECT * FROM directory ORDER BY issnl, rowid"
+        assert list(chunked_db.db.execute(query)) == list(serial_db.db.execute(query))
+
+    extra = serial_db.db.execute("SELECT extra FROM directory").fetchone()[0]
+    assert '"year_spans": [[1990, 1991], [1995, 1995], [2000, 2000]]' in extra
+
+
+def test_summarize_merge(config, database):
+
+    for cls in ALL_CHOCULA_DIR_CLASSES + ALL_CHOCULA_KBART_CLASSES:
+        cls(config).index_file(database)
+    # two fatcat containers with the same ISSN-L (first one wins), and an
+    # ISSN-L only in fatcat
+    database.db.executemany(
+        "INSERT INTO fatcat_container (ident, revision, issnl, publisher, release_count) VALUES (?,?,?,?,?)",
+        [
+            ("zzzzzzzzzzzzzzzzzzzzzzzzzz", "r1", "0140-6736", "Elsevier", 100),
+            ("aaaaaaaaaaaaaaaaaaaaaaaaaa", "r2", "0140-6736", "Other", 5),
+            ("bbbbbbbbbbbbbbbbbbbbbbbbbb", "r3", "0000-0000", None, 1),
+        ],
+    )
+    database.summarize()
+
+    db = database.db
+    db.row_factory = sqlite3.Row
+    summarized = {row["issnl"]: row for row in db.execute("SELECT * FROM journal")}
+    expected_issnls = set(
+        row[0]
+        for row in db.execute(
+            "SELECT issnl FROM directory WHERE slug != 'hathitrust' UNION SELECT issnl FROM fatcat_container"
+        )
+    )
+    assert set(summarized) == expected_issnls
+    assert len(summarized) > 100
+
+    # same as summarizing each ISSN-L with separate queries
+    columns = JOURNAL_INSERT_SQL.split("(")[1].split(")")[0].split(", ")
+    for issnl, row in summarized.items():
+        expected = database.summarize_journal(
+            issnl,
+            list(db.execute("SELECT * FROM fatcat_container WHERE issnl = ?", [issnl])),
+            list(db.execute("SELECT * FROM directory WHERE issnl = ?", [issnl])),
+            list(db.execute("SELECT * FROM homepage WHERE issnl = ?", [issnl])),
+            Counter(),
+        )
+        assert tuple(row[col] for col in columns) == expected
+
+    lancet = summarized["0140-6736"]
+    assert lancet["fatcat_ident"] == "zzzzzzzzzzzzzzzzzzzzzzzzzz"
+    assert lancet["publisher"] == "Elsevier"
+    assert lancet["release_count"] == 100
+    assert summarized["0000-0000"]["release_count"] == 1
+
+    output = io.StringIO()
+    counts = database.export_fatcat(output)
+    docs = [json.loads(line) for line in output.getvalue().splitlines()]
+    assert len(docs) == counts["total"] - counts["empty-name"] - counts["short-name"]
+    assert [doc["issnl"] for doc in docs] == sorted(doc["issnl"] for doc in docs)
+    assert any(doc["extra"]["urls"] for doc in docs)
+    assert any("kbart" in doc["extra"] for doc in docs)
+
+
+def test_summarize_parallel(config, issn_db, tmp_path):
+
+    journals = []
+    for workers in (1, 3):
+        database = ChoculaDatabase(str(tmp_path / f"chocula-{workers}.sqlite"), issn_db)
+        database.init_db()
+        for cls in ALL_CHOCULA_DIR_CLASSES + ALL_CHOCULA_KBART_CLASSES:
+            cls(config).index_file(database)
+        counts = database.summarize(workers=workers)
+        journals.append(
+            (counts, list(database.db.execute("SELECT * FROM journal ORDER BY issnl")))
+        )
+        # parallel mode restores the database's journal and locking modes
+        assert database.db.execute("PRAGMA main.journal_mode").fetchone()[0] == "delete"
+        assert (
+            database.db.execute("PRAGMA main.locking_mode").fetchone()[0] == "exclusive"
+        )
+    assert len(journals[0][1]) > 100
+    assert journals[0] == journals[1]
+
+    shards = database.summarize_shards(8)
+    assert len(shards) == 8
+    total = 0
+    for where, params in shards:
+        total += database.db.execute(
+            f"SELECT COUNT(*) FROM journal WHERE {where}", params
+        ).fetchone()[0]
+    assert total == len(journals[0][1])
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_summarize_incremental(config, issn_db, tmp_path, workers):
+
+    database = ChoculaDatabase(str(tmp_path / "chocula.sqlite"), issn_db)
+    database.init_db()
+    for cls in ALL_CHOCULA_DIR_CLASSES + ALL_CHOCULA_KBART_CLASSES:
+        cls(config).index_file(database)
+    database.db.execute(
+        "INSERT INTO fatcat_container (ident, revision, issnl, release_count) VALUES (?,?,?,?)",
+        ("aaaaaaaaaaaaaaaaaaaaaaaaaa", "r1", "0140-6736", 5),
+    )
+    database.summarize(workers=workers)
+    db = database.db
+    assert db.execute("SELECT COUNT(*) FROM dirty_issnl").fetchone()[0] == 0
+
+    # an ISSN-L only in a single directory, which goes away
+    gone = db.execute(
+        "SELECT issnl FROM directory GROUP BY issnl HAVING COUNT(*) = 1 AND issnl NOT IN (SELECT issnl FROM homepage) LIMIT 1"
+    ).fetchone()[0]
+    db.execute("DELETE FROM directory WHERE issnl = ?", [gone])
+    db.execute("UPDATE homepage SET status_code = 200 WHERE rowid = 1")
+    # fatcat container moves to a different ISSN-L
+    db.execute(
+        "INSERT OR REPLACE INTO fatcat_container (ident, revision, issnl, release_count) VALUES (?,?,?,?)",
+        ("aaaaaaaaaaaaaaaaaaaaaaaaaa", "r2", "0000-0000", 7),
+    )
+    dirty = set(row[0] for row in db.execute("SELECT issnl FROM dirty_issnl"))
+    homepage_issnl = db.execute(
+        "SELECT issnl FROM homepage WHERE rowid = 1"
+    ).fetchone()[0]
+    assert dirty == {gone, homepage_issnl, "0140-6736", "0000-0000"}
+
+    counts = database.summarize(workers=workers, incremental=True)
+    assert db.execute("SELECT COUNT(*) FROM dirty_issnl").fetchone()[0] == 0
+    incremental = list(db.execute("SELECT * FROM journal ORDER BY issnl"))
+    summarized = set(row[0] for row in incremental)
+    assert gone not in summarized
+    assert counts["total"] == len(dirty & summarized)
+
+    db.execute("DELETE FROM journal")
+    database.summarize()
+    assert incremental == list(db.execute("SELECT * FROM journal ORDER BY issnl"))
+
+
+def test_replace_source(config, issn_db, database, tmp_path):
+    def load_all(database, config):
+        for cls in ALL_CHOCULA_DIR_CLASSES + ALL_CHOCULA_KBART_CLASSES:
+            loader = cls(config)
+            counts = loader.index_file(database)
+            database.record_source(loader.source_slug, loader.source_paths(), counts)
+
+    def dump(database):
+        return [
+            sorted(database.db.execute("SELECT * FROM directory")),
+            sorted(database.db.execute("SELECT issnl, surt, url FROM homepage")),
+            sorted(database.db.execute("SELECT * FROM homepage_source")),
+        ]
+
+    load_all(database, config)
+    assert not database.source_changed("doaj", DoajLoader(config).source_paths())
+    doaj_counts = database.source_counts("doaj")
+    assert doaj_counts["inserted"] > 5
+
+    # same contents, different mtime
+    doaj_path = tmp_path / "doaj.csv"
+    lines = open(config.doaj.filepath).readlines()
+    doaj_path.write_text("".join(lines))
+    config.doaj.filepath = str(doaj_path)
+    assert database.source_changed("doaj", [str(doaj_path)])
+    database.record_source("doaj", [str(doaj_path)], doaj_counts)
+    os.utime(doaj_path, (0, 0))
+    assert not database.source_changed("doaj", [str(doaj_path)])
+    assert not database.source_changed("doaj", [str(doaj_path)])
+    assert database.source_counts("doaj") == doaj_counts
+
+    # changed contents get reloaded, with rows only from the old contents gone
+    doaj_path.write_text("".join(lines[:10]))
+    assert database.source_changed("doaj", [str(doaj_path)])
+    loader = DoajLoader(config)
+    counts = loader.index_file(database, replace=True)
+    assert counts["inserted"] < doaj_counts["inserted"]
+
+    expected = ChoculaDatabase(db_file=":memory:", issn_db=issn_db)
+    expected.init_db()
+    load_all(expected, config)
+    assert dump(database) == dump(expected)
+
+
+def test_load_homepage_status(config, database, tmp_path):
+
+    DoajLoader(config).index_file(database)
+    db = database.db
+    urls = [
+        row[0] for row in db.execute("SELECT url FROM homepage ORDER BY url LIMIT 3")
+    ]
+    assert len(urls) == 3
+    status_path = tmp_path / "homepage_status.json"
+    status_path.write_text(
+        "\n".join(
+            [
+                json.dumps(dict(url=urls[0], status_code=404)),
+                "",
+                json.dumps(
+                    dict(
+                        url=urls[0],
+                        status_code=200,
+                        terminal_url=urls[0] + "index.html",
+                        terminal_status_code=200,
+                        platform_software="ojs",
+                        issnl_in_body=True,
+                        blocked=False,
+                        gwb_url_success_dt="20200102030405",
+                        gwb_terminal_url_success_dt="2020010203040x",
+                    )
+                ),
+                json.dumps(
+                    dict(
+                        url=urls[1],
+                        status_code=0,
+                        crawl_error="timeout",
+                        gwb_url_success_dt="2020010203040x",
+                        gwb_terminal_url_success_dt="2020",
+                    )
+                ),
+                json.dumps(dict(url=urls[2])),
+                json.dumps(dict(url="http://not-a-homepage.example.com/")),
+                json.dumps(dict(status_code=200)),
+                json.dumps(dict(url="", status_code=200)),
+            ]
+        )
+        + "\n"
+    )
+    config.homepage_status = types.SimpleNamespace(filepath=str(status_path))
+    counts = database.load_homepage_status(config)
+    assert counts == Counter(
+        {
+            "total": 7,
+            "updated": 3,
+            "duplicate-url": 1,
+            "no-match": 1,
+            "missing-url": 2,
+        }
+    )
+
+    db.row_factory = sqlite3.Row
+    rows = {
+        row["url"]: row
+        for row in db.execute("SELECT * FROM homepage WHERE url IN (?,?,?)", urls)
+    }
+    assert rows[urls[0]]["status_code"] == 200
+    assert rows[urls[0]]["terminal_url"] == urls[0] + "index.html"
+    assert rows[urls[0]]["platform_software"] == "ojs"
+    assert rows[urls[0]]["issnl_in_body"] == 1
+    assert rows[urls[0]]["blocked"] == 0
+    assert rows[urls[0]]["gwb_url_success_dt"] == "20200102030405"
+    # only the length of the terminal timestamp gets checked
+    assert rows[urls[0]]["gwb_terminal_url_success_dt"] == "2020010203040x"
+    assert rows[urls[1]]["status_code"] == -1
+    assert rows[urls[1]]["crawl_error"] == "timeout"
+    assert rows[urls[1]]["gwb_url_success_dt"] is None
+    assert rows[urls[1]]["gwb_terminal_url_success_dt"] is None
+    assert rows[urls[2]]["status_code"] == -1
+    assert rows[urls[2]]["crawl_error"] is None
+
+
+def test_load_fatcat_stats(config, database, tmp_path):
+
+    database.db.executemany(
+        "INSERT INTO fatcat_container (ident, revision, issnl) VALUES (?,?,?)",
+        [
+            ("aaaaaaaaaaaaaaaaaaaaaaaaaa", "r1", "0140-6736"),
+            ("bbbbbbbbbbbbbbbbbbbbbbbbbb", "r2", "0140-6736"),
+            ("cccccccccccccccccccccccccc", "r3", "0000-0000"),
+        ],
+    )
+    stats_path = tmp_path / "container_stats.json"
+    stats_path.write_text(
+        "\n".join(
+            json.dumps(row)
+            for row in [
+                dict(issnl="0140-6736", total=1, in_web=1, is_preserved=1),
+                dict(issnl="0140-6736", total=8, in_web=2, is_preserved=6),
+                dict(issnl="0000-0000", total=0, in_web=0, is_preserved=0),
+                dict(issnl="1234-5679", total=5, in_web=5, is_preserved=5),
+            ]
+        )
+        + "\n"
+    )
+    config.fatcat_stats = types.SimpleNamespace(filepath=str(stats_path))
+    counts = database.load_fatcat_stats(config)
+    assert counts == Counter(
+        {"total": 4, "duplicate-issnl": 1, "updated": 3, "no-match": 1}
+    )
+    rows = list(
+        database.db.execute(
+            "SELECT ident, release_count, ia_count, ia_frac, preserved_count, preserved_frac FROM fatcat_container ORDER BY ident"
+        )
+    )
+    assert rows == [
+        ("aaaaaaaaaaaaaaaaaaaaaaaaaa", 8, 2, 0.25, 6, 0.75),
+        ("bbbbbbbbbbbbbbbbbbbbbbbbbb", 8, 2, 0.25, 6, 0.75),
+        ("cccccccccccccccccccccccccc", 0, 0, None, 0, None),
+    ]
+
+
+def test_load_fatcat_containers_chunks(config, issn_db, tmp_path):
+
+    containers_path = tmp_path / "container_export.json"
+    containers_path.write_text(
+        "".join(
+            json.dumps(
+                dict(
+                    state="deleted" if i % 7 == 0 else "active",
+                    # some idents repeat, and later lines replace earlier ones
+                    ident=f"{i % 40:026d}",
+                    revision=f"r{i}",
+                    issnl=None if i % 5 == 0 else f"0000-{i % 30:04d}",
+                    name=f"Journal {i}",
+                    extra=dict(
+                        urls=[f"http://journal{i % 20}.example.com/", "bogus"],
+                        languages=["en"] if i % 2 else [],
+                    ),
+                )
+            )
+            + "\n"
+            for i in range(100)
+        )
+    )
+    config.fatcat_containers = types.SimpleNamespace(filepath=str(containers_path))
+
+    results = []
+    for workers, chunk_bytes in [(1, 10 ** 6), (1, 1000), (3, 1000)]:
+        database = ChoculaDatabase(db_file=":memory:", issn_db=issn_db)
+        database.init_db()
+        counts = database.load_fatcat_containers(
+            config, workers=workers, chunk_bytes=chunk_bytes
+        )
+        results.append(
+            (
+                counts,
+                list(
+                    database.db.execute("SELECT * FROM fatcat_container ORDER BY ident")
+                ),
+                list(database.db.execute("SELECT * FROM homepage ORDER BY id")),
+            )
+        )
+    assert results[0][0] == Counter(total=85, inserted=85)
+    assert len(results[0][1]) == 40
+    assert len(results[0][2]) > 10
+    assert results[0] == results[1] == results[2]
+
+
+def test_compressed_sources(config, issn_db, tmp_path):
+    def load_all(config, issn_db):
+        database = ChoculaDatabase(db_file=":memory:", issn_db=issn_db)
+        database.init_db()
+        counts = [
+            cls(config).index_file(database)
+            for cls in ALL_CHOCULA_DIR_CLASSES + ALL_CHOCULA_KBART_CLASSES
+        ]
+        hathi = HathitrustLoader(config)
+        hathi.chunk_bytes = 500
+        database.db.execute("DELETE FROM directory WHERE slug = 'hathitrust'")
+        counts.append(hathi.index_file(database, workers=2))
+        tables = [
+            sorted(database.db.execute("SELECT * FROM directory")),
+            sorted(database.db.execute("SELECT issnl, surt, url FROM homepage")),
+        ]
+        return counts, tables
+
+    expected = load_all(config, issn_db)
+
+    # every source file compressed one way or another
+    compressors = [
+        (".gz", gzip.compress),
+        (".bz2", bz2.compress),
+        (".xz", lzma.compress),
+    ]
+    for i, section in enumerate(vars(config).values()):
+        path = getattr(section, "filepath", None)
+        if not path or not os.path.exists(path):
+            continue
+        name = os.path.basename(path)
+        raw = open(path, "rb").read()
+        if i % 4 == 3:
+            archive = tmp_path / f"{name}.zip"
+            with zipfile.ZipFile(archive, "w") as zf:
+                zf.writestr(f"snapshot/{name}", raw)
+            section.filepath = f"{archive}#*/{name}"
+        else:
+            suffix, compress = compressors[i % 4]
+            (tmp_path / (name + suffix)).write_bytes(compress(raw))
+            section.filepath = str(tmp_path / (name + suffix))
+
+    assert config.issnl.filepath.startswith(str(tmp_path))
+    compressed_issn_db = IssnDatabase(
+        config.issnl.filepath, cache_dir=str(tmp_path / "cache")
+    )
+    assert len(compressed_issn_db.issn_index) == len(issn_db.issn_index)
+    assert load_all(config, compressed_issn_db) == expected